@@ -4,7 +4,7 @@ import argparse
 from tqdm.auto import tqdm
 import matplotlib.dates as mdates
 import os
-from matplotlib.widgets import Cursor
+from sms_hover import PointHover, track_fields
 
 
 def plot_snr_vs_time(file_path, azimut_range=None, elevation_range=None, idsat_list=None, max_sats=None):
@@ -68,39 +68,16 @@ def plot_snr_vs_time(file_path, azimut_range=None, elevation_range=None, idsat_l
         if df['idsat'].nunique() > 0:
             fig, ax = plt.subplots(figsize=(12, 6))
             colors = plt.cm.get_cmap('tab10', df['idsat'].nunique())
-            lines = []
+            hover = PointHover(ax)
             for i, idsat in enumerate(df['idsat'].unique()):
                 df_idsat = df[df['idsat'] == idsat]
-                line, = ax.plot(df_idsat['time_num'], df_idsat['snr'], marker='', linestyle='-', color=colors(i),
-                                label=f'IDSAT {idsat}')
-                lines.append(line)
+                ax.plot(df_idsat['time_num'], df_idsat['snr'], marker='', linestyle='-', color=colors(i),
+                        label=f'IDSAT {idsat}')
+                hover.add(df_idsat['time_num'], df_idsat['snr'], track_fields(df_idsat, idsat))
             ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
 
-            # Aggiungi il cursore
-            cursor = Cursor(ax, useblit=True, color='red', linewidth=1)
-
-            # Aggiungi l'annotazione per il tooltip
-            annot = ax.annotate("", xy=(0, 0), xytext=(20, 20), textcoords="offset points",
-                                bbox=dict(boxstyle="round", fc="w"),
-                                arrowprops=dict(arrowstyle="->"))
-            annot.set_visible(False)
-
-            def hover(event):
-                if event.inaxes == ax:
-                    for line in lines:
-                        cont, ind = line.contains(event)
-                        if cont:
-                            x, y = line.get_data()
-                            idsat = line.get_label().split(' ')[1]
-                            annot.xy = (x[ind['ind'][0]], y[ind['ind'][0]])
-                            annot.set_text(f"IDSAT: {idsat}")
-                            annot.set_visible(True)
-                            fig.canvas.draw_idle()
-                            return
-                    annot.set_visible(False)
-                    fig.canvas.draw_idle()
-
-            fig.canvas.mpl_connect("motion_notify_event", hover)
+            # mirino e annotazione con i dati del punto più vicino al mouse
+            hover.connect()
 
         else:
             print("Nessun dato da plottare dopo i filtri.")
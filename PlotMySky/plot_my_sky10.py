@@ -4,8 +4,14 @@ import argparse
 from tqdm.auto import tqdm
 import matplotlib.dates as mdates
 import os
-from matplotlib.widgets import Cursor
+import time
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np  # Importa numpy per gestire NaN
+from typing import NamedTuple
+
+from sms_archive import file_date, load_range, parse_time, select_files
+from sms_hover import PointHover, track_fields
+from sms_rollup import RESOLUTIONS, choose_resolution, load_rollup
 
 try:
     import matplotlib.colormaps as cm
@@ -13,24 +19,27 @@ except ImportError:
     import matplotlib.cm as cm
 
 
-def plot_snr_vs_time(file_path, azimut_range=None, elevation_range=None, idsat_list=None, max_sats=None,
-                     hours_per_plot=24, cn0_mask=None, want_max=False):  # Aggiunto cn0_mask
-    try:
-        df = pd.read_csv(file_path)
-        if df.columns[0] != 'timestamp':
-            # missing header, add a new one:
-            print("This CSV has no header, applying a new one")
-            dtypes = {'timestamp': str, 'idsat': int, 'azimuth': float, 'elevation': float, 'cn0': float,
-                      's4c': float, 'time_num': float}
-            cols = list(dtypes.keys())
-            df = pd.read_csv(file_path, header=None, names=cols, dtype=dtypes)
-
-    except FileNotFoundError:
-        print(f"Errore: File '{file_path}' non trovato.")
-        return
+def load_and_filter(paths, base_filename, azimut_range=None, elevation_range=None, idsat_list=None, max_sats=None,
+                    cn0_mask=None, start=None, end=None, usecols=None, resolution='minute'):
+    """
+    Legge i file una sola volta, applica i filtri e prepara le colonne per il plot.
 
-    if df['time_num'].isna().any() is not None:
-        df['timestamp'] = pd.to_datetime(df['timestamp'], format='%y%m%d%H%M')
+    Con resolution 'hour' o 'day' vengono letti i riepiloghi di sms_rollup invece
+    delle righe al minuto: cn0 è il valore medio e s4c il massimo dell'intervallo.
+
+    Restituisce il DataFrame filtrato e ordinato per tempo, condiviso da tutti i
+    tipi di grafico, oppure None se un file non esiste o non restano dati. Il
+    file <base>_filtered.csv contiene le sole colonne lette (usecols) e time_num.
+    """
+    try:
+        if resolution == 'minute':
+            # usa l'archivio Parquet se esiste ed è aggiornato, altrimenti legge i CSV a blocchi
+            df = load_range(paths, start, end, usecols)
+        else:
+            df = load_rollup(paths, resolution, start, end).rename(columns={'cn0_mean': 'cn0', 's4c_max': 's4c'})
+    except FileNotFoundError as e:
+        print(f"Errore: File '{e.filename}' non trovato.")
+        return None
 
     print("Inizio filtraggio dati:")
 
@@ -58,284 +67,362 @@ def plot_snr_vs_time(file_path, azimut_range=None, elevation_range=None, idsat_l
         df = df[df['cn0'] > cn0_mask]
         print(f"Filtrato CN0: rimosse {initial_rows - len(df)} righe con CN0 <= {cn0_mask}.")
 
-    # 4. Prepara i dati per il plot e salva il file CSV filtrato
-    if 'timestamp' in df.columns:
-        df['timestamp'] = pd.to_datetime(df['timestamp']).dt.tz_localize(None)
-        df = df.sort_values('timestamp')
-        df = df.reset_index(drop=True)
-        df['time_num'] = mdates.date2num(df['timestamp'])
-
-        base_filename = os.path.splitext(os.path.basename(file_path))[0]
-        output_filename = f"{base_filename}_filtered.csv"
-        df.to_csv(output_filename, index=False)
-        print(f"File filtrato salvato come: {output_filename}")
-
-        start_time = df['timestamp'].min()
-        end_time = df['timestamp'].max()
-
-        total_hours = (end_time - start_time).total_seconds() / 3600
-        num_plots = int(total_hours / hours_per_plot)
-        if total_hours % hours_per_plot != 0:
-            num_plots += 1
-
-        print(
-            f"I dati coprono {total_hours:.2f} ore. Verranno generati {num_plots} grafici da {hours_per_plot} ore ciascuno.")
-
-        for i in range(num_plots):
-            plot_start_time = start_time + pd.Timedelta(hours=i * hours_per_plot)
-            plot_end_time = plot_start_time + pd.Timedelta(hours=hours_per_plot)
-
-            df_plot = df[(df['timestamp'] >= plot_start_time) & (df['timestamp'] < plot_end_time)].copy()
-
-            if df_plot['idsat'].nunique() > 0:
-                fig, ax = plt.subplots(figsize=(12, 6))
-
-                unique_idsats = df_plot['idsat'].unique()
-                num_unique_idsats = len(unique_idsats)
-
-                cmap = plt.colormaps.get_cmap('hsv')
-                colors = [cmap(j / num_unique_idsats) for j in range(num_unique_idsats)]
-
-                lines = []
-                for j, idsat in enumerate(unique_idsats):
-                    df_idsat = df_plot[df_plot['idsat'] == idsat]
-                    line, = ax.plot(df_idsat['time_num'], df_idsat['cn0'], marker='', linestyle='-', color=colors[j],
-                                    label=f'IDSAT {idsat}')
-                    lines.append(line)
-
-                ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
-
-                # NUOVA FUNZIONALITÀ: Linea nera tratteggiata per i massimi CN0
-                # Raggruppa per time_num e trova il CN0 massimo per ogni punto temporale
-                if want_max:
-                    max_cn0_per_time = df_plot.groupby('time_num')['cn0'].max().reset_index()
-                    ax.plot(max_cn0_per_time['time_num'], max_cn0_per_time['cn0'],
-                            color='black', linestyle='--', label='Max CN0')
-                    ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left')  # Aggiorna la legenda
-
-                cursor = Cursor(ax, useblit=True, color='red', linewidth=1)
-
-                annot = ax.annotate("", xy=(0, 0), xytext=(20, 20), textcoords="offset points",
-                                    bbox=dict(boxstyle="round", fc="w"),
-                                    arrowprops=dict(arrowstyle="->"))
-                annot.set_visible(False)
-
-                def hover(event):
-                    if event.inaxes == ax:
-                        for line in lines:
-                            cont, ind = line.contains(event)
-                            if cont:
-                                x, y = line.get_data()
-                                idsat = line.get_label().split(' ')[1]
-                                annot.xy = (x[ind['ind'][0]], y[ind['ind'][0]])
-                                annot.set_text(f"IDSAT: {idsat}")
-                                annot.set_visible(True)
-                                fig.canvas.draw_idle()
-                                return
-                        annot.set_visible(False)
-                        fig.canvas.draw_idle()
-
-                fig.canvas.mpl_connect("motion_notify_event", hover)
-
-            else:
-                print(f"Nessun dato da plottare per l'intervallo {plot_start_time} - {plot_end_time} dopo i filtri.")
-                plt.close(fig)
-                continue
-
-            ax.set_xlabel('Orario')
-            ax.set_ylabel('cn0')
-
-            title = f'cn0 nel tempo ({plot_start_time.strftime("%Y-%m-%d %H:%M")} a {plot_end_time.strftime("%Y-%m-%d %H:%M")})'
-            if azimut_range:
-                title += f', Azimut: {azimut_range[0]}-{azimut_range[1]}'
-            if elevation_range:
-                title += f', Elevazione: {elevation_range[0]}-{elevation_range[1]}'
-            if max_sats:
-                title += f', Max Sats: {max_sats}'
-            if idsat_list:
-                title += f', IDSAT: {idsat_list}'
-            if cn0_mask is not None:
-                title += f', CN0 > {cn0_mask}'  # Aggiunto al titolo
-
-            ax.set_title(title)
-
-            locator = mdates.AutoDateLocator()
-            formatter = mdates.DateFormatter('%Y-%m-%d %H:%M:%S')
-            ax.xaxis.set_major_locator(locator)
-            ax.xaxis.set_major_formatter(formatter)
-
-            plt.xticks(rotation=45)
-            plt.grid(True)
-            plt.tight_layout()
-
-            png_filename = f"{base_filename}_part{i + 1}.png"
-            plt.savefig(png_filename)
-            print(f"Grafico salvato come: {png_filename}")
-
-            plt.close(fig)
-
-    else:
+    if 'timestamp' not in df.columns or df.empty:
         print('Nessun dato con la colonna timestamp trovato dopo i filtri')
+        return None
 
+    # 4. Prepara i dati per il plot e salva il file CSV filtrato
+    df = df.copy()
+    df['timestamp'] = pd.to_datetime(df['timestamp']).dt.tz_localize(None)
+    df = df.sort_values('timestamp')
+    df = df.reset_index(drop=True)
+    df['time_num'] = mdates.date2num(df['timestamp'])
+
+    output_filename = f"{base_filename}_filtered.csv"
+    df.to_csv(output_filename, index=False)
+    print(f"File filtrato salvato come: {output_filename}")
+
+    return df
+
+
+# larghezza in pixel dei grafici (12 pollici a 100 dpi) usata per la decimazione
+DECIMATE_WIDTH = 1200
+
+# colonne con i valori da plottare, se presenti tra quelle caricate
+VALUE_COLUMNS = ['cn0', 's4c', 'azimuth', 'elevation']
+
+
+class Window(NamedTuple):
+    """
+    Dati di una finestra temporale già suddivisi per satellite.
+
+    values contiene le colonne della finestra ordinate per satellite e tempo;
+    tracks è la lista (idsat, inizio, fine) delle porzioni contigue di ciascun
+    satellite, nell'ordine in cui compaiono nel tempo. max_time e max_values
+    sono i massimi tra i satelliti per ogni istante della finestra.
+    """
+    index: int
+    start: pd.Timestamp
+    end: pd.Timestamp
+    values: dict
+    tracks: list
+    max_time: np.ndarray
+    max_values: dict
+
+
+def partition_windows(df, window_starts):
+    """
+    Suddivide una sola volta i dati per finestra, satellite e tempo.
+
+    Un unico ordinamento stabile su (finestra, idsat, posizione nel tempo) rende
+    contigui i dati di ogni satellite in ogni finestra; i confini si trovano con
+    searchsorted e i grafici usano solo porzioni degli array, senza altri filtri.
+    I massimi per istante sono calcolati una volta su tutti i dati.
+    """
+    columns = ['time_num'] + [c for c in VALUE_COLUMNS if c in df.columns]
+    num_windows = len(window_starts) - 1
+
+    # numero della finestra di ogni riga (le righe oltre l'ultima finestra restano in fondo)
+    starts = np.array(window_starts, dtype='datetime64[ns]')
+    win = np.searchsorted(starts, df['timestamp'].to_numpy().astype('datetime64[ns]'), side='right') - 1
+    win[win < 0] = num_windows
+    idsat = df['idsat'].to_numpy().astype(np.int64)
+    order = np.lexsort((np.arange(len(df)), idsat, win))
+
+    win = win[order]
+    idsat = idsat[order]
+    values = {c: df[c].to_numpy()[order] for c in columns}
+
+    window_bounds = np.searchsorted(win, np.arange(num_windows + 1), side='left')
+    keys = win * 65536 + idsat
+    track_starts = np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+    track_ends = np.append(track_starts[1:], len(keys))
+
+    maxima = df.groupby('time_num')[[c for c in columns if c != 'time_num']].max()
+    max_time = maxima.index.to_numpy()
+    max_bounds = np.searchsorted(max_time, mdates.date2num(pd.DatetimeIndex(window_starts)), side='left')
+
+    windows = []
+    t = 0
+    for i in range(num_windows):
+        a, b = window_bounds[i], window_bounds[i + 1]
+        tracks = []
+        while t < len(track_starts) and track_starts[t] < b:
+            ta, tb = track_starts[t], track_ends[t]
+            # posizione nel tempo della prima riga, per mantenere l'ordine di comparsa
+            tracks.append((order[ta], idsat[ta], ta - a, tb - a))
+            t += 1
+        tracks = [(sat, ta, tb) for _, sat, ta, tb in sorted(tracks)]
+        ma, mb = max_bounds[i], max_bounds[i + 1]
+        windows.append(Window(i, window_starts[i], window_starts[i + 1],
+                              {c: v[a:b] for c, v in values.items()}, tracks,
+                              max_time[ma:mb], {c: maxima[c].to_numpy()[ma:mb] for c in maxima.columns}))
+    return windows
+
+
+def m4_decimate(x, y, x_range, width):
+    """
+    Indici dei punti da disegnare per ridurre una serie a circa 4 punti per pixel
+    con l'algoritmo M4.
+
+    L'intervallo x_range viene diviso in width colonne e per ognuna si tengono il
+    primo, l'ultimo, il minimo e il massimo: il grafico disegnato è uguale a quello
+    con tutti i punti, compresi i picchi di scintillazione, ma il numero di punti
+    non dipende più dalla durata della finestra. x deve essere ordinato.
+    """
+    if len(x) <= 4 * width:
+        return slice(None)
+    x0, x1 = x_range
+    column = np.clip(((x - x0) / (x1 - x0) * width).astype(np.int64), 0, width - 1)
+    starts = np.concatenate(([0], np.flatnonzero(column[1:] != column[:-1]) + 1))
+    ends = np.append(starts[1:], len(x))
+    # ordinando per (colonna, y) il minimo e il massimo sono agli estremi di ogni colonna
+    order = np.lexsort((y, column))
+    return np.unique(np.concatenate((starts, ends - 1, order[starts], order[ends - 1])))
+
+
+def plot_index(x, y, window, filters):
+    """
+    Selezione dei punti di una serie da passare a matplotlib: tutti, oppure quelli
+    scelti da M4 se è stato chiesto --decimate.
+    """
+    width = filters.get('decimate')
+    if not width:
+        return slice(None)
+    x_range = mdates.date2num(window.start), mdates.date2num(window.end)
+    return m4_decimate(np.asarray(x), np.asarray(y), x_range, width)
+
+
+def filters_title(filters, considered=""):
+    """
+    Parte del titolo che descrive i filtri applicati.
+    """
+    title = ""
+    if filters.get('azimut_range'):
+        title += f", Azimut: {filters['azimut_range'][0]}-{filters['azimut_range'][1]}"
+    if filters.get('elevation_range'):
+        title += f", Elevazione: {filters['elevation_range'][0]}-{filters['elevation_range'][1]}"
+    if filters.get('max_sats'):
+        title += f", Max Sats{considered}: {filters['max_sats']}"
+    if filters.get('idsat_list'):
+        title += f", IDSAT{considered}: {filters['idsat_list']}"
+    if filters.get('cn0_mask') is not None:
+        title += f", CN0 > {filters['cn0_mask']}"
+    if filters.get('resolution', 'minute') != 'minute':
+        title += f", Riepilogo per {'ora' if filters['resolution'] == 'hour' else 'giorno'}"
+    return title
+
+
+def finish_plot(fig, ax, title, png_filename, label):
+    ax.set_title(title)
+
+    locator = mdates.AutoDateLocator()
+    formatter = mdates.DateFormatter('%Y-%m-%d %H:%M:%S')
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(formatter)
+
+    plt.xticks(rotation=45)
+    plt.grid(True)
+    plt.tight_layout()
+
+    plt.savefig(png_filename)
+    print(f"{label} salvato come: {png_filename}")
+
+    plt.close(fig)
+
+
+def render_snr(window, base_filename, filters, interactive=True):
+    """
+    Grafico del cn0 nel tempo, una linea per satellite.
+
+    Restituisce il numero di grafici salvati; con interactive=False non vengono
+    creati il mirino e l'annotazione al passaggio del mouse.
+    """
+    plot_start_time, plot_end_time = window.start, window.end
+    if not window.tracks:
+        print(f"Nessun dato da plottare per l'intervallo {plot_start_time} - {plot_end_time} dopo i filtri.")
+        return 0
+
+    fig, ax = plt.subplots(figsize=(12, 6))
+
+    num_unique_idsats = len(window.tracks)
+
+    cmap = plt.colormaps.get_cmap('hsv')
+    colors = [cmap(j / num_unique_idsats) for j in range(num_unique_idsats)]
+
+    hover = PointHover(ax) if interactive else None
+
+    time_num = window.values['time_num']
+    cn0 = window.values['cn0']
+    for j, (idsat, a, b) in enumerate(window.tracks):
+        sel = plot_index(time_num[a:b], cn0[a:b], window, filters)
+        ax.plot(time_num[a:b][sel], cn0[a:b][sel], marker='', linestyle='-', color=colors[j],
+                label=f'IDSAT {idsat}')
+        if hover:
+            hover.add(time_num[a:b][sel], cn0[a:b][sel],
+                      track_fields({c: v[a:b][sel] for c, v in window.values.items()}, idsat))
+
+    ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
+
+    # NUOVA FUNZIONALITÀ: Linea nera tratteggiata per i massimi CN0
+    # Raggruppa per time_num e trova il CN0 massimo per ogni punto temporale
+    if filters.get('want_max'):
+        sel = plot_index(window.max_time, window.max_values['cn0'], window, filters)
+        ax.plot(window.max_time[sel], window.max_values['cn0'][sel],
+                color='black', linestyle='--', label='Max CN0')
+        ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left')  # Aggiorna la legenda
+        if hover:
+            hover.add(window.max_time[sel], window.max_values['cn0'][sel],
+                      {'Max C/N0': window.max_values['cn0'][sel]})
+
+    if hover:
+        # mirino e annotazione con i dati del punto più vicino al mouse
+        hover.connect()
+
+    ax.set_xlabel('Orario')
+    ax.set_ylabel('cn0')
+
+    title = f'cn0 nel tempo ({plot_start_time.strftime("%Y-%m-%d %H:%M")} a {plot_end_time.strftime("%Y-%m-%d %H:%M")})'
+    title += filters_title(filters)
+
+    finish_plot(fig, ax, title, f"{base_filename}_part{window.index + 1}.png", "Grafico")
+    return 1
+
+
+def render_s4c_max(window, base_filename, filters, interactive=True):
+    """
+    Grafico del valore massimo di s4c tra i satelliti per ogni istante.
+    """
+    # Il valore massimo di s4c per ogni timestamp è già calcolato in partition_windows():
+    # se ci sono più satelliti nello stesso timestamp, è il massimo tra loro.
+    plot_start_time, plot_end_time = window.start, window.end
+    if len(window.max_time) == 0:
+        print(f"Nessun dato MAX S4C da plottare per l'intervallo {plot_start_time} - {plot_end_time} dopo i filtri.")
+        return 0
+
+    fig, ax = plt.subplots(figsize=(12, 6))
+
+    # Plotta solo il valore massimo di s4c nel tempo
+    sel = plot_index(window.max_time, window.max_values['s4c'], window, filters)
+    ax.plot(window.max_time[sel], window.max_values['s4c'][sel],
+            marker='.', linestyle='-', color='blue', label='Max S4C')
+
+    ax.legend(loc='upper right')
 
-def plot_s4c_vs_time(file_path, azimut_range=None, elevation_range=None, idsat_list=None, max_sats=None,
-                     hours_per_plot=24, cn0_mask=None):  # cn0_mask applicato anche qui per coerenza nel filtro
+    if interactive:
+        # Annotazione per il hover sulla singola linea
+        hover = PointHover(ax, crosshair=False)
+        hover.add(window.max_time[sel], window.max_values['s4c'][sel], {'Max S4C': window.max_values['s4c'][sel]})
+        hover.connect()
+
+    ax.set_xlabel('Orario')
+    ax.set_ylabel('s4c (Valore Massimo)')
+
+    title = f'Valore Massimo s4c nel tempo ({plot_start_time.strftime("%Y-%m-%d %H:%M")} a {plot_end_time.strftime("%Y-%m-%d %H:%M")})'
+    title += filters_title(filters, " considerati")
 
-    try:
-        df = pd.read_csv(file_path)
-        if df.columns[0] != 'timestamp':
-            # missing header, add a new one:
-            print("This CSV has no header, applying a new one")
-            dtypes = {'timestamp': str, 'idsat': int, 'azimuth': float, 'elevation': float, 'cn0': float,
-                      's4c': float, 'time_num': float}
-            cols = list(dtypes.keys())
-            df = pd.read_csv(file_path, header=None, names=cols, dtype=dtypes)
-
-    except FileNotFoundError:
-        print(f"Errore: File '{file_path}' non trovato.")
-        return
+    finish_plot(fig, ax, title, f"{base_filename}_s4c_max_part{window.index + 1}.png", "Grafico Max S4C")
+    return 1
 
-    if df['time_num'].isna().any() is not None:
-        df['timestamp'] = pd.to_datetime(df['timestamp'], format='%y%m%d%H%M')
 
-    print("Inizio filtraggio dati per S4C:")
-    if azimut_range is not None:
-        df = df[(df['azimuth'] >= azimut_range[0]) & (df['azimuth'] <= azimut_range[1])]
-    if elevation_range is not None:
-        df = df[(df['elevation'] >= elevation_range[0]) & (df['elevation'] <= elevation_range[1])]
+# tipi di grafico disponibili: ciascuno riceve la porzione di dati di una finestra temporale
+RENDERERS = {
+    'snr': render_snr,
+    's4c_max': render_s4c_max,
+}
+
+# colonne lette dai file per ciascun tipo di grafico, oltre a timestamp e idsat
+RENDERER_COLUMNS = {
+    'snr': ['cn0'],
+    's4c_max': ['s4c'],
+}
+
+
+def output_basename(source, paths):
+    """
+    Nome base dei file prodotti: quello del file se è uno solo, altrimenti il primo
+    file seguito dalla data dell'ultimo (es. gps_BENDER_171123-241123).
+    """
+    base_filename = os.path.splitext(os.path.basename(paths[0] if paths else source))[0]
+    if len(paths) > 1:
+        last_date = file_date(paths[-1])
+        last = last_date.strftime('%d%m%y') if last_date else os.path.splitext(os.path.basename(paths[-1]))[0]
+        base_filename += f"-{last}"
+    return base_filename
+
+
+def render_window(renderers, window, base_filename, filters, interactive):
+    """
+    Disegna una finestra temporale con tutti i renderer; restituisce il numero di grafici salvati.
+    """
+    saved = 0
+    for render in renderers:
+        saved += render(window, base_filename, filters, interactive)
+    return saved
+
+
+def use_agg():
+    # nei processi di lavoro e in modalità batch non serve una finestra grafica
+    plt.switch_backend('Agg')
+
+
+def plot_windows(df, base_filename, renderers, hours_per_plot=24, filters=None, jobs=None):
+    """
+    Divide i dati in finestre di hours_per_plot ore e passa ogni finestra a tutti i renderer.
+    Ogni renderer riceve una Window e restituisce il numero di grafici salvati.
+
+    Con jobs (modalità batch) si usa il backend Agg senza cursore né annotazioni e le
+    finestre vengono disegnate da jobs processi in parallelo.
+    """
+    filters = filters or {}
 
-    if max_sats:
-        sat_counts = df['idsat'].value_counts()
-        top_sats = sat_counts.nlargest(max_sats).index.tolist()
-        df = df[df['idsat'].isin(top_sats)]
-        print(f"IDSAT considerati (args.max_sats = {max_sats}): {top_sats}")
+    start_time = df['timestamp'].min()
+    end_time = df['timestamp'].max()
 
-    if idsat_list:
-        df = df[df['idsat'].isin(idsat_list)]
-        print(f"IDSAT considerati (da linea di comando): {idsat_list}")
+    total_hours = (end_time - start_time).total_seconds() / 3600
+    num_plots = int(total_hours / hours_per_plot)
+    if total_hours % hours_per_plot != 0:
+        num_plots += 1
 
-    if cn0_mask is not None:
-        initial_rows = len(df)
-        df = df[df['cn0'] > cn0_mask]
-        print(f"Filtrato CN0 anche per S4C: rimosse {initial_rows - len(df)} righe con CN0 <= {cn0_mask}.")
-
-    if 'timestamp' in df.columns and not df.empty:
-        df['timestamp'] = pd.to_datetime(df['timestamp']).dt.tz_localize(None)
-        df = df.sort_values('timestamp')
-        df = df.reset_index(drop=True)
-        df['time_num'] = mdates.date2num(df['timestamp'])
-
-        base_filename = os.path.splitext(os.path.basename(file_path))[0]
-        output_filename = f"{base_filename}_filtered_s4c_max.csv"  # Nome file filtrato specifico per S4C MAX
-        df.to_csv(output_filename, index=False)
-        print(f"File filtrato S4C salvato come: {output_filename}")
-
-        start_time = df['timestamp'].min()
-        end_time = df['timestamp'].max()
-
-        total_hours = (end_time - start_time).total_seconds() / 3600
-        num_plots = int(total_hours / hours_per_plot)
-        if total_hours % hours_per_plot != 0:
-            num_plots += 1
-
-        print(
-            f"I dati S4C coprono {total_hours:.2f} ore. Verranno generati {num_plots} grafici da {hours_per_plot} ore ciascuno.")
-
-        for i in range(num_plots):
-            plot_start_time = start_time + pd.Timedelta(hours=i * hours_per_plot)
-            plot_end_time = plot_start_time + pd.Timedelta(hours=hours_per_plot)
-
-            df_plot = df[(df['timestamp'] >= plot_start_time) & (df['timestamp'] < plot_end_time)].copy()
-
-            # Calcola il valore massimo di s4c per ogni timestamp
-            # Per il caso in cui ci sia un solo valore per timestamp, max() lo restituirà.
-            # Se ci sono più satelliti nello stesso timestamp, prenderà il massimo tra loro.
-            max_s4c_per_time = df_plot.groupby('time_num')['s4c'].max().reset_index()
-
-            if not max_s4c_per_time.empty:
-                fig, ax = plt.subplots(figsize=(12, 6))
-
-                # Plotta solo il valore massimo di s4c nel tempo
-                ax.plot(max_s4c_per_time['time_num'], max_s4c_per_time['s4c'],
-                        marker='.', linestyle='-', color='blue', label='Max S4C')
-
-                ax.legend(loc='upper right')
-
-                # Il cursore non è utile per una singola linea "Max S4C" a meno che non si voglia il valore esatto.
-                # Se lo si vuole, si può riattivare e adattare. Per ora, lo lascio commentato o gestito diversamente.
-                # cursor = Cursor(ax, useblit=True, color='red', linewidth=1)
-
-                # Annotazione per il hover sulla singola linea
-                annot = ax.annotate("", xy=(0, 0), xytext=(20, 20), textcoords="offset points",
-                                    bbox=dict(boxstyle="round", fc="w"),
-                                    arrowprops=dict(arrowstyle="->"))
-                annot.set_visible(False)
-
-                def hover_max_s4c(event):
-                    if event.inaxes == ax:
-                        # Find the nearest point on the line
-                        contains, details = ax.lines[0].contains(event)
-                        if contains:
-                            ind = details['ind'][0]
-                            x, y = ax.lines[0].get_data()
-                            timestamp_val = mdates.num2date(x[ind]).strftime('%Y-%m-%d %H:%M:%S')
-                            s4c_val = y[ind]
-                            annot.xy = (x[ind], y[ind])
-                            annot.set_text(f"Orario: {timestamp_val}\nMax S4C: {s4c_val:.2f}")
-                            annot.set_visible(True)
-                            fig.canvas.draw_idle()
-                            return
-                    annot.set_visible(False)
-                    fig.canvas.draw_idle()
-
-                fig.canvas.mpl_connect("motion_notify_event", hover_max_s4c)
-
-
-            else:
-                print(
-                    f"Nessun dato MAX S4C da plottare per l'intervallo {plot_start_time} - {plot_end_time} dopo i filtri.")
-                plt.close(fig)
-                continue
-
-            ax.set_xlabel('Orario')
-            ax.set_ylabel('s4c (Valore Massimo)')  # Etichetta aggiornata
-
-            title = f'Valore Massimo s4c nel tempo ({plot_start_time.strftime("%Y-%m-%d %H:%M")} a {plot_end_time.strftime("%Y-%m-%d %H:%M")})'  # Titolo aggiornato
-            if azimut_range:
-                title += f', Azimut: {azimut_range[0]}-{azimut_range[1]}'
-            if elevation_range:
-                title += f', Elevazione: {elevation_range[0]}-{elevation_range[1]}'
-            if max_sats:
-                title += f', Max Sats considerati: {max_sats}'
-            if idsat_list:
-                title += f', IDSAT considerati: {idsat_list}'
-            if cn0_mask is not None:
-                title += f', CN0 > {cn0_mask}'
-
-            ax.set_title(title)
-
-            locator = mdates.AutoDateLocator()
-            formatter = mdates.DateFormatter('%Y-%m-%d %H:%M:%S')
-            ax.xaxis.set_major_locator(locator)
-            ax.xaxis.set_major_formatter(formatter)
-
-            plt.xticks(rotation=45)
-            plt.grid(True)
-            plt.tight_layout()
-
-            png_filename = f"{base_filename}_s4c_max_part{i + 1}.png"  # Nome file specifico per S4C MAX
-            plt.savefig(png_filename)
-            print(f"Grafico Max S4C salvato come: {png_filename}")
-
-            plt.close(fig)
+    print(
+        f"I dati coprono {total_hours:.2f} ore. Verranno generati {num_plots} grafici da {hours_per_plot} ore "
+        f"ciascuno per {len(renderers)} tipi di grafico.")
 
+    window_starts = [start_time + pd.Timedelta(hours=i * hours_per_plot) for i in range(num_plots + 1)]
+    windows = partition_windows(df, window_starts)
+
+    interactive = jobs is None
+    if not interactive:
+        use_agg()
+
+    t0 = time.perf_counter()
+    if interactive or jobs <= 1:
+        saved = sum(render_window(renderers, window, base_filename, filters, interactive) for window in windows)
     else:
-        print('Nessun dato con la colonna timestamp trovato dopo i filtri per S4C')
+        with ProcessPoolExecutor(max_workers=jobs, initializer=use_agg) as pool:
+            futures = [pool.submit(render_window, renderers, window, base_filename, filters, False)
+                       for window in windows]
+            saved = sum(f.result() for f in futures)
+    elapsed = time.perf_counter() - t0
+
+    if not interactive:
+        print(f"Salvati {saved} grafici in {elapsed:.1f} s ({saved / max(elapsed, 1e-9):.1f} grafici/s, "
+              f"{max(jobs, 1)} processi).")
 
 
 def main():
-    parser = argparse.ArgumentParser(description='Genera un grafico dell\'SNR nel tempo da un file CSV.')
-    parser.add_argument('file_path', type=str, help='Il percorso del file CSV.')
+    parser = argparse.ArgumentParser(description='Genera un grafico dell\'SNR nel tempo da un file CSV.',
+                                     epilog='Il file <nome>_filtered.csv contiene solo le colonne lette: timestamp, '
+                                            'idsat e quelle usate dai filtri e dai grafici scelti con --plots '
+                                            '(azimuth ed elevation solo con i rispettivi filtri oppure, senza '
+                                            '--jobs, con il grafico snr, per l\'annotazione del punto).')
+    parser.add_argument('file_path', type=str,
+                        help='Il percorso del file CSV, oppure una directory o un glob (es. "gps_BENDER_*.csv") '
+                             'con i file giornalieri di una stazione.')
+    parser.add_argument('--from', dest='time_from', type=str,
+                        help='Inizio dei dati da plottare, "AAAA-MM-GG" o "AAAA-MM-GG HH:MM" (UTC).')
+    parser.add_argument('--to', dest='time_to', type=str,
+                        help='Fine dei dati da plottare (esclusa), "AAAA-MM-GG" (giorno incluso) o "AAAA-MM-GG HH:MM".')
     parser.add_argument('--azimut_min', type=float, help='Il valore minimo di azimut.')
     parser.add_argument('--azimut_max', type=float, help='Il valore massimo di azimut.')
     parser.add_argument('--elevation_min', type=float, help='Il valore minimo di elevazione.')
@@ -349,6 +436,17 @@ def main():
                         help='Valore CN0 minimo. Ignora i valori di CN0 inferiori o uguali a N.')  
     parser.add_argument('--show_max', action='store_true',
                         help='Visualizza il cn0 massimo')
+    parser.add_argument('--plots', type=str, nargs='+', choices=list(RENDERERS), default=list(RENDERERS),
+                        help=f'Tipi di grafico da generare (default: {" ".join(RENDERERS)}).')
+    parser.add_argument('--decimate', type=int, nargs='?', const=DECIMATE_WIDTH,
+                        help='Riduce ogni serie a circa 4 punti per pixel (M4) mantenendo minimi e massimi; '
+                             f'il valore è la larghezza in pixel (default: {DECIMATE_WIDTH}).')
+    parser.add_argument('--resolution', type=str, choices=['auto'] + list(RESOLUTIONS), default='minute',
+                        help='Risoluzione dei dati: al minuto oppure riepiloghi orari o giornalieri; auto sceglie la '
+                             'più grossolana che riempie ancora il grafico (default: minute).')
+    parser.add_argument('--jobs', type=int,
+                        help='Modalità batch: salva i grafici senza interfaccia (backend Agg) usando N processi '
+                             'in parallelo.')
 
     args = parser.parse_args()
 
@@ -362,9 +460,53 @@ def main():
     cn0_mask = args.mask  # Recupera il valore della maschera
     show_max = args.show_max
 
-    plot_snr_vs_time(args.file_path, azimut_range, elevation_range, idsat_list, max_sats, hours_per_plot, cn0_mask, show_max)
-    plot_s4c_vs_time(args.file_path, azimut_range, elevation_range, idsat_list, max_sats, hours_per_plot, cn0_mask)
+    start = parse_time(args.time_from) if args.time_from else None
+    end = parse_time(args.time_to, end=True) if args.time_to else None
+
+    resolution = args.resolution
+    if resolution == 'auto':
+        resolution = choose_resolution(hours_per_plot * 60, args.decimate or DECIMATE_WIDTH)
+        print(f"Risoluzione scelta: {resolution}")
+    if resolution != 'minute' and (azimut_range is not None or elevation_range is not None or cn0_mask is not None):
+        # i riepiloghi non hanno azimut ed elevazione, né il C/N0 di ogni minuto per la maschera
+        print("Con i filtri di azimut, elevazione o CN0 vengono usati i dati al minuto.")
+        resolution = 'minute'
+    if resolution != 'minute':
+        print(f"Risoluzione dei dati: {resolution} (riepiloghi di sms_rollup)")
+
+    # solo i file giornalieri che si sovrappongono all'intervallo richiesto
+    paths = select_files(args.file_path, start, end)
+    if not paths:
+        print(f"Nessun file trovato in '{args.file_path}' per l'intervallo richiesto.")
+        return
+    if len(paths) > 1:
+        print(f"File selezionati: {len(paths)} ({os.path.basename(paths[0])} ... {os.path.basename(paths[-1])})")
+    base_filename = output_basename(args.file_path, paths)
+
+    # solo le colonne usate dai filtri e dai grafici scelti
+    usecols = ['timestamp', 'idsat']
+    if azimut_range is not None:
+        usecols.append('azimuth')
+    if elevation_range is not None:
+        usecols.append('elevation')
+    if cn0_mask is not None:
+        usecols.append('cn0')
+    for name in args.plots:
+        usecols.extend(RENDERER_COLUMNS[name])
+    if args.jobs is None and 'snr' in args.plots:
+        # in modalità interattiva l'annotazione del grafico snr mostra anche azimut ed elevazione del punto
+        usecols.extend(['azimuth', 'elevation'])
+
+    df = load_and_filter(paths, base_filename, azimut_range, elevation_range, idsat_list, max_sats, cn0_mask,
+                         start, end, usecols, resolution)
+    if df is None:
+        return
+
+    filters = {'azimut_range': azimut_range, 'elevation_range': elevation_range, 'idsat_list': idsat_list,
+               'max_sats': max_sats, 'cn0_mask': cn0_mask, 'want_max': show_max, 'decimate': args.decimate,
+               'resolution': resolution}
+    plot_windows(df, base_filename, [RENDERERS[name] for name in args.plots], hours_per_plot, filters, args.jobs)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
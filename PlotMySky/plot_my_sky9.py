@@ -4,7 +4,7 @@ import argparse
 from tqdm.auto import tqdm
 import matplotlib.dates as mdates
 import os
-from matplotlib.widgets import Cursor
+from sms_hover import PointHover, track_fields
 
 try:
     import matplotlib.colormaps as cm
@@ -96,38 +96,17 @@ def plot_snr_vs_time(file_path, azimut_range=None, elevation_range=None, idsat_l
                 cmap = plt.colormaps.get_cmap('hsv')
                 colors = [cmap(j / num_unique_idsats) for j in range(num_unique_idsats)]
 
-                lines = []
+                hover = PointHover(ax)
                 for j, idsat in enumerate(unique_idsats):
                     df_idsat = df_plot[df_plot['idsat'] == idsat]
-                    line, = ax.plot(df_idsat['time_num'], df_idsat['cn0'], marker='', linestyle='-', color=colors[j],
-                                    label=f'IDSAT {idsat}')
-                    lines.append(line)
+                    ax.plot(df_idsat['time_num'], df_idsat['cn0'], marker='', linestyle='-', color=colors[j],
+                            label=f'IDSAT {idsat}')
+                    hover.add(df_idsat['time_num'], df_idsat['cn0'], track_fields(df_idsat, idsat))
 
                 ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
 
-                cursor = Cursor(ax, useblit=True, color='red', linewidth=1)
-
-                annot = ax.annotate("", xy=(0, 0), xytext=(20, 20), textcoords="offset points",
-                                    bbox=dict(boxstyle="round", fc="w"),
-                                    arrowprops=dict(arrowstyle="->"))
-                annot.set_visible(False)
-
-                def hover(event):
-                    if event.inaxes == ax:
-                        for line in lines:
-                            cont, ind = line.contains(event)
-                            if cont:
-                                x, y = line.get_data()
-                                idsat = line.get_label().split(' ')[1]
-                                annot.xy = (x[ind['ind'][0]], y[ind['ind'][0]])
-                                annot.set_text(f"IDSAT: {idsat}")
-                                annot.set_visible(True)
-                                fig.canvas.draw_idle()
-                                return
-                        annot.set_visible(False)
-                        fig.canvas.draw_idle()
-
-                fig.canvas.mpl_connect("motion_notify_event", hover)
+                # mirino e annotazione con i dati del punto più vicino al mouse
+                hover.connect()
 
             else:
                 print(f"Nessun dato da plottare per l'intervallo {plot_start_time} - {plot_end_time} dopo i filtri.")
@@ -0,0 +1,297 @@
+"""
+Archivio colonnare (Parquet) dei file CSV giornalieri di Share My Sky.
+
+Per ogni gps_<stazione>_<data>.csv viene creato accanto un file .parquet con
+colonne tipizzate e compresse: timestamp (epoch, secondi), idsat (uint8),
+azimuth, elevation, cn0 e s4c (float32). I programmi di plot usano il file
+Parquet quando esiste ed è aggiornato, evitando di rileggere il testo e di
+ricalcolare le date a ogni esecuzione.
+
+Con select_files() e iter_range() si possono leggere più giorni di una stazione
+(una directory o un glob) limitando la lettura ai file, alle colonne e alle righe
+dell'intervallo di tempo richiesto. Per i CSV l'indice temporale di sms_index
+permette di leggere solo i byte dell'intervallo.
+
+Uso come convertitore:
+    python sms_archive.py gps_BENDER_*.csv
+
+Richiede pyarrow per i file Parquet; senza, i programmi di plot continuano a
+leggere i CSV.
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import argparse
+import glob
+import io
+import os
+import re
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from sms_index import byte_range
+
+try:
+    import pyarrow  # noqa: F401
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
+COLUMNS = ['timestamp', 'idsat', 'azimuth', 'elevation', 'cn0', 's4c']
+FLOAT_COLUMNS = ['azimuth', 'elevation', 'cn0', 's4c']
+COMPRESSION = 'zstd'
+CHUNK_ROWS = 200_000
+
+# data ddmmyy nel nome dei file giornalieri gps_<stazione>_<ddmmyy>.csv
+FILE_DATE = re.compile(r'_(\d{6})\.csv$')
+
+
+def parquet_path(csv_path):
+    return Path(csv_path).with_suffix('.parquet')
+
+
+def has_header(csv_path):
+    with open(csv_path, 'r') as f:
+        return f.readline().startswith('timestamp')
+
+
+def read_csv_frame(csv_path, usecols=None, chunksize=None, offsets=None):
+    """
+    Legge un CSV della console (con o senza intestazione) con i tipi dell'archivio.
+
+    Con chunksize restituisce un iteratore di blocchi già convertiti; con offsets
+    (inizio, fine) vengono letti solo i byte indicati, fine None indica la fine del file.
+    """
+    cols = COLUMNS if usecols is None else [c for c in COLUMNS if c in usecols]
+    dtypes = {'timestamp': str, 'idsat': np.uint8, 'azimuth': np.float64, 'elevation': np.float64,
+              'cn0': np.float64, 's4c': np.float64}
+    names = COLUMNS
+    header = None
+    if has_header(csv_path):
+        if offsets is None:
+            names = None
+            header = 'infer'
+        else:
+            with open(csv_path, 'r') as f:
+                names = f.readline().strip().split(',')
+
+    source = csv_path
+    if offsets is not None:
+        start, end = offsets
+        with open(csv_path, 'rb') as f:
+            f.seek(start)
+            source = io.BytesIO(f.read() if end is None else f.read(end - start))
+    reader = pd.read_csv(source, header=header, names=names, usecols=cols, dtype={c: dtypes[c] for c in cols},
+                         chunksize=chunksize)
+
+    def convert(df):
+        if 'timestamp' in df.columns:
+            df['timestamp'] = pd.to_datetime(df['timestamp'], format='%y%m%d%H%M')
+        return df
+
+    if chunksize is None:
+        return convert(reader)
+    return (convert(chunk) for chunk in reader)
+
+
+def to_columnar(df):
+    """
+    Converte una tabella nei tipi compatti dell'archivio.
+    """
+    out = pd.DataFrame({'timestamp': df['timestamp'].astype('datetime64[s]'),
+                        'idsat': df['idsat'].astype(np.uint8)})
+    for c in FLOAT_COLUMNS:
+        out[c] = df[c].astype(np.float32)
+    return out
+
+
+def from_columnar(df):
+    """
+    Riporta le colonne float32 a float64 con gli stessi valori decimali del CSV
+    (al più due decimali), così i filtri danno gli stessi risultati.
+    """
+    for c in FLOAT_COLUMNS:
+        if c in df.columns:
+            df[c] = np.round(df[c].to_numpy(dtype=np.float64), 2)
+    if 'timestamp' in df.columns:
+        df['timestamp'] = df['timestamp'].astype('datetime64[ns]')
+    return df
+
+
+def is_current(csv_path):
+    """
+    True se esiste un file Parquet non più vecchio del CSV.
+    """
+    pq = parquet_path(csv_path)
+    return pq.exists() and pq.stat().st_mtime >= Path(csv_path).stat().st_mtime
+
+
+def convert(csv_path, force=False):
+    """
+    Crea o aggiorna il file Parquet di un CSV; restituisce il percorso o None se era già aggiornato.
+    """
+    if not HAVE_PYARROW:
+        raise RuntimeError("Per creare l'archivio Parquet installare pyarrow (pip install pyarrow)")
+    if not force and is_current(csv_path):
+        return None
+    pq = parquet_path(csv_path)
+    tmp = pq.with_suffix('.parquet.tmp')
+    to_columnar(read_csv_frame(csv_path)).to_parquet(tmp, compression=COMPRESSION, index=False)
+    os.replace(tmp, pq)
+    return pq
+
+
+def load_frame(csv_path, usecols=None):
+    """
+    Carica i dati di un CSV della console, dal file Parquet se disponibile e aggiornato.
+    """
+    if HAVE_PYARROW and is_current(csv_path):
+        cols = None if usecols is None else [c for c in COLUMNS if c in usecols]
+        return from_columnar(pd.read_parquet(parquet_path(csv_path), columns=cols))
+    return read_csv_frame(csv_path, usecols)
+
+
+def file_date(path):
+    """
+    Data (datetime a mezzanotte) nel nome di un file giornaliero, None se il nome non la contiene.
+    """
+    m = FILE_DATE.search(os.path.basename(path))
+    if m is None:
+        return None
+    try:
+        return datetime.strptime(m.group(1), '%d%m%y')
+    except ValueError:
+        return None
+
+
+def file_span(path):
+    """
+    Intervallo [inizio, fine) coperto dalle righe di un file giornaliero.
+
+    La console sceglie il file con la data RMC alla chiusura del minuto, quindi la
+    riga delle 23:59 finisce nel file del giorno successivo.
+    """
+    day = file_date(path)
+    if day is None:
+        return None
+    return day - timedelta(minutes=1), day + timedelta(days=1) - timedelta(minutes=1)
+
+
+def parse_time(text, end=False):
+    """
+    Converte una data 'AAAA-MM-GG' o 'AAAA-MM-GG HH:MM' (UTC); se manca l'ora e la data
+    è la fine dell'intervallo, viene incluso l'intero giorno.
+    """
+    t = pd.Timestamp(text)
+    if end and len(text.strip()) <= 10:
+        t += pd.Timedelta(days=1)
+    return t
+
+
+def select_files(source, start=None, end=None):
+    """
+    Elenco ordinato dei CSV gps_*.csv di una directory, di un glob o di un singolo file che
+    possono contenere dati tra start (incluso) e end (escluso).
+
+    I file senza data nel nome vengono sempre inclusi.
+    """
+    if os.path.isdir(source):
+        # solo i file giornalieri dei dati, non i CSV filtrati o il registro degli eventi
+        paths = [p for p in glob.glob(os.path.join(source, 'gps_*.csv')) if file_date(p) is not None]
+    elif glob.has_magic(source):
+        paths = glob.glob(source)
+    else:
+        return [source]
+    # non i file derivati accanto ai dati, come i riepiloghi .rollup.csv
+    paths = [p for p in paths if len(Path(p).suffixes) == 1]
+
+    selected = []
+    for path in paths:
+        span = file_span(path)
+        if span is not None:
+            if start is not None and span[1] <= start:
+                continue
+            if end is not None and span[0] >= end:
+                continue
+        selected.append(path)
+    # ordine cronologico quando i nomi hanno la data, alfabetico altrimenti
+    return sorted(selected, key=lambda p: (file_date(p) or datetime.min, p))
+
+
+def iter_range(paths, start=None, end=None, usecols=None, chunksize=CHUNK_ROWS):
+    """
+    Legge i file a blocchi restituendo solo le righe tra start (incluso) e end (escluso).
+
+    Dai file Parquet aggiornati vengono lette solo le colonne richieste e il filtro
+    sul tempo viene passato a pyarrow; dai CSV si legge a blocchi di chunksize righe,
+    così la memoria dipende dai dati selezionati e non dalla dimensione dell'archivio.
+    Se è chiesto un intervallo, l'indice temporale del CSV limita la lettura ai byte
+    che lo contengono.
+    """
+    cols = None if usecols is None else [c for c in COLUMNS if c in usecols or c == 'timestamp']
+    for path in paths:
+        if HAVE_PYARROW and is_current(path):
+            filters = []
+            if start is not None:
+                filters.append(('timestamp', '>=', pd.Timestamp(start)))
+            if end is not None:
+                filters.append(('timestamp', '<', pd.Timestamp(end)))
+            chunks = [from_columnar(pd.read_parquet(parquet_path(path), columns=cols, filters=filters or None))]
+        else:
+            offsets = byte_range(path, start, end) if start is not None or end is not None else None
+            if offsets is not None and offsets[0] >= (offsets[1] or os.path.getsize(path)):
+                continue
+            chunks = read_csv_frame(path, cols, chunksize, offsets)
+        for chunk in chunks:
+            if start is not None:
+                chunk = chunk[chunk['timestamp'] >= start]
+            if end is not None:
+                chunk = chunk[chunk['timestamp'] < end]
+            if not chunk.empty:
+                yield chunk
+
+
+def load_range(paths, start=None, end=None, usecols=None):
+    """
+    Carica in un unico DataFrame le righe tra start e end di più file.
+    """
+    chunks = list(iter_range(paths, start, end, usecols))
+    if not chunks:
+        cols = COLUMNS if usecols is None else [c for c in COLUMNS if c in usecols or c == 'timestamp']
+        return pd.DataFrame(columns=cols)
+    if len(chunks) == 1:
+        return chunks[0].reset_index(drop=True)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Crea l\'archivio Parquet dei file CSV giornalieri di Share My Sky.')
+    parser.add_argument('files', type=str, nargs='+', help='File CSV da convertire (sono ammessi i caratteri jolly).')
+    parser.add_argument('--force', action='store_true', help='Riconverte anche i file già aggiornati.')
+    args = parser.parse_args()
+
+    paths = []
+    for pattern in args.files:
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+
+    for csv_path in paths:
+        try:
+            pq = convert(csv_path, args.force)
+        except FileNotFoundError:
+            print(f"Errore: File '{csv_path}' non trovato.")
+            continue
+        if pq is None:
+            print(f"{csv_path}: già aggiornato")
+        else:
+            ratio = os.path.getsize(csv_path) / max(os.path.getsize(pq), 1)
+            print(f"{csv_path} -> {pq} ({ratio:.1f} volte più piccolo)")
+
+
+if __name__ == '__main__':
+    main()
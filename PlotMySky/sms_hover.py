@@ -0,0 +1,189 @@
+"""
+Annotazione al passaggio del mouse per i grafici di Share My Sky.
+
+Tutti i punti disegnati vengono raccolti in un unico indice ordinato per la
+coordinata x sullo schermo, ricalcolato solo quando il grafico viene ridisegnato
+(zoom, spostamento, ridimensionamento). A ogni movimento del mouse il punto più
+vicino si trova con una ricerca binaria sulla striscia di pixel attorno al
+puntatore, invece di chiamare contains() su ogni linea; poi vengono ridisegnati
+con il blitting solo il mirino e l'annotazione, non tutta la figura.
+
+Uso:
+    hover = PointHover(ax)
+    hover.add(x, y, {'PRN': idsat, 'C/N0': cn0, 'S4C': s4c})
+    hover.connect()
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import matplotlib.dates as mdates
+import numpy as np
+from matplotlib.lines import Line2D
+
+# etichette dei campi mostrati nell'annotazione per le colonne dei CSV
+FIELD_LABELS = {
+    'idsat': 'PRN',
+    'cn0': 'C/N0',
+    'snr': 'C/N0',
+    's4c': 'S4C',
+    'azimuth': 'Az',
+    'elevation': 'El',
+}
+
+# distanza massima in pixel tra puntatore e punto
+RADIUS = 10
+
+
+def track_fields(columns, idsat=None):
+    """
+    Campi da mostrare per una traccia: le colonne presenti tra quelle di FIELD_LABELS.
+
+    columns è un dizionario (o DataFrame) colonna -> valori; se idsat è indicato
+    sostituisce la colonna idsat, ad esempio per una traccia di un solo satellite.
+    """
+    fields = {}
+    if idsat is not None:
+        fields['PRN'] = idsat
+    for name, label in FIELD_LABELS.items():
+        if name in columns and label not in fields:
+            fields[label] = np.asarray(columns[name])
+    return fields
+
+
+def format_value(value):
+    if isinstance(value, (float, np.floating)):
+        return f"{value:.2f}"
+    return str(value)
+
+
+class PointHover:
+    """
+    Mirino e annotazione con i dati del punto più vicino al mouse in un grafico.
+    """
+
+    def __init__(self, ax, crosshair=True, radius=RADIUS):
+        self.ax = ax
+        self.fig = ax.figure
+        self.canvas = ax.figure.canvas
+        self.radius = radius
+        self.x = []
+        self.y = []
+        self.fields = []
+        self.background = None
+        self.order = None
+        self.xs = None
+        self.ys = None
+
+        # artisti animati: esclusi dal disegno normale e da savefig, disegnati solo con il blitting
+        self.annot = ax.annotate("", xy=(0, 0), xytext=(20, 20), textcoords="offset points",
+                                 bbox=dict(boxstyle="round", fc="w"),
+                                 arrowprops=dict(arrowstyle="->"), animated=True)
+        self.annot.set_visible(False)
+        self.artists = [self.annot]
+        if crosshair:
+            # aggiunte con add_artist per non modificare i limiti degli assi
+            self.hline = ax.add_artist(Line2D([0, 1], [0, 0], transform=ax.get_yaxis_transform(), color='red',
+                                              linewidth=1, animated=True, visible=False))
+            self.vline = ax.add_artist(Line2D([0, 0], [0, 1], transform=ax.get_xaxis_transform(), color='red',
+                                              linewidth=1, animated=True, visible=False))
+            self.artists += [self.hline, self.vline]
+        else:
+            self.hline = self.vline = None
+
+    def add(self, x, y, fields=None):
+        """
+        Aggiunge i punti di una linea; fields è un dizionario etichetta -> valori
+        (array lungo quanto x, oppure un valore unico per tutta la linea).
+        """
+        x = np.asarray(x, dtype=np.float64)
+        self.x.append(x)
+        self.y.append(np.asarray(y, dtype=np.float64))
+        self.fields.append({label: (np.asarray(v) if np.ndim(v) else v) for label, v in (fields or {}).items()})
+
+    def connect(self):
+        self.offsets = np.cumsum([0] + [len(x) for x in self.x])
+        self.all_x = np.concatenate(self.x) if self.x else np.empty(0)
+        self.all_y = np.concatenate(self.y) if self.y else np.empty(0)
+        # funzioni e non metodi: matplotlib tiene solo riferimenti deboli ai metodi
+        self.canvas.mpl_connect("draw_event", lambda event: self.on_draw(event))
+        self.canvas.mpl_connect("motion_notify_event", lambda event: self.on_move(event))
+        return self
+
+    def on_draw(self, event):
+        # dopo ogni ridisegno: nuovo sfondo per il blitting e coordinate schermo dei punti
+        if self.canvas.supports_blit:
+            self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        xy = self.ax.transData.transform(np.column_stack((self.all_x, self.all_y)))
+        valid = np.isfinite(xy).all(axis=1)
+        order = np.flatnonzero(valid)
+        order = order[np.argsort(xy[order, 0], kind='stable')]
+        self.order = order
+        self.xs = xy[order, 0]
+        self.ys = xy[order, 1]
+        self.draw_artists()
+
+    def nearest(self, ex, ey):
+        """
+        Indice (nell'insieme di tutti i punti) del punto più vicino entro radius pixel, o None.
+        """
+        if self.xs is None or not len(self.xs):
+            return None
+        a, b = np.searchsorted(self.xs, (ex - self.radius, ex + self.radius))
+        if a == b:
+            return None
+        d2 = (self.xs[a:b] - ex) ** 2 + (self.ys[a:b] - ey) ** 2
+        k = int(np.argmin(d2))
+        if d2[k] > self.radius ** 2:
+            return None
+        return self.order[a + k]
+
+    def text(self, index):
+        line = int(np.searchsorted(self.offsets, index, side='right')) - 1
+        i = index - self.offsets[line]
+        items = [(label, values[i] if np.ndim(values) else values) for label, values in self.fields[line].items()]
+        rows = [f"{label}: {format_value(value)}" for label, value in items if label == 'PRN']
+        rows.append(f"Orario: {mdates.num2date(self.all_x[index]).strftime('%Y-%m-%d %H:%M:%S')}")
+        rows += [f"{label}: {format_value(value)}" for label, value in items if label != 'PRN']
+        return "\n".join(rows)
+
+    def on_move(self, event):
+        visible = self.annot.get_visible()
+        if event.inaxes != self.ax:
+            if visible or (self.vline is not None and self.vline.get_visible()):
+                for artist in self.artists:
+                    artist.set_visible(False)
+                self.update()
+            return
+
+        if self.vline is not None:
+            self.vline.set_xdata([event.xdata, event.xdata])
+            self.hline.set_ydata([event.ydata, event.ydata])
+            self.vline.set_visible(True)
+            self.hline.set_visible(True)
+
+        index = self.nearest(event.x, event.y)
+        if index is None:
+            self.annot.set_visible(False)
+        else:
+            self.annot.xy = (self.all_x[index], self.all_y[index])
+            self.annot.set_text(self.text(index))
+            self.annot.set_visible(True)
+
+        if self.vline is not None or visible or index is not None:
+            self.update()
+
+    def draw_artists(self):
+        for artist in self.artists:
+            if artist.get_visible():
+                self.ax.draw_artist(artist)
+
+    def update(self):
+        if self.background is None:
+            # grafico non ancora disegnato
+            return
+        self.canvas.restore_region(self.background)
+        self.draw_artists()
+        self.canvas.blit(self.fig.bbox)
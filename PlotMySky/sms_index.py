@@ -0,0 +1,213 @@
+"""
+Indice temporale dei file CSV di Share My Sky.
+
+Accanto a ogni file <nome>.csv viene mantenuto un file <nome>.csv.idx che associa
+a ogni minuto (yymmddHHMM) la posizione in byte della sua prima riga. Per leggere
+un intervallo di tempo basta cercare le due posizioni nell'indice e passare a
+pandas solo i byte compresi, invece di leggere e scartare tutto il resto del file.
+
+L'indice viene creato alla prima lettura e poi solo esteso con le righe che la
+console ha aggiunto nel frattempo; se il file è stato accorciato o sostituito
+viene ricreato da capo.
+
+Formato: intestazione MAGIC, posizione fino a cui il file è indicizzato, flag,
+primi byte del file; seguono record <qq> (minuto yymmddHHMM, posizione).
+
+Uso:
+    python sms_index.py gps_BENDER_*.csv share_my_sky-BENDER.csv
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import argparse
+import glob
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b"SMSIDX1\n"
+HEADER = struct.Struct("<qq32s")
+RECORD = np.dtype([('minute', '<i8'), ('offset', '<i8')])
+BLOCK_SIZE = 8 * 1024 * 1024
+
+# flag: i minuti nel file non sono in ordine, l'indice non può essere usato
+UNSORTED = 1
+
+
+def index_path(csv_path):
+    return f"{csv_path}.idx"
+
+
+def minute_key(t):
+    """
+    Chiave dell'indice (intero yymmddHHMM) per un datetime o Timestamp.
+    """
+    return int(t.strftime('%y%m%d%H%M'))
+
+
+def scan(f, start, last_minute=-1):
+    """
+    Legge il file dalla posizione start e restituisce (record, fine, ordinato).
+
+    Per ogni blocco trova i fine riga con numpy e confronta i primi 10 byte delle
+    righe consecutive; solo le righe dove il minuto cambia vengono convertite.
+    Le righe che non iniziano con 10 cifre (intestazione) vengono ignorate.
+    """
+    records = []
+    is_sorted = True
+    f.seek(start)
+    pos = start
+    tail = b""
+    while True:
+        data = f.read(BLOCK_SIZE)
+        if not data:
+            break
+        buf = tail + data
+        base = pos - len(tail)
+        last_nl = buf.rfind(b"\n")
+        if last_nl < 0:
+            tail = buf
+            pos += len(data)
+            continue
+        arr = np.frombuffer(buf, dtype=np.uint8, count=last_nl + 1)
+        line_starts = np.concatenate(([0], np.flatnonzero(arr == 10)[:-1] + 1))
+        # scarta le righe troppo corte per contenere il minuto
+        line_starts = line_starts[line_starts + 10 <= last_nl]
+        keys = arr[line_starts[:, None] + np.arange(10)]
+        digits = ((keys >= 48) & (keys <= 57)).all(axis=1)
+        line_starts = line_starts[digits]
+        keys = keys[digits].astype(np.int64) - 48
+        minutes = keys @ (10 ** np.arange(9, -1, -1, dtype=np.int64))
+
+        changed = np.empty(len(minutes), dtype=bool)
+        if len(minutes):
+            changed[0] = minutes[0] != last_minute
+            changed[1:] = minutes[1:] != minutes[:-1]
+            if minutes[0] < last_minute or (np.diff(minutes) < 0).any():
+                is_sorted = False
+            last_minute = int(minutes[-1])
+        block = np.empty(int(changed.sum()), dtype=RECORD)
+        block['minute'] = minutes[changed]
+        block['offset'] = line_starts[changed] + base
+        records.append(block)
+
+        tail = buf[last_nl + 1:]
+        pos += len(data)
+    end = pos - len(tail)
+    if records:
+        records = np.concatenate(records)
+    else:
+        records = np.empty(0, dtype=RECORD)
+    return records, end, is_sorted
+
+
+def read_index(csv_path):
+    """
+    Restituisce (record, fine, flag, inizio del file) dal file .idx, None se manca o non è valido.
+    """
+    try:
+        with open(index_path(csv_path), "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            end, flags, head = HEADER.unpack(f.read(HEADER.size))
+            records = np.frombuffer(f.read(), dtype=RECORD)
+    except (OSError, struct.error, ValueError):
+        return None
+    return records, end, flags, head
+
+
+def write_index(csv_path, records, end, flags, head):
+    tmp = index_path(csv_path) + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(HEADER.pack(end, flags, head))
+        f.write(records.tobytes())
+    os.replace(tmp, index_path(csv_path))
+
+
+def append_index(csv_path, records, end, flags):
+    with open(index_path(csv_path), "r+b") as f:
+        f.seek(len(MAGIC))
+        f.write(struct.pack("<qq", end, flags))
+        f.seek(0, os.SEEK_END)
+        f.write(records.tobytes())
+
+
+def update_index(csv_path):
+    """
+    Crea o estende l'indice di un file CSV e restituisce (record, ordinato).
+
+    Se la directory non è scrivibile l'indice viene calcolato ma non salvato.
+    """
+    with open(csv_path, "rb") as f:
+        head = f.read(HEADER.size - 16).ljust(HEADER.size - 16, b"\0")
+        size = os.fstat(f.fileno()).st_size
+        old = read_index(csv_path)
+        if old is not None and old[3] == head and old[1] <= size:
+            records, end, flags, _ = old
+            if end == size:
+                return records, not flags & UNSORTED
+            last_minute = int(records['minute'][-1]) if len(records) else -1
+            new, end, is_sorted = scan(f, end, last_minute)
+            flags |= 0 if is_sorted else UNSORTED
+            try:
+                append_index(csv_path, new, end, flags)
+            except OSError:
+                pass
+            return np.concatenate((records, new)), not flags & UNSORTED
+
+        records, end, is_sorted = scan(f, 0)
+        flags = 0 if is_sorted else UNSORTED
+    try:
+        write_index(csv_path, records, end, flags, head)
+    except OSError:
+        pass
+    return records, is_sorted
+
+
+def byte_range(csv_path, start=None, end=None):
+    """
+    Posizioni (inizio, fine) dei byte con le righe tra start (incluso) e end (escluso);
+    fine è None se l'intervallo arriva alla fine del file. Restituisce None se il file
+    non è ordinato per tempo e va letto per intero.
+    """
+    records, is_sorted = update_index(csv_path)
+    if not is_sorted:
+        return None
+    # l'intervallo di byte può contenere qualche riga in più ai bordi, che il chiamante scarta
+    minutes = records['minute']
+    i = np.searchsorted(minutes, minute_key(start), side='left') if start is not None else 0
+    first = int(records['offset'][i]) if i < len(records) else os.path.getsize(csv_path)
+    last = None
+    if end is not None:
+        i = np.searchsorted(minutes, minute_key(end), side='right')
+        if i < len(records):
+            last = int(records['offset'][i])
+    return first, last
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Crea o aggiorna l\'indice temporale dei file CSV di Share My Sky.')
+    parser.add_argument('files', type=str, nargs='+', help='File CSV da indicizzare (sono ammessi i caratteri jolly).')
+    args = parser.parse_args()
+
+    paths = []
+    for pattern in args.files:
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+
+    for csv_path in paths:
+        try:
+            records, is_sorted = update_index(csv_path)
+        except FileNotFoundError:
+            print(f"Errore: File '{csv_path}' non trovato.")
+            continue
+        note = "" if is_sorted else " (minuti non ordinati, l'indice non verrà usato)"
+        print(f"{csv_path}: {len(records)} minuti indicizzati{note}")
+
+
+if __name__ == '__main__':
+    main()
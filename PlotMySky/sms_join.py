@@ -0,0 +1,385 @@
+"""
+Unione dei dati di più stazioni allineati sullo stesso minuto e satellite.
+
+Le stazioni marcano i dati con il minuto del ricevitore GPS, quindi le righe di
+stazioni diverse con lo stesso (minuto, PRN) descrivono lo stesso satellite
+nello stesso istante. Per ogni blocco di tempo (un giorno per default) i dati
+di tutte le stazioni vengono letti con sms_archive (Parquet o CSV, solo le
+colonne e l'intervallo richiesti) e uniti con un'unica operazione vettoriale:
+le chiavi minuto*256+PRN di tutte le stazioni vengono ordinate e rese uniche,
+poi i valori di ogni stazione vengono collocati con una ricerca binaria.
+Il risultato è una tabella larga
+
+    timestamp,idsat,cn0_<A>,cn0_<B>,...,s4c_<A>,s4c_<B>,...
+
+con un campo vuoto dove una stazione non ha visto il satellite. Se una stazione
+ha più righe con lo stesso (minuto, PRN), per esempio per file giornalieri
+copiati o scritti due volte, viene tenuta la prima letta (in ordine di file e
+di riga) e le righe scartate vengono contate e segnalate.
+
+Con --corr viene calcolata, per ogni coppia di stazioni e ogni satellite, la
+correlazione della colonna scelta (s4c per default) su finestre mobili di
+--window minuti, con ritardi da -max_lag a +max_lag minuti. Un ritardo positivo
+significa che la seconda stazione vede la stessa variazione dopo la prima.
+Le somme delle finestre si ottengono dalle somme cumulative, quindi il costo non
+dipende dalla lunghezza della finestra.
+
+La memoria usata dipende dalla lunghezza del blocco (--chunk_days) e dal numero
+di stazioni, non dalla durata totale: si possono unire decine di stazioni per
+mesi di dati.
+
+Ogni sorgente è una directory, un glob o un file di una stazione; il nome della
+stazione viene preso dai nomi gps_<stazione>_<data>.csv oppure indicato come
+NOME=sorgente.
+
+Esempio:
+    python sms_join.py /dati/BENDER /dati/LEELA --from 2024-10-01 --to 2024-10-31 --corr
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import argparse
+import os
+import re
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from sms_archive import file_span, load_range, parse_time, select_files
+
+# nome della stazione nei file giornalieri gps_<stazione>_<ddmmyy>.csv
+STATION_NAME = re.compile(r'^gps_(.+)_\d{6}\.csv$')
+
+DEFAULT_WINDOW = 60
+DEFAULT_MAX_LAG = 5
+DEFAULT_MIN_POINTS = 10
+
+
+def parse_source(text):
+    """
+    Restituisce (stazione, elenco dei file) per una sorgente 'NOME=percorso' o 'percorso'.
+    """
+    name, sep, source = text.partition('=')
+    if not sep or os.path.exists(text):
+        name, source = None, text
+    paths = select_files(source)
+    if name is None:
+        names = {m.group(1) for m in (STATION_NAME.match(os.path.basename(p)) for p in paths) if m}
+        if len(names) != 1:
+            raise ValueError(f"Impossibile ricavare il nome della stazione da '{source}': usare NOME={source}")
+        name = names.pop()
+    return name, paths
+
+
+def minute_keys(df):
+    """
+    Chiavi minuto*256+PRN di un DataFrame, con i minuti contati dall'epoch.
+    """
+    minutes = df['timestamp'].to_numpy().astype('datetime64[m]').astype(np.int64)
+    return minutes * 256 + df['idsat'].to_numpy().astype(np.int64)
+
+
+def join_stations(frames, columns):
+    """
+    Unisce i DataFrame delle stazioni sulla chiave (minuto, PRN).
+
+    Restituisce (chiavi ordinate, {colonna: matrice righe x stazioni}, duplicati)
+    con NaN dove una stazione non ha dati per la chiave. Delle righe di una
+    stazione con la stessa chiave viene tenuta la prima; duplicati contiene per
+    ogni stazione le chiavi delle righe scartate.
+    """
+    keys = [minute_keys(df) for df in frames]
+    all_keys = np.unique(np.concatenate(keys)) if keys else np.empty(0, dtype=np.int64)
+    values = {c: np.full((len(all_keys), len(frames)), np.nan) for c in columns}
+    duplicates = []
+    for i, (df, k) in enumerate(zip(frames, keys)):
+        unique, first = np.unique(k, return_index=True)
+        dropped = np.ones(len(k), dtype=bool)
+        dropped[first] = False
+        duplicates.append(k[dropped])
+        pos = np.searchsorted(all_keys, unique)
+        for c in columns:
+            values[c][pos, i] = df[c].to_numpy(dtype=np.float64)[first]
+    return all_keys, values, duplicates
+
+
+def wide_frame(keys, values, stations):
+    """
+    Tabella larga timestamp,idsat,<colonna>_<stazione>... dalle chiavi e matrici di join_stations().
+    """
+    out = {'timestamp': (keys // 256).astype('datetime64[m]').astype('datetime64[ns]'),
+           'idsat': (keys % 256).astype(np.uint8)}
+    for c, matrix in values.items():
+        for i, station in enumerate(stations):
+            out[f"{c}_{station}"] = matrix[:, i]
+    return pd.DataFrame(out)
+
+
+def time_grid(keys, matrix, first_minute, length, prns):
+    """
+    Riporta i valori su una griglia (stazioni, minuti, satelliti) a partire da first_minute.
+    """
+    grid = np.full((matrix.shape[1], length, len(prns)), np.nan)
+    t = keys // 256 - first_minute
+    p = np.searchsorted(prns, keys % 256)
+    inside = (t >= 0) & (t < length)
+    grid[:, t[inside], p[inside]] = matrix[inside].T
+    return grid
+
+
+def window_sums(a, starts, window):
+    """
+    Somme su finestre [s, s+window) per ogni inizio s, lungo l'asse dei minuti, da somme cumulative.
+    """
+    c = np.zeros((a.shape[0] + 1,) + a.shape[1:])
+    np.cumsum(a, axis=0, out=c[1:])
+    return c[starts + window] - c[starts]
+
+
+def lagged_correlation(x, y, starts, window, max_lag, min_points):
+    """
+    Correlazione tra le serie x e y (minuti x satelliti) sulle finestre che iniziano in starts,
+    per ogni ritardo da -max_lag a +max_lag: y viene confrontata con x spostata di lag minuti.
+
+    x e y devono avere max_lag minuti di margine prima del primo inizio e dopo l'ultima finestra.
+    Restituisce (r, n) con forma (ritardi, finestre, satelliti); r è NaN con meno di min_points coppie.
+    """
+    lags = range(-max_lag, max_lag + 1)
+    r = np.full((len(lags), len(starts)) + x.shape[1:], np.nan)
+    n = np.zeros(r.shape)
+    length = x.shape[0]
+    for k, lag in enumerate(lags):
+        # ys[t] = y[t + lag]
+        ys = np.full(y.shape, np.nan)
+        if lag >= 0:
+            ys[:length - lag] = y[lag:]
+        else:
+            ys[-lag:] = y[:length + lag]
+        valid = ~np.isnan(x) & ~np.isnan(ys)
+        xv = np.where(valid, x, 0.0)
+        yv = np.where(valid, ys, 0.0)
+        cnt = window_sums(valid.astype(np.float64), starts, window)
+        sx = window_sums(xv, starts, window)
+        sy = window_sums(yv, starts, window)
+        sxx = window_sums(xv * xv, starts, window)
+        syy = window_sums(yv * yv, starts, window)
+        sxy = window_sums(xv * yv, starts, window)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = sxy - sx * sy / cnt
+            var = (sxx - sx * sx / cnt) * (syy - sy * sy / cnt)
+            rk = cov / np.sqrt(var)
+        rk[(cnt < min_points) | ~(var > 0)] = np.nan
+        r[k] = np.clip(rk, -1, 1)
+        n[k] = cnt
+    return r, n
+
+
+def correlate_chunk(keys, matrix, stations, window_starts, window, max_lag, min_points):
+    """
+    Correlazioni di tutte le coppie di stazioni per le finestre che iniziano in window_starts
+    (minuti dall'epoch); restituisce un DataFrame con una riga per finestra, satellite e coppia.
+    """
+    if not len(keys) or not len(window_starts):
+        return None
+    prns = np.unique(keys % 256)
+    first = window_starts[0] - max_lag
+    length = window_starts[-1] + window + max_lag - first
+    grid = time_grid(keys, matrix, first, length, prns)
+    starts = window_starts - first
+
+    frames = []
+    for a in range(len(stations)):
+        for b in range(a + 1, len(stations)):
+            r, n = lagged_correlation(grid[a], grid[b], starts, window, max_lag, min_points)
+            r0 = r[max_lag]
+            has_value = ~np.isnan(r).all(axis=0)
+            if not has_value.any():
+                continue
+            best = np.nanargmax(np.where(np.isnan(r), -np.inf, r), axis=0)
+            w, p = np.nonzero(has_value)
+            frames.append(pd.DataFrame({
+                'timestamp': (window_starts[w]).astype('datetime64[m]').astype('datetime64[ns]'),
+                'idsat': prns[p].astype(np.uint8),
+                'station_a': stations[a],
+                'station_b': stations[b],
+                'points': n[max_lag, w, p].astype(np.int64),
+                'r0': np.round(r0[w, p], 3),
+                'lag': best[w, p] - max_lag,
+                'r_max': np.round(r[best[w, p], w, p], 3),
+            }))
+    if not frames:
+        return None
+    return pd.concat(frames, ignore_index=True)
+
+
+def select_files_in(paths, start, end):
+    """
+    File di una stazione che possono contenere dati tra start e end.
+    """
+    selected = []
+    for path in paths:
+        span = file_span(path)
+        if span is None or (span[1] > start and span[0] < end):
+            selected.append(path)
+    return selected
+
+
+def chunk_ranges(start, end, days):
+    t = start
+    step = timedelta(days=days)
+    while t < end:
+        yield t, min(t + step, end)
+        t += step
+
+
+def sources_span(paths):
+    """
+    Intervallo coperto dai file giornalieri di tutte le stazioni, dalle date nei nomi.
+    """
+    spans = [file_span(p) for p in paths]
+    spans = [s for s in spans if s is not None]
+    if not spans:
+        return None
+    return min(s[0] for s in spans), max(s[1] for s in spans)
+
+
+def write_csv(df, path, first):
+    df = df.copy()
+    df['timestamp'] = df['timestamp'].dt.strftime('%y%m%d%H%M')
+    df.to_csv(path, mode='w' if first else 'a', header=first, index=False)
+
+
+def summary(corr):
+    """
+    Riepilogo per coppia di stazioni: finestre, correlazione mediana e ritardo più frequente.
+    """
+    for (a, b), g in corr.groupby(['station_a', 'station_b'], sort=False):
+        lag = g['lag'].mode()
+        print(f"{a} - {b}: {len(g)} finestre, r mediana a ritardo 0 {g['r0'].median():.2f}, "
+              f"r massima mediana {g['r_max'].median():.2f}, ritardo più frequente "
+              f"{int(lag.iloc[0]) if len(lag) else 0} min")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Unisce i dati di più stazioni sullo stesso minuto e satellite e '
+                                                 'ne calcola le correlazioni.')
+    parser.add_argument('sources', type=str, nargs='+',
+                        help='Una sorgente per stazione: directory, glob o file, eventualmente come NOME=sorgente.')
+    parser.add_argument('--from', dest='time_from', type=str,
+                        help='Inizio dei dati, "AAAA-MM-GG" o "AAAA-MM-GG HH:MM" (UTC).')
+    parser.add_argument('--to', dest='time_to', type=str,
+                        help='Fine dei dati (esclusa), "AAAA-MM-GG" (giorno incluso) o "AAAA-MM-GG HH:MM".')
+    parser.add_argument('--columns', type=str, nargs='+', choices=['cn0', 's4c', 'azimuth', 'elevation'],
+                        default=['cn0', 's4c'], help='Colonne della tabella unita (default: cn0 s4c).')
+    parser.add_argument('--idsat', type=int, nargs='+', help='Lista di IDSAT da considerare, separati da spazi.')
+    parser.add_argument('--elevation_min', type=float, help='Elevazione minima dei dati considerati.')
+    parser.add_argument('--output', type=str, default='joined',
+                        help='Nome base dei file prodotti: <output>.csv e <output>_corr.csv (default: joined).')
+    parser.add_argument('--corr', action='store_true', help='Calcola le correlazioni tra le coppie di stazioni.')
+    parser.add_argument('--corr_column', type=str, choices=['cn0', 's4c'], default='s4c',
+                        help='Colonna da correlare (default: s4c).')
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW,
+                        help=f'Lunghezza delle finestre di correlazione in minuti (default: {DEFAULT_WINDOW}).')
+    parser.add_argument('--step', type=int, help='Passo tra le finestre in minuti (default: uguale a --window).')
+    parser.add_argument('--max_lag', type=int, default=DEFAULT_MAX_LAG,
+                        help=f'Ritardo massimo in minuti (default: {DEFAULT_MAX_LAG}).')
+    parser.add_argument('--min_points', type=int, default=DEFAULT_MIN_POINTS,
+                        help=f'Coppie di valori minime per finestra (default: {DEFAULT_MIN_POINTS}).')
+    parser.add_argument('--chunk_days', type=int, default=1,
+                        help='Giorni elaborati per volta; limita la memoria usata (default: 1).')
+    args = parser.parse_args()
+
+    stations = []
+    sources = []
+    for text in args.sources:
+        try:
+            name, paths = parse_source(text)
+        except ValueError as e:
+            print(f"Errore: {e}")
+            return
+        if not paths:
+            print(f"Nessun file trovato in '{text}'.")
+            return
+        if name in stations:
+            print(f"Errore: la stazione {name} compare due volte.")
+            return
+        stations.append(name)
+        sources.append(paths)
+    if len(stations) < 2:
+        print("Servono almeno due stazioni.")
+        return
+
+    span = sources_span([p for paths in sources for p in paths])
+    start = parse_time(args.time_from) if args.time_from else (span[0] if span else None)
+    end = parse_time(args.time_to, end=True) if args.time_to else (span[1] if span else None)
+    if start is None or end is None:
+        print("Indicare l'intervallo con --from e --to: i nomi dei file non contengono la data.")
+        return
+    start = pd.Timestamp(start).floor('min')
+
+    columns = list(dict.fromkeys(args.columns + ([args.corr_column] if args.corr else [])))
+    usecols = ['timestamp', 'idsat'] + columns + (['elevation'] if args.elevation_min is not None else [])
+    step = args.step or args.window
+    margin = timedelta(minutes=args.window + args.max_lag) if args.corr else timedelta(0)
+    first_minute = int(np.datetime64(start, 'm').astype(np.int64))
+
+    t0 = time.perf_counter()
+    rows = corr_rows = duplicate_rows = 0
+    corr_parts = []
+    for chunk_start, chunk_end in chunk_ranges(start, end, args.chunk_days):
+        # con le correlazioni il blocco viene letto con un margine, per le finestre e i ritardi a cavallo
+        lo = chunk_start - timedelta(minutes=args.max_lag) if args.corr else chunk_start
+        hi = min(chunk_end + margin, end)
+        frames = []
+        for paths in sources:
+            df = load_range(select_files_in(paths, lo, hi), lo, hi, usecols)
+            if args.idsat:
+                df = df[df['idsat'].isin(args.idsat)]
+            if args.elevation_min is not None:
+                df = df[df['elevation'] >= args.elevation_min]
+            frames.append(df)
+        keys, values, duplicates = join_stations(frames, columns)
+
+        lo_m = np.datetime64(chunk_start, 'm').astype(np.int64)
+        hi_m = np.datetime64(chunk_end, 'm').astype(np.int64)
+        inside = (keys // 256 >= lo_m) & (keys // 256 < hi_m)
+        # solo i duplicati del blocco: quelli nel margine vengono contati con il blocco successivo
+        for station, dup in zip(stations, duplicates):
+            count = int(((dup // 256 >= lo_m) & (dup // 256 < hi_m)).sum())
+            if count:
+                print(f"Attenzione: {count} righe duplicate (stesso minuto e PRN) della stazione {station} "
+                      f"ignorate, tenuta la prima")
+                duplicate_rows += count
+        wide = wide_frame(keys[inside], {c: m[inside] for c, m in values.items()}, stations)
+        write_csv(wide, f"{args.output}.csv", rows == 0)
+        rows += len(wide)
+
+        if args.corr:
+            # inizi delle finestre allineati a --from, solo quelli nel blocco
+            k0 = -(-(lo_m - first_minute) // step)
+            window_starts = first_minute + step * np.arange(k0, (hi_m - 1 - first_minute) // step + 1)
+            corr = correlate_chunk(keys, values[args.corr_column], stations, window_starts, args.window,
+                                   args.max_lag, args.min_points)
+            if corr is not None:
+                write_csv(corr, f"{args.output}_corr.csv", corr_rows == 0)
+                corr_rows += len(corr)
+                corr_parts.append(corr[['station_a', 'station_b', 'r0', 'r_max', 'lag']])
+        print(f"{chunk_start:%Y-%m-%d %H:%M}: {len(wide)} righe unite")
+
+    elapsed = time.perf_counter() - t0
+    print(f"Tabella unita: {rows} righe di {len(stations)} stazioni in {args.output}.csv ({elapsed:.1f} s)")
+    if duplicate_rows:
+        print(f"Righe duplicate ignorate: {duplicate_rows}")
+    if args.corr:
+        print(f"Correlazioni: {corr_rows} righe in {args.output}_corr.csv")
+        if corr_parts:
+            summary(pd.concat(corr_parts, ignore_index=True))
+
+
+if __name__ == '__main__':
+    main()
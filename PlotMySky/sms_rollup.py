@@ -0,0 +1,231 @@
+"""
+Riepiloghi orari e giornalieri dei file CSV di Share My Sky.
+
+Per ogni gps_<stazione>_<data>.csv viene creato accanto
+gps_<stazione>_<data>.rollup.csv con una riga per ora e satellite e una per
+giorno e satellite:
+
+    resolution,timestamp,idsat,count,cn0_mean,cn0_min,cn0_max,s4c_max,s4c_p95,minutes_above
+
+resolution è 'hour' o 'day', timestamp l'inizio dell'ora o del giorno e
+minutes_above il numero di minuti con s4c >= soglia (prima riga del file, come
+commento). Il giorno è quello del file: la console vi scrive anche la riga delle
+23:59 del giorno prima, che quindi finisce nell'ora 23 del giorno precedente;
+leggendo più file le due parti di quell'ora vengono unite (per s4c_p95 si tiene
+il valore maggiore).
+
+Il riepilogo viene ricreato solo quando il CSV è più recente, quindi dopo la
+prima volta si aggiorna solo il giorno in corso. Un anno di dati occupa qualche
+MB di riepiloghi orari e qualche centinaio di kB di riepiloghi giornalieri,
+invece di centinaia di MB di righe al minuto. Se la directory dei dati non è
+scrivibile i riepiloghi vengono calcolati in memoria a ogni lettura.
+
+plot_my_sky10 li usa con --resolution hour o day; con --resolution auto sceglie
+la risoluzione più grossolana che riempie ancora il grafico.
+
+Uso:
+    python sms_rollup.py /dati/BENDER
+    python sms_rollup.py "gps_BENDER_*.csv" --threshold 0.4 --force
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import argparse
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from sms_archive import load_frame, select_files
+
+# minuti rappresentati da un punto per ciascuna risoluzione
+RESOLUTIONS = {'minute': 1, 'hour': 60, 'day': 1440}
+ROLLUP_COLUMNS = ['resolution', 'timestamp', 'idsat', 'count', 'cn0_mean', 'cn0_min', 'cn0_max', 's4c_max',
+                  's4c_p95', 'minutes_above']
+S4C_THRESHOLD = 0.5
+
+# frazione minima di punti per pixel perché una risoluzione riempia il grafico
+MIN_POINTS_PER_PIXEL = 0.25
+
+
+def rollup_path(csv_path):
+    return Path(csv_path).with_suffix('.rollup.csv')
+
+
+def read_threshold(path):
+    try:
+        with open(path, 'r') as f:
+            line = f.readline()
+    except OSError:
+        return None
+    if not line.startswith('# s4c_threshold='):
+        return None
+    try:
+        return float(line.split('=', 1)[1])
+    except ValueError:
+        return None
+
+
+def is_current(csv_path, threshold=S4C_THRESHOLD):
+    """
+    True se esiste un riepilogo non più vecchio del CSV e calcolato con la stessa soglia.
+    """
+    path = rollup_path(csv_path)
+    return (path.exists() and path.stat().st_mtime >= Path(csv_path).stat().st_mtime
+            and read_threshold(path) == threshold)
+
+
+def summarize(df, buckets, resolution, threshold):
+    """
+    Statistiche per (intervallo, satellite) delle righe al minuto.
+    """
+    g = df.assign(bucket=buckets, above=df['s4c'] >= threshold).groupby(['bucket', 'idsat'], sort=True)
+    out = pd.DataFrame({
+        'count': g['cn0'].size(),
+        'cn0_mean': g['cn0'].mean().round(2),
+        'cn0_min': g['cn0'].min(),
+        'cn0_max': g['cn0'].max(),
+        's4c_max': g['s4c'].max(),
+        's4c_p95': g['s4c'].quantile(0.95).round(3),
+        'minutes_above': g['above'].sum(),
+    }).reset_index().rename(columns={'bucket': 'timestamp'})
+    out.insert(0, 'resolution', resolution)
+    return out
+
+
+def compute_rollup(csv_path, threshold=S4C_THRESHOLD):
+    """
+    Calcola il riepilogo di un file; restituisce il DataFrame e il numero di righe al minuto lette.
+    """
+    df = load_frame(csv_path, ['timestamp', 'idsat', 'cn0', 's4c']).dropna()
+    ts = df['timestamp']
+    hourly = summarize(df, ts.dt.floor('h'), 'hour', threshold)
+    # giorno del file: la riga delle 23:59 appartiene al giorno dopo
+    daily = summarize(df, (ts + pd.Timedelta(minutes=1)).dt.floor('D'), 'day', threshold)
+    return pd.concat([hourly, daily], ignore_index=True), len(df)
+
+
+def save_rollup(out, csv_path, threshold=S4C_THRESHOLD):
+    path = rollup_path(csv_path)
+    tmp = path.with_suffix('.tmp')
+    try:
+        with open(tmp, 'w', newline='') as f:
+            f.write(f"# s4c_threshold={threshold}\n")
+            out.to_csv(f, index=False, date_format='%Y-%m-%d %H:%M')
+        os.replace(tmp, path)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def build_rollup(csv_path, threshold=S4C_THRESHOLD):
+    """
+    Calcola e salva il riepilogo di un file; restituisce il numero di righe al minuto lette.
+    """
+    out, rows = compute_rollup(csv_path, threshold)
+    save_rollup(out, csv_path, threshold)
+    return rows
+
+
+def update_rollups(paths, threshold=S4C_THRESHOLD, force=False):
+    """
+    Ricrea i riepiloghi mancanti o più vecchi dei CSV; restituisce il numero di file aggiornati.
+    """
+    updated = 0
+    for path in paths:
+        if force or not is_current(path, threshold):
+            build_rollup(path, threshold)
+            updated += 1
+    return updated
+
+
+def combine_duplicates(df):
+    """
+    Unisce le righe con lo stesso (timestamp, idsat) provenienti da file diversi.
+    """
+    dup = df.duplicated(['timestamp', 'idsat'], keep=False)
+    if not dup.any():
+        return df
+    part = df[dup].assign(cn0_sum=df['cn0_mean'] * df['count'])
+    g = part.groupby(['timestamp', 'idsat'], sort=False)
+    merged = g.agg(count=('count', 'sum'), cn0_sum=('cn0_sum', 'sum'), cn0_min=('cn0_min', 'min'),
+                   cn0_max=('cn0_max', 'max'), s4c_max=('s4c_max', 'max'), s4c_p95=('s4c_p95', 'max'),
+                   minutes_above=('minutes_above', 'sum')).reset_index()
+    merged['cn0_mean'] = (merged.pop('cn0_sum') / merged['count']).round(2)
+    out = pd.concat([df[~dup], merged[df.columns]], ignore_index=True)
+    return out.sort_values(['timestamp', 'idsat'], kind='stable').reset_index(drop=True)
+
+
+def load_rollup(paths, resolution, start=None, end=None, threshold=S4C_THRESHOLD):
+    """
+    Riepiloghi di una risoluzione ('hour' o 'day') dei file, aggiornati se serve,
+    limitati agli intervalli che iniziano tra start (incluso) e end (escluso).
+
+    Un riepilogo che non si può salvare (archivio in sola lettura) viene usato
+    dalla memoria.
+    """
+    frames = []
+    for path in paths:
+        if is_current(path, threshold):
+            df = pd.read_csv(rollup_path(path), comment='#', parse_dates=['timestamp'],
+                             dtype={'resolution': str, 'idsat': np.uint8})
+        else:
+            df, _ = compute_rollup(path, threshold)
+            try:
+                save_rollup(df, path, threshold)
+            except OSError:
+                pass
+        frames.append(df[df['resolution'] == resolution].drop(columns='resolution'))
+    if not frames:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS[1:])
+    df = pd.concat(frames, ignore_index=True)
+    if start is not None:
+        df = df[df['timestamp'] >= start]
+    if end is not None:
+        df = df[df['timestamp'] < end]
+    return combine_duplicates(df.reset_index(drop=True))
+
+
+def choose_resolution(window_minutes, width):
+    """
+    Risoluzione più grossolana con almeno width * MIN_POINTS_PER_PIXEL punti per grafico.
+    """
+    for name in ('day', 'hour'):
+        if window_minutes / RESOLUTIONS[name] >= width * MIN_POINTS_PER_PIXEL:
+            return name
+    return 'minute'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Crea i riepiloghi orari e giornalieri dei file CSV di Share My Sky.')
+    parser.add_argument('sources', type=str, nargs='+', help='Directory, glob o file CSV giornalieri.')
+    parser.add_argument('--threshold', type=float, default=S4C_THRESHOLD,
+                        help=f'Soglia di s4c per il conteggio dei minuti (default: {S4C_THRESHOLD}).')
+    parser.add_argument('--force', action='store_true', help='Ricrea anche i riepiloghi già aggiornati.')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    updated = total = size = 0
+    for source in args.sources:
+        paths = select_files(source)
+        total += len(paths)
+        try:
+            updated += update_rollups(paths, args.threshold, args.force)
+        except FileNotFoundError as e:
+            print(f"Errore: File '{e.filename}' non trovato.")
+            continue
+        except OSError as e:
+            print(f"Errore: impossibile scrivere i riepiloghi di '{source}': {e}")
+            continue
+        size += sum(rollup_path(p).stat().st_size for p in paths)
+    print(f"Riepiloghi aggiornati: {updated} di {total} file ({size / 1024:.0f} kB in totale, "
+          f"{time.perf_counter() - t0:.1f} s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,377 @@
+"""
+Cubo di statistiche del cielo di una stazione per azimut, elevazione, PRN e ora.
+
+Per ogni cella di AZ_STEP x EL_STEP gradi, per satellite e per ora del giorno
+(UTC) vengono accumulati numero di campioni, somma, somma dei quadrati e massimo
+di C/N0 e s4c. Sono grandezze che si sommano: il cubo di un mese è la somma dei
+cubi dei suoi giorni, quello di più stazioni la somma dei loro cubi, e media,
+deviazione standard e massimo si ricavano alla fine.
+
+Il cubo è sparso: contiene solo le celle visitate, ordinate per indice, quindi
+un giorno di una stazione occupa poche decine di kB e sommare i cubi di mesi di
+dati richiede pochi millisecondi.
+
+Accanto a ogni file giornaliero gps_<stazione>_<data>.csv viene mantenuto
+gps_<stazione>_<data>.cube.npz, che registra anche fino a quale byte il CSV è
+stato letto: se la console ha aggiunto righe vengono lette solo quelle nuove,
+se il file è stato accorciato o sostituito il cubo viene ricreato. Un cubo
+ottenuto dalla somma ricorda i file da cui proviene e rifiuta di sommare due
+volte lo stesso file.
+
+Esempi:
+    python sms_skycube.py /dati/BENDER --from 2024-10-01 --to 2024-10-31 --metric s4c --stat max
+    python sms_skycube.py /dati/BENDER --save BENDER_ottobre.npz --update_only
+    python sms_skycube.py BENDER_ottobre.npz LEELA_ottobre.npz --metric cn0 --hours 18 23
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import argparse
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+from sms_archive import parse_time, read_csv_frame, select_files
+
+AZ_STEP = 2
+EL_STEP = 2
+AZ_BINS = 360 // AZ_STEP
+EL_BINS = 90 // EL_STEP
+HOURS = 24
+PRNS = 256
+
+CUBE_VERSION = 1
+HEAD_SIZE = 32
+METRICS = ('cn0', 's4c')
+STATS = ('mean', 'std', 'max', 'count')
+
+
+def cube_path(csv_path):
+    return Path(csv_path).with_suffix('.cube.npz')
+
+
+def cell_index(idsat, hour, azimuth, elevation):
+    """
+    Indice della cella ((prn*HOURS + ora)*AZ_BINS + az)*EL_BINS + el.
+    """
+    az = (np.floor(azimuth / AZ_STEP).astype(np.int64)) % AZ_BINS
+    el = np.clip(np.floor(elevation / EL_STEP).astype(np.int64), 0, EL_BINS - 1)
+    return ((idsat.astype(np.int64) * HOURS + hour) * AZ_BINS + az) * EL_BINS + el
+
+
+def split_cells(cells):
+    """
+    (prn, ora, az, el) degli indici di cella.
+    """
+    cells = cells.astype(np.int64)
+    el = cells % EL_BINS
+    az = cells // EL_BINS % AZ_BINS
+    hour = cells // (EL_BINS * AZ_BINS) % HOURS
+    prn = cells // (EL_BINS * AZ_BINS * HOURS)
+    return prn, hour, az, el
+
+
+def group_starts(sorted_keys):
+    """
+    Posizioni in cui inizia ogni gruppo di chiavi uguali in un array ordinato.
+    """
+    return np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+
+
+def reduce_cells(cells, count, sums, sumsqs, maxes):
+    """
+    Somma le statistiche con lo stesso indice di cella; restituisce le celle ordinate e le statistiche.
+    """
+    if not len(cells):
+        return cells.astype(np.uint32), count, sums, sumsqs, maxes
+    order = np.argsort(cells, kind='stable')
+    cells = cells[order]
+    first = group_starts(cells)
+    count = np.add.reduceat(count[order], first)
+    sums = {m: np.add.reduceat(v[order], first) for m, v in sums.items()}
+    sumsqs = {m: np.add.reduceat(v[order], first) for m, v in sumsqs.items()}
+    maxes = {m: np.maximum.reduceat(v[order], first) for m, v in maxes.items()}
+    return cells[first].astype(np.uint32), count, sums, sumsqs, maxes
+
+
+class SkyCube:
+    """
+    Statistiche sparse per cella (PRN, ora, azimut, elevazione) con l'elenco dei file letti.
+    """
+
+    def __init__(self):
+        self.cells = np.empty(0, dtype=np.uint32)
+        self.count = np.empty(0, dtype=np.uint32)
+        self.sums = {m: np.empty(0) for m in METRICS}
+        self.sumsqs = {m: np.empty(0) for m in METRICS}
+        self.maxes = {m: np.empty(0, dtype=np.float32) for m in METRICS}
+        # file letti: nome -> (byte letti, primi byte del file)
+        self.sources = {}
+
+    def __len__(self):
+        return len(self.cells)
+
+    def add_rows(self, df):
+        """
+        Aggiunge le righe di un DataFrame con timestamp, idsat, azimuth, elevation, cn0 e s4c.
+        """
+        df = df.dropna()
+        df = df[(df['elevation'] >= 0) & (df['idsat'] < PRNS)]
+        if df.empty:
+            return
+        hour = df['timestamp'].dt.hour.to_numpy()
+        cells = cell_index(df['idsat'].to_numpy(), hour, df['azimuth'].to_numpy(), df['elevation'].to_numpy())
+        values = {m: df[m].to_numpy(dtype=np.float64) for m in METRICS}
+        self.combine(cells, np.ones(len(cells), dtype=np.uint32), values, {m: v * v for m, v in values.items()},
+                     {m: v.astype(np.float32) for m, v in values.items()})
+
+    def combine(self, cells, count, sums, sumsqs, maxes):
+        self.cells, self.count, self.sums, self.sumsqs, self.maxes = reduce_cells(
+            np.concatenate([self.cells, cells]), np.concatenate([self.count, count]),
+            {m: np.concatenate([self.sums[m], sums[m]]) for m in METRICS},
+            {m: np.concatenate([self.sumsqs[m], sumsqs[m]]) for m in METRICS},
+            {m: np.concatenate([self.maxes[m], maxes[m]]) for m in METRICS})
+
+    def merge(self, others):
+        """
+        Somma al cubo uno o più cubi; un file già presente non viene sommato due volte.
+        """
+        for other in others:
+            for name in other.sources:
+                if name in self.sources:
+                    raise ValueError(f"Il file {name} è già compreso nel cubo")
+            self.sources.update(other.sources)
+        others = [o for o in others if len(o)]
+        if others:
+            self.combine(np.concatenate([o.cells for o in others]), np.concatenate([o.count for o in others]),
+                         {m: np.concatenate([o.sums[m] for o in others]) for m in METRICS},
+                         {m: np.concatenate([o.sumsqs[m] for o in others]) for m in METRICS},
+                         {m: np.concatenate([o.maxes[m] for o in others]) for m in METRICS})
+        return self
+
+    def save(self, path):
+        names = sorted(self.sources)
+        arrays = {'version': np.array(CUBE_VERSION), 'steps': np.array([AZ_STEP, EL_STEP]),
+                  'cells': self.cells, 'count': self.count,
+                  'source_names': np.array(names, dtype=str),
+                  'source_sizes': np.array([self.sources[n][0] for n in names], dtype=np.int64),
+                  'source_heads': np.array([self.sources[n][1].hex() for n in names], dtype=str)}
+        for m in METRICS:
+            arrays[f'sum_{m}'] = self.sums[m]
+            arrays[f'sumsq_{m}'] = self.sumsqs[m]
+            arrays[f'max_{m}'] = self.maxes[m]
+        tmp = Path(path).with_suffix('.tmp.npz')
+        np.savez_compressed(tmp, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            if int(z['version']) != CUBE_VERSION or list(z['steps']) != [AZ_STEP, EL_STEP]:
+                raise ValueError(f"{path}: formato del cubo non compatibile")
+            cube = cls()
+            cube.cells = z['cells']
+            cube.count = z['count']
+            for m in METRICS:
+                cube.sums[m] = z[f'sum_{m}']
+                cube.sumsqs[m] = z[f'sumsq_{m}']
+                cube.maxes[m] = z[f'max_{m}']
+            cube.sources = {str(n): (int(s), bytes.fromhex(str(h)))
+                            for n, s, h in zip(z['source_names'], z['source_sizes'], z['source_heads'])}
+        return cube
+
+    def plane(self, metric, stat, idsat=None, hours=None):
+        """
+        Matrice AZ_BINS x EL_BINS della statistica richiesta (NaN nelle celle vuote),
+        limitata eventualmente ad alcuni satelliti e ore.
+        """
+        prn, hour, az, el = split_cells(self.cells)
+        keep = np.ones(len(self.cells), dtype=bool)
+        if idsat is not None:
+            keep &= np.isin(prn, idsat)
+        if hours is not None:
+            keep &= np.isin(hour, hours)
+        flat = az[keep] * EL_BINS + el[keep]
+        size = AZ_BINS * EL_BINS
+        count = np.bincount(flat, self.count[keep], size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if stat == 'count':
+                result = count
+            elif stat == 'max':
+                result = np.full(size, -np.inf)
+                order = np.argsort(flat, kind='stable')
+                first = group_starts(flat[order])
+                if len(first):
+                    result[flat[order][first]] = np.maximum.reduceat(self.maxes[metric][keep][order], first)
+            else:
+                s = np.bincount(flat, self.sums[metric][keep], size)
+                result = s / count
+                if stat == 'std':
+                    sq = np.bincount(flat, self.sumsqs[metric][keep], size)
+                    result = np.sqrt(np.maximum(sq / count - result * result, 0))
+        result = np.where(count > 0, result, np.nan)
+        return result.reshape(AZ_BINS, EL_BINS)
+
+
+def file_head(f):
+    f.seek(0)
+    return f.read(HEAD_SIZE)
+
+
+def update_day_cube(csv_path):
+    """
+    Crea o aggiorna il cubo di un file giornaliero leggendo solo le righe aggiunte
+    dall'ultimo aggiornamento; restituisce (cubo, righe lette).
+    """
+    path = cube_path(csv_path)
+    name = os.path.basename(csv_path)
+    with open(csv_path, 'rb') as f:
+        head = file_head(f)
+        size = os.fstat(f.fileno()).st_size
+        cube = None
+        if path.exists():
+            try:
+                cube = SkyCube.load(path)
+            except (OSError, ValueError, KeyError):
+                cube = None
+        done, old_head = cube.sources.get(name, (0, b'')) if cube is not None else (0, b'')
+        if cube is None or name not in cube.sources or done > size or head[:len(old_head)] != old_head[:len(head)]:
+            # file nuovo, accorciato o sostituito: si riparte da capo
+            cube = SkyCube()
+            done = 0
+        if done == 0:
+            # l'eventuale intestazione non è una riga di dati
+            f.seek(0)
+            first = f.readline()
+            if first.startswith(b'timestamp') and first.endswith(b'\n'):
+                done = len(first)
+        if done == size:
+            return cube, 0
+        # solo righe complete: l'ultima potrebbe essere ancora in scrittura
+        f.seek(size - 1)
+        end = size
+        if f.read(1) != b'\n':
+            f.seek(done)
+            end = done + f.read(size - done).rfind(b'\n') + 1
+        if end <= done:
+            return cube, 0
+
+    df = read_csv_frame(csv_path, ['timestamp', 'idsat', 'azimuth', 'elevation', 'cn0', 's4c'],
+                        offsets=(done, end))
+    cube.add_rows(df)
+    cube.sources[name] = (end, head)
+    cube.save(path)
+    return cube, len(df)
+
+
+def load_cubes(sources, start=None, end=None):
+    """
+    Somma i cubi delle sorgenti: file .npz di cubi già pronti, oppure directory, glob o file CSV
+    i cui cubi giornalieri vengono creati o aggiornati.
+    """
+    total = SkyCube()
+    cubes = []
+    rows = 0
+    for source in sources:
+        if source.endswith('.npz'):
+            cubes.append(SkyCube.load(source))
+            continue
+        for csv_path in select_files(source, start, end):
+            cube, n = update_day_cube(csv_path)
+            cubes.append(cube)
+            rows += n
+    return total.merge(cubes), rows
+
+
+def render(cube, metric, stat, idsat, hours, title, png, show):
+    import matplotlib
+    if not show:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    values = cube.plane(metric, stat, idsat, hours)
+    theta = np.radians(np.arange(AZ_BINS + 1) * AZ_STEP)
+    # lo zenit al centro, l'orizzonte sul bordo
+    r = 90 - np.arange(EL_BINS + 1) * EL_STEP
+
+    fig, ax = plt.subplots(figsize=(8, 8), subplot_kw={'projection': 'polar'})
+    ax.set_theta_zero_location('N')
+    ax.set_theta_direction(-1)
+    mesh = ax.pcolormesh(theta, r, np.ma.masked_invalid(values.T), cmap='viridis', shading='flat')
+    ax.set_rlim(0, 90)
+    ax.set_yticks([0, 30, 60, 90])
+    ax.set_yticklabels(['90°', '60°', '30°', '0°'])
+    label = {'mean': 'media', 'std': 'deviazione standard', 'max': 'massimo', 'count': 'campioni'}[stat]
+    fig.colorbar(mesh, ax=ax, shrink=0.8, label=f"{metric.upper() if stat != 'count' else ''} {label}".strip())
+    ax.set_title(title)
+    fig.savefig(png, dpi=100)
+    print(f"Grafico salvato come: {png}")
+    if show:
+        plt.show()
+    plt.close(fig)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mappa del cielo di una o più stazioni da cubi di statistiche '
+                                                 'per azimut ed elevazione.')
+    parser.add_argument('sources', type=str, nargs='+',
+                        help='Directory, glob o file CSV giornalieri (i cubi vengono creati o aggiornati), '
+                             'oppure cubi .npz già salvati.')
+    parser.add_argument('--from', dest='time_from', type=str,
+                        help='Primo giorno dei dati, "AAAA-MM-GG" (UTC); vengono usati i file giornalieri interi.')
+    parser.add_argument('--to', dest='time_to', type=str, help='Ultimo giorno dei dati (incluso), "AAAA-MM-GG".')
+    parser.add_argument('--metric', type=str, choices=METRICS, default='cn0', help='Grandezza (default: cn0).')
+    parser.add_argument('--stat', type=str, choices=STATS, default='mean', help='Statistica (default: mean).')
+    parser.add_argument('--idsat', type=int, nargs='+', help='Lista di IDSAT da considerare, separati da spazi.')
+    parser.add_argument('--hours', type=int, nargs=2, metavar=('DA', 'A'),
+                        help='Ore UTC da considerare, estremi inclusi (es. 22 3 per la notte).')
+    parser.add_argument('--save', type=str, help='Salva il cubo sommato in un file .npz.')
+    parser.add_argument('--output', type=str, default='skymap', help='Nome base del grafico (default: skymap).')
+    parser.add_argument('--update_only', action='store_true', help='Aggiorna i cubi senza disegnare il grafico.')
+    parser.add_argument('--show', action='store_true', help='Mostra il grafico oltre a salvarlo.')
+    args = parser.parse_args()
+
+    start = parse_time(args.time_from) if args.time_from else None
+    end = parse_time(args.time_to, end=True) if args.time_to else None
+    hours = None
+    if args.hours is not None:
+        a, b = args.hours
+        hours = list(range(a, b + 1)) if a <= b else list(range(a, HOURS)) + list(range(0, b + 1))
+
+    t0 = time.perf_counter()
+    try:
+        cube, rows = load_cubes(args.sources, start, end)
+    except (OSError, ValueError) as e:
+        print(f"Errore: {e}")
+        return
+    elapsed = time.perf_counter() - t0
+    print(f"Cubo di {len(cube.sources)} file, {len(cube)} celle, {int(cube.count.sum())} campioni "
+          f"({rows} righe nuove lette, {elapsed * 1000:.0f} ms)")
+    if not len(cube.sources):
+        print("Nessun dato trovato.")
+        return
+    if args.save:
+        cube.save(args.save)
+        print(f"Cubo salvato come: {args.save}")
+    if args.update_only:
+        return
+
+    t0 = time.perf_counter()
+    names = sorted(cube.sources)
+    title = f"{args.metric.upper()} {args.stat} - {names[0]}" + (f" ... {names[-1]}" if len(names) > 1 else "")
+    if args.idsat:
+        title += f"\nIDSAT: {', '.join(map(str, args.idsat))}"
+    if hours is not None:
+        title += f"\nOre UTC {args.hours[0]}-{args.hours[1]}"
+    render(cube, args.metric, args.stat, args.idsat, hours, title, f"{args.output}_{args.metric}_{args.stat}.png",
+           args.show)
+    print(f"Mappa calcolata e disegnata in {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
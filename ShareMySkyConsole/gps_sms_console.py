@@ -10,9 +10,21 @@ For more information, see the LICENSE file or visit https://www.gnu.org/licenses
 import serial
 import argparse
 import sys
+import math
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
 
+from sms_capture import RecordingSerial, ReplaySerial
+from sms_events import DEFAULT_MIN_MINUTES, DEFAULT_OFF, DEFAULT_ON, DEFAULT_SATS, EventDetector, EventLog
+from sms_nmea import Gsv, NmeaCounters, Rmc, Txt
+from sms_reader import DEFAULT_QUEUE_SIZE, SerialReader
+from sms_stats import ConsoleStats
+from sms_ubx import (MAX_RATE as UBX_MAX_RATE, NAV_MESSAGES, NMEA_SENTENCES, UNUSED_SENTENCES, NavPos, NavSats,
+                     NavTime, UbxError, UbxSerial, configure, read_message)
+from sms_uploader import DEFAULT_BATCH_ROWS, DEFAULT_MAX_AGE, Uploader
+from sms_writer import FLUSH_POLICIES, DailyCsvWriter
+
 APPVERSION="0.2"
 
 def parse_arguments():
@@ -40,6 +52,58 @@ def parse_arguments():
                         help=f"Massimo numero di satelliti da considerare, default 32")
     parser.add_argument("--silent", action="store_true", default=False,
                         help="Se specificato, disabilita la stampa dei dati sulla console")
+    parser.add_argument("--baudrate", type=int, default=9600,
+                        help="Velocità della porta seriale del ricevitore (default: 9600)")
+    parser.add_argument("--ubx_rate", type=int, default=None,
+                        help=f"Configura un ricevitore u-blox con messaggi UBX per N epoche al secondo (1-{UBX_MAX_RATE}) "
+                             "e disabilita le frasi VTG, GLL e GSA; più campioni al minuto migliorano la stima di s4c")
+    parser.add_argument("--ubx_baudrate", type=int, default=None,
+                        help="Porta la porta UART del ricevitore u-blox alla velocità indicata (es. 115200), "
+                             "necessaria oltre 2 epoche al secondo")
+    parser.add_argument("--ubx", type=str, choices=list(NAV_MESSAGES), default=None,
+                        help="Acquisisce i satelliti dai messaggi binari UBX invece che dalle frasi GSV: svinfo "
+                             "(NAV-SVINFO, u-blox 7) o sat (NAV-SAT, u-blox 8 e successivi); configura il ricevitore "
+                             "e disabilita tutte le frasi NMEA")
+    parser.add_argument("--ubx_save", action="store_true", default=False,
+                        help="Salva nel ricevitore la configurazione UBX, che resta valida alle accensioni successive")
+    parser.add_argument("--flush", type=str, choices=FLUSH_POLICIES, default="minute",
+                        help="Quando forzare la scrittura su disco del file CSV: none (solo a buffer pieno e al "
+                             "cambio di data), minute (ogni minuto) o fsync (ogni minuto con fsync). Default: minute")
+    parser.add_argument("--queue_size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="Righe che il thread di lettura della seriale può accodare mentre si elabora il minuto "
+                             f"(0 disabilita il thread, default: {DEFAULT_QUEUE_SIZE})")
+    parser.add_argument("--record", type=str, default=None,
+                        help="Registra le frasi ricevute dal GPS nel file di cattura indicato")
+    parser.add_argument("--replay", type=str, default=None,
+                        help="Legge le frasi da un file di cattura invece che dalla porta seriale (che viene ignorata)")
+    parser.add_argument("--speed", type=float, default=0,
+                        help="Con --replay, multiplo della velocità reale (default: 0, massima velocità)")
+    parser.add_argument("--upload", type=str, default=None,
+                        help="Indirizzo del server di raccolta a cui inviare i dati (es. http://server:8080); i dati "
+                             "vengono prima accodati in <csv_path>/spool_<stazione>")
+    parser.add_argument("--upload_batch", type=int, default=DEFAULT_BATCH_ROWS,
+                        help=f"Con --upload, righe per lotto inviato (default: {DEFAULT_BATCH_ROWS})")
+    parser.add_argument("--upload_age", type=float, default=DEFAULT_MAX_AGE,
+                        help=f"Con --upload, secondi massimi di attesa di una riga prima dell'invio "
+                             f"(default: {DEFAULT_MAX_AGE})")
+    parser.add_argument("--events", action="store_true", default=False,
+                        help="Rileva gli eventi di scintillazione alla chiusura di ogni minuto e li registra in "
+                             "sms_<stazione>_events_<data>.csv")
+    parser.add_argument("--event_on", type=float, default=DEFAULT_ON,
+                        help=f"Con --events, s4c da cui un satellite è in scintillazione (default: {DEFAULT_ON})")
+    parser.add_argument("--event_off", type=float, default=DEFAULT_OFF,
+                        help=f"Con --events, s4c sotto cui un satellite torna quieto (default: {DEFAULT_OFF})")
+    parser.add_argument("--event_min", type=int, default=DEFAULT_MIN_MINUTES,
+                        help=f"Con --events, durata minima di un evento in minuti (default: {DEFAULT_MIN_MINUTES})")
+    parser.add_argument("--event_sats", type=int, default=DEFAULT_SATS,
+                        help=f"Con --events, satelliti in scintillazione nello stesso minuto perché ci sia un evento "
+                             f"(default: {DEFAULT_SATS})")
+    parser.add_argument("--stats", action="store_true", default=False,
+                        help="Stampa a ogni minuto una riga di statistiche: frasi per tipo, checksum errati, campioni "
+                             "scartati, tempo di chiusura del minuto, regolarità delle frasi RMC")
+    parser.add_argument("--stats_file", type=str, default=None,
+                        help="Scrive a ogni minuto le statistiche nel file indicato, nel formato testuale di "
+                             "Prometheus (es. per il textfile collector di node_exporter)")
     # parser.add_argument("--window", type=int, default=60,
     # help="Lunghezza della finestra dati per il calcolo di s4c (default: 60)")
 
@@ -106,37 +170,89 @@ def s4c(a):
     return x
 
 
-# crea array di array vuoti di n elementi
-def array(n):
-    x = []
-    for t in range(0, n):
-        x = x + [[]]
-    return x
-
-
-# legge i dati dall'antenna
-def readgps(ser):
-    s = str(ser.readline().decode("utf-8"))
+# da Python 3.12 sum() sui float usa la sommatoria compensata di Neumaier:
+# le somme correnti la replicano per restare identiche a med()/s4c()
+_COMPENSATED_SUM = sys.version_info >= (3, 12)
 
-    # calcola il checksum
-    payload_start = s.find('$') + 1  # trova il primo carattere dopo $
-    payload_end = s.find('*')  # trova il carattere *
-    payload = s[payload_start: payload_end]  # dati di cui fare XOR
-    ck = 0
-    for ch in payload:  # ciclo di calcolo del checksum
-        ck = ck ^ ord(ch)  # XOR
-    str_ck = '%02X' % ck  # trasforma il valore calcolato in una stringa di 2 caratteri
 
-    # controlla checksum
-    if s[-4:-2] != str_ck:
-        s = "$ERR"
+class SatAccumulator:
+    """
+    Statistiche di un satellite nel minuto corrente, mantenute come somme correnti.
 
-    # decodifica stringa GPS
-    s = s[:-5].split(',')
-    for t in range(len(s)):
-        if s[t] == '':
-            s[t] = '0'
-    return s
+    Memoria costante e chiusura del minuto O(1); i risultati coincidono bit a bit
+    con med() e s4c() applicate alla lista dei campioni.
+    """
+    __slots__ = ("n", "sum_az", "sum_alt", "sum_cn0", "sum_i", "comp_i", "sum_i2", "comp_i2")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.sum_az = 0
+        self.sum_alt = 0
+        self.sum_cn0 = 0
+        self.sum_i = 0.0
+        self.comp_i = 0.0
+        self.sum_i2 = 0.0
+        self.comp_i2 = 0.0
+
+    def add(self, az, alt, cn0):
+        i = 10 ** (cn0 / 10)
+        i2 = i ** 2
+        self.sum_az += az
+        self.sum_alt += alt
+        self.sum_cn0 += cn0
+        if _COMPENSATED_SUM and self.n > 0:
+            t = self.sum_i + i
+            if abs(self.sum_i) >= abs(i):
+                self.comp_i += (self.sum_i - t) + i
+            else:
+                self.comp_i += (i - t) + self.sum_i
+            self.sum_i = t
+            t = self.sum_i2 + i2
+            if abs(self.sum_i2) >= abs(i2):
+                self.comp_i2 += (self.sum_i2 - t) + i2
+            else:
+                self.comp_i2 += (i2 - t) + self.sum_i2
+            self.sum_i2 = t
+        else:
+            self.sum_i += i
+            self.sum_i2 += i2
+        self.n += 1
+
+    # media arrotondata al decimo, come int(med(v) * 10 + 0.5) / 10
+    def az_med(self):
+        return int(self.sum_az / self.n * 10 + 0.5) / 10
+
+    def alt_med(self):
+        return int(self.sum_alt / self.n * 10 + 0.5) / 10
+
+    def cn0_med(self):
+        return int(self.sum_cn0 / self.n * 10 + 0.5) / 10
+
+    # equivalente di s4c() sui valori cn0 accumulati
+    def s4c(self):
+        x = 0
+        if self.n == 0:
+            return x
+        sum_i = self.sum_i
+        sum_i2 = self.sum_i2
+        if self.comp_i and math.isfinite(self.comp_i):
+            sum_i += self.comp_i
+        if self.comp_i2 and math.isfinite(self.comp_i2):
+            sum_i2 += self.comp_i2
+        k = sum_i2 / self.n
+        j = (sum_i / self.n) ** 2
+        if (j > 0) and (k >= j):
+            x = ((k - j) / j) ** 0.5
+            x = int(x * 100 + 0.5) / 100
+        return x
+
+
+# crea un accumulatore vuoto per ciascuno degli n satelliti
+def accumulators(n):
+    return [SatAccumulator() for t in range(0, n)]
 
 
 def fixDate(date: str):
@@ -152,136 +268,306 @@ def fixDate(date: str):
     return data_corretta.strftime("%d%m%y")
 
 
-def main():
-    args = parse_arguments()
+# coordinate per la riga di partenza: gradi e minuti interi (ddmm / 100) ed emisfero
+def banner_coordinate(value, positive, negative):
+    v = abs(value)
+    deg = int(v)
+    minutes = int(round((v - deg) * 60, 6))
+    return str((deg * 100 + minutes) / 100) + " " + (negative if value < 0 else positive)
+
+
+def rmc_time(rmc):
+    """
+    Restituisce secondo, timestamp yymmddHHMM e data ddmmyy di una frase RMC,
+    oppure None se orario o data non sono ancora disponibili.
+    """
+    hhmmss = rmc.time
+    date = rmc.date
+    if len(hhmmss) < 6 or len(date) != 6:
+        return None
+    if len(hhmmss) == 6:
+        # orario senza millisecondi, per dispositivi vecchi
+        try:
+            date = fixDate(date)
+        except ValueError:
+            return None
+    return hhmmss[4:6], date[4:6] + date[2:4] + date[0:2] + hhmmss[0:4], date
 
-    azimuth_start, azimuth_end = parse_cutoff_interval(args.azimuth_cutoff, 360)
-    elevation_start, elevation_end = parse_cutoff_interval(args.elevation_cutoff, 90)
 
+class Station:
+    """
+    Acquisizione di una stazione: sincronizzazione al secondo 00, accumulo dei
+    campioni GSV nella finestra di cutoff e chiusura del minuto.
+
+    Riceve le frasi già decodificate da feed(), per cui può essere alimentata
+    dal ciclo di lettura della console come da un event loop con più ricevitori.
+    """
+
+    def __init__(self, name, csv_path, azimuth_cutoff, elevation_cutoff, max_sats=32, silent=False,
+                 flush="minute", prefix="", events=None, uploader=None, stats=None):
+        self.name = name
+        self.azimuth_start, self.azimuth_end = azimuth_cutoff
+        self.elevation_start, self.elevation_end = elevation_cutoff
+        self.max_sats = int(max_sats)
+        self.silent = silent
+        self.prefix = prefix
+        self.synced = False
+        self.timesat_old = ""
+        self.lat = ""
+        self.lon = ""
+        self.satacc = accumulators(self.max_sats)
+        self.logfile = DailyCsvWriter(csv_path, "gps_" + name + "_", flush)
+        # rilevatore di eventi (EventLog di sms_events), opzionale
+        self.events = events
+        # invio al server di raccolta (Uploader di sms_uploader), opzionale
+        self.uploader = uploader
+        # statistiche di funzionamento (ConsoleStats di sms_stats), opzionali
+        self.stats = stats
+        self.accepted = 0
+        self.rejected_cutoff = 0
+        self.rejected_max_sats = 0
+        self.rows_written = 0
+
+    def feed(self, s):
+        """
+        Elabora una frase decodificata da sms_nmea o un messaggio NAV di sms_ubx (None viene ignorato).
+        """
+        # decodifica il codice nmea0183 GPGSV
+        if type(s) is Gsv:
+            if self.synced and s.talker == b'GP':
+                self.add_sats(s.sats)
+
+        # NAV-SVINFO o NAV-SAT: tutti i satelliti GPS dell'epoca in un solo messaggio
+        elif type(s) is NavSats:
+            if self.synced:
+                self.add_sats(s.sats)
+
+        # decodifica il codice nmea0183 GPRMC (o NAV-TIMEUTC) per avere latitudine longitudine e l'orario gps
+        elif (type(s) is Rmc and s.talker in (b'GP', b'GN')) or type(s) is NavTime:
+            rt = rmc_time(s)
+            if rt is None:
+                return
+            second, timesat, date = rt
+
+            if not self.synced:
+                # sincronizza la partenza al secondo 00
+                self.timesat_old = timesat
+                if type(s) is Rmc:
+                    self.lat = banner_coordinate(s.lat, "N", "S")
+                    self.lon = banner_coordinate(s.lon, "E", "W")
+                self.synced = second == "00"
+
+            # al secondo 00 esegue la statistica e logga i risultati; oltre 1 Hz il secondo 00
+            # compare in più epoche e il minuto va chiuso solo alla prima
+            elif second == "00" and timesat != self.timesat_old:
+                if self.stats is not None:
+                    t0 = time.perf_counter()
+                    self.close_minute(date)
+                    self.stats.minute_closed(self, self.timesat_old, time.perf_counter() - t0)
+                else:
+                    self.close_minute(date)
+                self.timesat_old = timesat
+
+        elif type(s) is Txt and not self.synced and s.talker == b'GP':
+            print(self.prefix + s.text)
+
+        # NAV-POSLLH: con l'acquisizione UBX le coordinate non arrivano con l'orario
+        elif type(s) is NavPos and not self.synced:
+            self.lat = banner_coordinate(s.lat, "N", "S")
+            self.lon = banner_coordinate(s.lon, "E", "W")
+
+    def add_sats(self, sats):
+        """
+        Accumula i campioni (idsat, elevazione, azimut, cn0) di un'epoca che cadono nella finestra di cutoff.
+        """
+        for idsat, altsat, azsat, cn0sat in sats:
+            # calcola la finestra di cutoff
+            if is_within_cutoff(azsat, altsat, self.azimuth_start, self.azimuth_end, self.elevation_start,
+                                self.elevation_end):
+                if idsat < self.max_sats:
+                    self.satacc[idsat].add(azsat, altsat, cn0sat)
+                    self.accepted += 1
+                else:
+                    self.rejected_max_sats += 1
+            else:
+                self.rejected_cutoff += 1
+
+    def close_minute(self, date):
+        # calcolo delle coordinate medie e dell sqm del segnale per ogni satellite valido
+        rows = []
+        values = []
+        timesat_old = self.timesat_old
+        for t in range(0, self.max_sats):
+            acc = self.satacc[t]
+            if acc.n > 0:
+                azmed = acc.az_med()
+                altmed = acc.alt_med()
+                cn0med = acc.cn0_med()
+                cn0s4c = acc.s4c()
+                cn0s = ""
+                for x in range(int(cn0s4c / 0.333)):
+                    cn0s = cn0s + "*"
+
+                if not self.silent:
+                    print(self.prefix +
+                          f'{timesat_old:6}  sat: {t:2}   az: {azmed:5}   alt: {altmed:4}   cn0: {cn0med:4}   s4c:{cn0s4c:5} {cn0s}')
+
+                rows.append(str(timesat_old) + "," + str(t) + "," + str(azmed) + "," + str(
+                    altmed) + "," + str(cn0med) + "," + str(cn0s4c) + "\n")
+                values.append((t, azmed, altmed, cn0s4c))
+
+                # azzera l'accumulatore
+                acc.reset()
+
+        # una sola scrittura per minuto sul file del giorno, che resta aperto
+        if rows:
+            self.logfile.write(date, rows)
+            self.rows_written += len(rows)
+            if self.uploader is not None:
+                self.uploader.enqueue(rows)
+
+        if self.events is not None:
+            self.events.update(timesat_old, date, values)
+
+    def close(self):
+        self.logfile.close()
+        if self.events is not None:
+            self.events.close()
+        if self.uploader is not None:
+            self.uploader.close()
+
+
+def open_serial(port, baudrate=9600, timeout=1):
+    """
+    Apre la porta seriale del GPS e ne svuota il buffer; termina il programma in caso di errore.
+    """
     try:
-        ser = serial.Serial(args.serial_port, baudrate=9600, timeout=1)
+        ser = serial.Serial(port, baudrate=baudrate, timeout=timeout)
         ser.reset_input_buffer()  # era flushInput()
 
     except serial.SerialException as e:
         print(f"Errore apertura porta seriale: {e}")
         sys.exit(1)
 
+    return ser
+
+
+def main():
+    args = parse_arguments()
+
+    azimuth_cutoff = parse_cutoff_interval(args.azimuth_cutoff, 360)
+    elevation_cutoff = parse_cutoff_interval(args.elevation_cutoff, 90)
+
+    if args.replay is not None:
+        try:
+            ser = ReplaySerial(args.replay, args.speed)
+        except (OSError, ValueError) as e:
+            print(f"Errore apertura file di cattura: {e}")
+            sys.exit(1)
+    else:
+        ser = open_serial(args.serial_port, args.baudrate)
+        if args.ubx_rate is not None or args.ubx_baudrate is not None or args.ubx is not None:
+            # configurazione del ricevitore prima di avviare il thread di lettura
+            try:
+                configure(ser, args.ubx_rate, args.ubx_baudrate, NMEA_SENTENCES if args.ubx else UNUSED_SENTENCES,
+                          args.ubx_save, args.ubx)
+            except (UbxError, ValueError) as e:
+                print(f"Errore nella configurazione del ricevitore: {e}")
+                ser.close()
+                sys.exit(1)
+        if args.ubx is not None:
+            # frame UBX binari al posto delle righe NMEA
+            ser = UbxSerial(ser)
+
+    if args.record is not None:
+        ser = RecordingSerial(ser, args.record)
+
+    # la lettura avviene in un thread separato; riproducendo una cattura non si devono perdere righe
+    reader = None
+    if args.queue_size > 0:
+        reader = SerialReader(ser, args.queue_size, block=args.replay is not None)
+        ser = reader
+
+    events = None
+    if args.events:
+        try:
+            detector = EventDetector(args.event_on, args.event_off, args.event_min, args.event_sats)
+        except ValueError as e:
+            print(f"Errore: {e}")
+            sys.exit(1)
+        events = EventLog(args.csv_path, args.station, detector, args.flush)
+
+    uploader = None
+    if args.upload is not None:
+        try:
+            uploader = Uploader(args.upload, args.station, Path(args.csv_path) / f"spool_{args.station}",
+                                args.upload_batch, args.upload_age, fsync=args.flush == "fsync")
+        except (ValueError, OSError) as e:
+            print(f"Errore: {e}")
+            sys.exit(1)
+
+    counters = None
+    stats = None
+    if args.stats or args.stats_file:
+        counters = NmeaCounters()
+        stats = ConsoleStats(args.station, counters, reader, args.stats_file, show=args.stats)
+
+    station = Station(args.station, args.csv_path, azimuth_cutoff, elevation_cutoff, args.max_sats, args.silent,
+                      args.flush, events=events, uploader=uploader, stats=stats)
+
     # sincronizza la partenza al secondo 00
-    lat = ""
-    lon = ""
-    timesat_old = ""
-    second = ""
     print("--- SHARE MY SKY ---\n")
     print("Attesa sincronizzazione...")
 
-    while second != "00":
+    while not station.synced:
         try:
-            s = readgps(ser)
-            if s[0] == '$GPTXT':
-                print(s[4])
-
-            # decodifica il codice nmea0183 GPRMC per avere latitudine longitudine e l'orario gps
-            if s[0] == '$GPRMC':
-                if len(s[1]) == 6:
-                    s[9] = fixDate(s[9])
-                    # orario senza millisecondi, per dispositivi vecchi
-                    second = s[1][4:6]
-                    timesat_old = s[9][4:6] + s[9][2:4] + s[9][0:2] + s[1][0:2] + s[1][2:4]
-                else:
-                    second = s[1][-5:-3]
-                    timesat_old = s[9][4:6] + s[9][2:4] + s[9][0:2] + s[1][:-5]
-
-                lat = str(int(float(s[3])) / 100) + " " + s[4]
-                lon = str(int(float(s[5])) / 100) + " " + s[6]
-
+            station.feed(read_message(ser, counters))
             print('.', end='')
 
-        except KeyboardInterrupt:
-            print("Interruzione da tastiera.")
+        except (KeyboardInterrupt, EOFError) as e:
+            if isinstance(e, EOFError):
+                print("Fine dei dati registrati.")
+            else:
+                print("Interruzione da tastiera.")
+            station.close()
             ser.close()
             print("Programma terminato.")
             return
 
     print("\n\nDati ricevitore:")
-    print("\nStart ", timesat_old, " coordinate: ", lat, "-", lon, "\n")
-
-    azsatvet = array(int(args.max_sats))
-    altsatvet = array(int(args.max_sats))
-    cn0satvet = array(int(args.max_sats))
+    print("\nStart ", station.timesat_old, " coordinate: ", station.lat, "-", station.lon, "\n")
 
+    dropped = 0
     while True:
         try:
-            s = readgps(ser)
-
-            # decodifica il codice nmea0183 GPRMC
-            if s[0] == '$GPRMC':
-                if len(s[1]) == 6:
-                    # orario senza millisecondi, per dispositivi vecchi
-                    s[9] = fixDate(s[9])
-                    # orario senza millisecondi, per dispositivi vecchi
-                    second = s[1][4:6]
-                    timesat = s[9][4:6] + s[9][2:4] + s[9][0:2] + s[1][0:2] + s[1][2:4]
-                else:
-                    second = s[1][-5:-3]
-                    timesat = s[9][4:6] + s[9][2:4] + s[9][0:2] + s[1][:-5]
-
-                date = s[9]
-
-                # al secondo 00 esegue la statistica e logga i risultati
-                if second == "00":
-                    # calcolo delle coordinate medie e dell sqm del segnale per ogni satellite valido
-                    for t in range(0, int(args.max_sats)):
-                        if len(cn0satvet[t]) > 0:
-                            azmed = int(med(azsatvet[t]) * 10 + 0.5) / 10
-                            altmed = int(med(altsatvet[t]) * 10 + 0.5) / 10
-                            cn0med = int(med(cn0satvet[t]) * 10 + 0.5) / 10
-                            cn0s4c = s4c(cn0satvet[t])
-                            cn0s = ""
-                            for x in range(int(cn0s4c / 0.333)):
-                                cn0s = cn0s + "*"
-
-                            if not args.silent:
-                                print(
-                                    f'{timesat_old:6}  sat: {t:2}   az: {azmed:5}   alt: {altmed:4}   cn0: {cn0med:4}   s4c:{cn0s4c:5} {cn0s}')
-
-                            logname = "gps_" + args.station + "_" + date + ".csv"
-                            logfile = args.csv_path / Path(logname)
-                            f = open(logfile, "a")
-                            s1 = str(timesat_old) + "," + str(t) + "," + str(azmed) + "," + str(
-                                altmed) + "," + str(cn0med) + "," + str(cn0s4c) + "\n"
-                            f.write(s1)
-                            f.close()
-
-                    # vuota gli array
-                    azsatvet = array(int(args.max_sats))
-                    altsatvet = array(int(args.max_sats))
-                    cn0satvet = array(int(args.max_sats))
-                    timesat_old = timesat
-
-            # decodifica il codice nmea0183 GPGSV
-            elif s[0] == '$GPGSV':
-                sat_data = s[4:]
-                for i in range(0, len(sat_data), 4):
-                    try:
-                        idsat = int(sat_data[i])
-                        altsat = int(sat_data[i + 1])
-                        azsat = int(sat_data[i + 2])
-                        cn0sat = int(sat_data[i + 3])
-
-                        # calcola la finestra di cutoff
-                        if is_within_cutoff(azsat, altsat, azimuth_start, azimuth_end, elevation_start,
-                                            elevation_end):
-                            if idsat < int(args.max_sats):
-                                azsatvet[idsat] = azsatvet[idsat] + [azsat]
-                                altsatvet[idsat] = altsatvet[idsat] + [altsat]
-                                cn0satvet[idsat] = cn0satvet[idsat] + [cn0sat]
-                    except (ValueError, IndexError):
-                        pass
+            s = read_message(ser, counters)
+            if stats is not None:
+                stats.line(type(s) is Rmc or type(s) is NavTime)
+            station.feed(s)
+
+            # segnala le righe perse per coda di lettura piena
+            if reader is not None and reader.dropped != dropped:
+                queue = reader.stats()
+                print(f"Attenzione: {queue['dropped'] - dropped} righe perse per coda di lettura piena "
+                      f"(riempimento massimo {queue['high_water']}/{queue['size']})")
+                dropped = queue['dropped']
         except KeyboardInterrupt:
             print("Interruzione da tastiera.")
             break
+        except EOFError:
+            print("Fine dei dati registrati.")
+            break
 
+    station.close()
     ser.close()
+    if reader is not None:
+        stats = reader.stats()
+        print(f"Righe lette: {stats['lines_read']}, perse: {stats['dropped']}, "
+              f"riempimento massimo della coda: {stats['high_water']}/{stats['size']}")
+    if uploader is not None:
+        stats = uploader.stats()
+        print(f"Righe inviate al server: {stats['sent_rows']} in {stats['batches']} lotti ({stats['sent_bytes']} byte), "
+              f"invii non riusciti: {stats['failures']}, righe in coda: {stats['pending']}")
     print("Programma terminato.")
 
 
@@ -0,0 +1,170 @@
+"""
+Registrazione e riproduzione delle frasi grezze ricevute dal GPS.
+
+Il file di cattura è uno stream gzip che inizia con MAGIC e l'istante di
+partenza (epoch, double); ogni record è composto dai millisecondi trascorsi
+dalla partenza (uint32), dalla lunghezza (uint16) e dai byte ricevuti così
+come sono arrivati dalla seriale, compresi eventuali caratteri spuri.
+
+I millisecondi in un uint32 bastano per circa 49 giorni: prima che si esauriscano
+viene scritto un record con lunghezza REBASE seguito da un nuovo istante di
+partenza (double), da cui si contano i record successivi.
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import gzip
+import struct
+import time
+
+MAGIC = b"SMSCAP1\n"
+_START = struct.Struct("<d")
+_RECORD = struct.Struct("<IH")
+REBASE = 0xFFFF
+MAX_LENGTH = REBASE - 1
+# millisecondi oltre i quali si riparte da un nuovo istante (circa 48 giorni)
+REBASE_MS = 0xF0000000
+
+# ogni quanto rendere leggibile su disco quanto catturato (secondi)
+FLUSH_INTERVAL = 60
+
+
+class CaptureWriter:
+    """
+    Scrive un file di cattura compresso.
+    """
+
+    def __init__(self, path, start=None):
+        self.start = time.time() if start is None else start
+        self.f = gzip.open(path, "wb")
+        self.f.write(MAGIC + _START.pack(self.start))
+        self.last_flush = self.start
+
+    def write(self, data, t=None):
+        if t is None:
+            t = time.time()
+        ms = max(0, int((t - self.start) * 1000))
+        if ms >= REBASE_MS:
+            self.start = t
+            self.f.write(_RECORD.pack(0, REBASE) + _START.pack(t))
+            ms = 0
+        data = data[:MAX_LENGTH]
+        self.f.write(_RECORD.pack(ms, len(data)) + data)
+        # un flush periodico rende recuperabile la cattura anche se il programma viene ucciso
+        if t - self.last_flush >= FLUSH_INTERVAL:
+            self.f.flush()
+            self.last_flush = t
+
+    def close(self):
+        self.f.close()
+
+
+def read_capture(path):
+    """
+    Restituisce un iteratore sulle coppie (istante di ricezione, byte) di un file di cattura.
+
+    L'intestazione viene controllata subito: solleva OSError se il file non si
+    può aprire o non è compresso con gzip, ValueError se non è una cattura.
+    Una cattura troncata, ad esempio per uno spegnimento improvviso, termina
+    all'ultimo record completo.
+    """
+    f = gzip.open(path, "rb")
+    try:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"'{path}' non è un file di cattura Share My Sky")
+        header = f.read(_START.size)
+        if len(header) < _START.size:
+            raise ValueError(f"'{path}': intestazione della cattura incompleta")
+    except EOFError:
+        f.close()
+        raise ValueError(f"'{path}': intestazione della cattura incompleta")
+    except BaseException:
+        f.close()
+        raise
+    start, = _START.unpack(header)
+    return _records(f, start)
+
+
+def _records(f, start):
+    with f:
+        try:
+            while True:
+                header = f.read(_RECORD.size)
+                if len(header) < _RECORD.size:
+                    break
+                ms, length = _RECORD.unpack(header)
+                if length == REBASE:
+                    data = f.read(_START.size)
+                    if len(data) < _START.size:
+                        break
+                    start, = _START.unpack(data)
+                    continue
+                data = f.read(length)
+                if len(data) < length:
+                    break
+                yield start + ms / 1000, data
+        except EOFError:
+            pass
+
+
+class RecordingSerial:
+    """
+    Avvolge una porta seriale e registra ogni riga letta in un file di cattura.
+    """
+
+    def __init__(self, ser, path):
+        self.ser = ser
+        self.writer = CaptureWriter(path)
+
+    def readline(self):
+        line = self.ser.readline()
+        if line:
+            self.writer.write(line)
+        return line
+
+    def close(self):
+        self.writer.close()
+        self.ser.close()
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+
+class ReplaySerial:
+    """
+    Sostituisce la porta seriale rileggendo un file di cattura.
+
+    Con speed=0 le righe vengono restituite alla massima velocità possibile,
+    altrimenti rispettando i tempi registrati accelerati di speed volte.
+    A fine file readline() solleva EOFError. Il costruttore solleva OSError o
+    ValueError come read_capture().
+    """
+
+    def __init__(self, path, speed=0):
+        self.records = read_capture(path)
+        self.speed = speed
+        self.t0 = None
+        self.wall0 = None
+
+    def readline(self):
+        try:
+            t, data = next(self.records)
+        except StopIteration:
+            raise EOFError("fine del file di cattura")
+        if self.speed > 0:
+            if self.t0 is None:
+                self.t0 = t
+                self.wall0 = time.monotonic()
+            delay = (t - self.t0) / self.speed - (time.monotonic() - self.wall0)
+            if delay > 0:
+                time.sleep(delay)
+        return data
+
+    def reset_input_buffer(self):
+        pass
+
+    def close(self):
+        self.records.close()
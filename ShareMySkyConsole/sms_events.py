@@ -0,0 +1,175 @@
+"""
+Rilevamento in tempo reale degli eventi di scintillazione.
+
+Il rilevatore lavora sui valori di s4c già calcolati alla chiusura di ogni
+minuto, quindi non aggiunge nessun costo all'elaborazione dei singoli campioni
+e segnala un evento pochi istanti dopo la fine del minuto.
+
+Regole:
+- isteresi: un satellite diventa attivo quando s4c >= on e torna quieto quando
+  s4c < off (o quando esce dalla finestra di cutoff);
+- coincidenza: c'è scintillazione quando almeno `sats` satelliti sono attivi
+  nello stesso minuto;
+- durata minima: l'evento inizia solo se la coincidenza dura almeno
+  `min_minutes` minuti consecutivi, e termina al primo minuto in cui manca.
+
+Per ogni evento vengono scritte due righe nel file giornaliero
+sms_<stazione>_events_<data>.csv:
+    minuto,START|END,inizio,durata_min,satelliti,prn,s4c_max,prn_max,az,el
+dove prn sono i satelliti coinvolti separati da spazi e s4c_max, prn_max, az
+ed el si riferiscono al valore massimo di s4c osservato fino a quel momento.
+Se l'acquisizione termina durante un evento, la riga END viene scritta alla
+chiusura con l'ultimo minuto elaborato.
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+from typing import NamedTuple
+
+from sms_writer import DailyCsvWriter
+
+DEFAULT_ON = 0.5
+DEFAULT_OFF = 0.3
+DEFAULT_MIN_MINUTES = 2
+DEFAULT_SATS = 2
+
+
+class Event(NamedTuple):
+    minute: str
+    kind: str  # START o END
+    start: str
+    minutes: int
+    satellites: int
+    prns: tuple
+    s4c: float
+    prn: int
+    az: int
+    el: int
+
+    def csv(self):
+        return (f"{self.minute},{self.kind},{self.start},{self.minutes},{self.satellites},"
+                f"{' '.join(str(p) for p in self.prns)},{self.s4c},{self.prn},{self.az},{self.el}\n")
+
+
+class EventDetector:
+    """
+    Macchina a stati che riceve i valori di un minuto e restituisce gli eventi iniziati e finiti.
+    """
+
+    def __init__(self, on=DEFAULT_ON, off=DEFAULT_OFF, min_minutes=DEFAULT_MIN_MINUTES, sats=DEFAULT_SATS):
+        if off > on:
+            raise ValueError(f"La soglia di fine evento ({off}) deve essere minore o uguale a quella di inizio ({on})")
+        self.on = on
+        self.off = off
+        self.min_minutes = max(int(min_minutes), 1)
+        self.sats = max(int(sats), 1)
+
+        self.active = set()
+        self.in_event = False
+        self.run_start = None
+        self.run_minutes = 0
+        self.last_minute = None
+        self.reset_run()
+
+    def reset_run(self):
+        self.prns = set()
+        self.max_active = 0
+        self.peak = None  # (s4c, prn, az, el)
+
+    def record(self, minute, kind):
+        s4c, prn, az, el = self.peak
+        satellites = len(self.active) if kind == "START" else self.max_active
+        return Event(minute, kind, self.run_start, self.run_minutes, satellites, tuple(sorted(self.prns)),
+                     s4c, prn, az, el)
+
+    def update(self, minute, values):
+        """
+        Elabora i valori del minuto, una tupla (prn, az, el, s4c) per satellite, e
+        restituisce gli Event da scrivere nel registro degli eventi.
+        """
+        seen = set()
+        active = self.active
+        on = self.on
+        off = self.off
+        for prn, az, el, s4c in values:
+            seen.add(prn)
+            if s4c >= on or (prn in active and s4c >= off):
+                active.add(prn)
+            else:
+                active.discard(prn)
+        # un satellite che non compare più non è attivo
+        active &= seen
+
+        records = []
+        if len(active) >= self.sats:
+            if self.run_minutes == 0:
+                self.run_start = minute
+                self.reset_run()
+            self.run_minutes += 1
+            self.prns |= active
+            self.max_active = max(self.max_active, len(active))
+            for prn, az, el, s4c in values:
+                if prn in active and (self.peak is None or s4c > self.peak[0]):
+                    self.peak = (s4c, prn, az, el)
+            if not self.in_event and self.run_minutes >= self.min_minutes:
+                self.in_event = True
+                records.append(self.record(minute, "START"))
+        else:
+            if self.in_event:
+                # la fine è l'ultimo minuto in cui la coincidenza era presente
+                records.append(self.record(self.last_minute, "END"))
+            self.in_event = False
+            self.run_minutes = 0
+
+        self.last_minute = minute
+        return records
+
+    def close(self):
+        """
+        Chiude l'evento in corso al termine dell'acquisizione; restituisce la sua riga END, se c'è.
+        """
+        records = []
+        if self.in_event:
+            records.append(self.record(self.last_minute, "END"))
+        self.in_event = False
+        self.run_minutes = 0
+        return records
+
+
+class EventLog:
+    """
+    Rilevatore di eventi con il registro giornaliero su file di una stazione.
+    """
+
+    def __init__(self, directory, station, detector, flush="minute", prefix=""):
+        self.detector = detector
+        self.prefix = prefix
+        self.logfile = DailyCsvWriter(directory, "sms_" + station + "_events_", flush)
+        self.last_date = None
+
+    def update(self, minute, date, values):
+        self.last_date = date
+        records = self.detector.update(minute, values)
+        self.write(date, records)
+        return records
+
+    def write(self, date, records):
+        if not records:
+            return
+        for e in records:
+            prns = " ".join(str(p) for p in e.prns)
+            if e.kind == "START":
+                print(self.prefix + f"*** Inizio evento di scintillazione alle {e.start}: {e.satellites} satelliti "
+                                    f"({prns}), s4c massimo {e.s4c} (sat {e.prn})")
+            else:
+                print(self.prefix + f"*** Fine evento di scintillazione alle {e.minute}: durata {e.minutes} min, "
+                                    f"satelliti {prns}, s4c massimo {e.s4c} (sat {e.prn})")
+        self.logfile.write(date, [e.csv() for e in records])
+
+    def close(self):
+        # un evento ancora in corso viene chiuso all'ultimo minuto elaborato
+        self.write(self.last_date, self.detector.close())
+        self.logfile.close()
@@ -0,0 +1,276 @@
+"""
+Ricevitore u-blox simulato su uno pseudo-terminale.
+
+Permette di provare senza hardware la configurazione UBX (sms_ubx.configure,
+opzioni --ubx_* della console) e l'acquisizione ad alta frequenza: il programma
+crea un pty, stampa il nome del terminale (o crea il collegamento --link) e vi
+trasmette in tempo reale le frasi NMEA di sms_synth, all'ora UTC corrente.
+
+Come il ricevitore vero:
+  - parte a --rate epoche al secondo con tutte le frasi di fabbrica (RMC, VTG,
+    GGA, GSA, GSV, GLL) e risponde con ACK-ACK o ACK-NAK ai messaggi CFG-PRT,
+    CFG-RATE, CFG-MSG e CFG-CFG, e con la configurazione corrente ai poll;
+  - rifiuta (NAK) frequenze oltre --max_rate;
+  - su una porta UART trasmette al massimo baudrate/10 byte al secondo: le
+    epoche che non ci stanno vengono perse;
+  - dopo CFG-PRT passa alla nuova velocità (l'ACK parte alla velocità vecchia)
+    e, se la velocità impostata sul terminale dal programma collegato è diversa
+    dalla sua, riceve e trasmette solo byte senza senso;
+  - con CFG-MSG si possono attivare i messaggi NAV-POSLLH, NAV-TIMEUTC e
+    NAV-SVINFO e, con --nav_sat (u-blox 8), NAV-SAT, trasmessi dopo
+    le frasi NMEA di ogni epoca.
+
+Uso:
+    python sms_fakegps.py --link /tmp/gps
+    python gps_sms_console.py PROVA /tmp/gps 0-360 0-90 --ubx_rate 10 --ubx_baudrate 115200 --stats
+    python gps_sms_console.py PROVA /tmp/gps 0-360 0-90 --ubx svinfo --ubx_rate 10 --ubx_baudrate 115200
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import argparse
+import math
+import os
+import struct
+import termios
+import threading
+import time
+import tty
+
+from sms_synth import (ALL_SENTENCES, DEFAULT_SATS, SkyModel, epochs as synth_epochs, nav_posllh, nav_sat, nav_svinfo,
+                       nav_timeutc, nmea_stream)
+from sms_ubx import (ACK_ACK, ACK_NAK, CFG_CFG, CFG_MSG, CFG_PRT, CFG_RATE, CLS_ACK, CLS_CFG, CLS_NAV, CLS_NMEA,
+                     MAX_RATE, MODE_8N1, NAV_POSLLH, NAV_SAT, NAV_SVINFO, NAV_TIMEUTC, NMEA_IDS, PORT_UART1, PORT_USB,
+                     PROTO_NMEA, PROTO_UBX, UART_PORTS, UbxParser, frame)
+
+# velocità del terminale (costanti termios) in baud
+_SPEEDS = {getattr(termios, f"B{b}"): b for b in (4800, 9600, 19200, 38400, 57600, 115200, 230400, 460800)
+           if hasattr(termios, f"B{b}")}
+_SENTENCE_NAMES = {v: k for k, v in NMEA_IDS.items()}
+_NAV_NAMES = {NAV_POSLLH: "NAV-POSLLH", NAV_TIMEUTC: "NAV-TIMEUTC", NAV_SVINFO: "NAV-SVINFO", NAV_SAT: "NAV-SAT"}
+
+
+class FakeReceiver:
+    """
+    Ricevitore simulato: un thread risponde ai messaggi UBX, un altro trasmette le epoche.
+    """
+
+    def __init__(self, sky, seed=0, rate=1, baudrate=9600, port_id=PORT_UART1, max_rate=MAX_RATE, nav_sat=False,
+                 log=print):
+        self.sky = sky
+        self.seed = seed
+        self.rate = rate
+        self.baudrate = baudrate
+        self.port_id = port_id
+        self.max_rate = max_rate
+        self.log = log
+        self.sentences = set(ALL_SENTENCES)
+        # messaggi NAV conosciuti (NAV-SAT solo dai ricevitori u-blox 8) e attivi
+        self.nav_known = set(_NAV_NAMES) if nav_sat else set(_NAV_NAMES) - {NAV_SAT}
+        self.nav = set()
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        attrs = termios.tcgetattr(self.slave)
+        speed = {b: s for s, b in _SPEEDS.items()}.get(baudrate, termios.B9600)
+        attrs[4] = attrs[5] = speed
+        termios.tcsetattr(self.slave, termios.TCSANOW, attrs)
+        self.name = os.ttyname(self.slave)
+        self.lock = threading.Lock()
+        self.running = False
+        self.dropped_epochs = 0
+        self.threads = []
+
+    def host_baudrate(self):
+        """
+        Velocità impostata sul terminale dal programma collegato.
+        """
+        return _SPEEDS.get(termios.tcgetattr(self.slave)[5])
+
+    def in_sync(self):
+        return self.port_id not in UART_PORTS or self.host_baudrate() == self.baudrate
+
+    def write(self, data):
+        with self.lock:
+            if not self.in_sync():
+                # a velocità diverse il programma collegato riceve solo byte senza senso
+                data = bytes((b ^ 0xA5) | 0x80 for b in data)
+            os.write(self.master, data)
+
+    def port_payload(self):
+        if self.port_id in UART_PORTS:
+            return struct.pack("<BBHIIHHHH", self.port_id, 0, 0, MODE_8N1, self.baudrate, PROTO_UBX | PROTO_NMEA,
+                               PROTO_UBX | PROTO_NMEA, 0, 0)
+        return struct.pack("<BBHIIHHHH", self.port_id, 0, 0, 0, 0, PROTO_UBX | PROTO_NMEA, PROTO_UBX | PROTO_NMEA,
+                           0, 0)
+
+    def ack(self, f, ok=True):
+        self.write(frame(CLS_ACK, ACK_ACK if ok else ACK_NAK, bytes((f.cls, f.msg_id))))
+
+    def handle(self, f):
+        """
+        Risponde a un frame UBX ricevuto.
+        """
+        if f.cls != CLS_CFG:
+            return
+        if f.msg_id == CFG_PRT:
+            if len(f.payload) <= 1:
+                self.write(frame(CLS_CFG, CFG_PRT, self.port_payload()))
+                self.ack(f)
+            elif len(f.payload) == 20:
+                port_id, baudrate = f.payload[0], struct.unpack_from("<I", f.payload, 8)[0]
+                self.ack(f)
+                if port_id == self.port_id and port_id in UART_PORTS and baudrate != self.baudrate:
+                    # la risposta è già partita alla vecchia velocità
+                    time.sleep(0.02)
+                    self.baudrate = baudrate
+                    self.log(f"CFG-PRT: porta a {baudrate} baud")
+            else:
+                self.ack(f, False)
+        elif f.msg_id == CFG_RATE:
+            if not f.payload:
+                self.write(frame(CLS_CFG, CFG_RATE, struct.pack("<HHH", round(1000 / self.rate), 1, 1)))
+                self.ack(f)
+                return
+            meas_rate, nav_rate, _ = struct.unpack("<HHH", f.payload[:6])
+            if nav_rate != 1 or meas_rate < 1000 / self.max_rate or 1000 % meas_rate:
+                self.ack(f, False)
+                self.log(f"CFG-RATE: periodo di {meas_rate} ms rifiutato")
+                return
+            self.rate = 1000 // meas_rate
+            self.ack(f)
+            self.log(f"CFG-RATE: {self.rate} epoche al secondo")
+        elif f.msg_id == CFG_MSG:
+            if len(f.payload) in (3, 8) and f.payload[0] == CLS_NMEA and f.payload[1] in _SENTENCE_NAMES:
+                name = _SENTENCE_NAMES[f.payload[1]]
+                if f.payload[2 if len(f.payload) == 3 else 2 + self.port_id]:
+                    self.sentences.add(name)
+                else:
+                    self.sentences.discard(name)
+                self.ack(f)
+                self.log(f"CFG-MSG: frasi {' '.join(s for s in ALL_SENTENCES if s in self.sentences)}")
+            elif len(f.payload) in (3, 8) and f.payload[0] == CLS_NAV and f.payload[1] in self.nav_known:
+                if f.payload[2 if len(f.payload) == 3 else 2 + self.port_id]:
+                    self.nav.add(f.payload[1])
+                else:
+                    self.nav.discard(f.payload[1])
+                self.ack(f)
+                self.log(f"CFG-MSG: messaggi {' '.join(_NAV_NAMES[m] for m in sorted(self.nav)) or 'NAV nessuno'}")
+            else:
+                self.ack(f, False)
+        elif f.msg_id == CFG_CFG:
+            self.ack(f)
+            self.log("CFG-CFG: configurazione salvata")
+        else:
+            self.ack(f, False)
+
+    def receive(self):
+        parser = UbxParser()
+        while self.running:
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                break
+            if not self.in_sync():
+                continue
+            for f in parser.feed(data):
+                self.handle(f)
+
+    def transmit(self):
+        t = math.floor(time.time()) + 1
+        while self.running:
+            # le epoche di un secondo, con frequenza e frasi correnti
+            epochs = {}
+            for ti, line in nmea_stream(t, 1, self.sky, self.rate, self.seed,
+                                        sentences=tuple(s for s in ALL_SENTENCES if s in self.sentences)):
+                epochs.setdefault(ti, []).append(line)
+            if self.nav:
+                self.add_nav(t, epochs)
+            budget = self.baudrate / 10 if self.port_id in UART_PORTS else math.inf
+            for ti, lines in epochs.items():
+                data = b"".join(lines)
+                budget -= len(data)
+                if budget < 0:
+                    # la porta è satura: il ricevitore perde le epoche che non riesce a trasmettere
+                    self.dropped_epochs += 1
+                    continue
+                delay = ti - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                if not self.running:
+                    return
+                self.write(data)
+            t += 1
+
+    def add_nav(self, t, epochs):
+        """
+        Aggiunge alle epoche del secondo t i messaggi NAV attivi, in ordine di id come il ricevitore.
+        """
+        for ti, sats in synth_epochs(t, 1, self.sky, self.rate, self.seed):
+            lines = epochs.setdefault(ti, [])
+            for msg_id in sorted(self.nav):
+                if msg_id == NAV_POSLLH:
+                    lines.append(nav_posllh(ti, 45.5, 9.2))
+                elif msg_id == NAV_TIMEUTC:
+                    lines.append(nav_timeutc(ti))
+                elif msg_id == NAV_SVINFO:
+                    lines.append(nav_svinfo(ti, sats))
+                else:
+                    lines.append(nav_sat(ti, sats))
+
+    def start(self):
+        self.running = True
+        self.threads = [threading.Thread(target=self.receive, daemon=True),
+                        threading.Thread(target=self.transmit, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def close(self):
+        self.running = False
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simula un ricevitore u-blox su uno pseudo-terminale")
+    parser.add_argument("--rate", type=int, default=1, help="Epoche al secondo alla partenza (default: 1)")
+    parser.add_argument("--baudrate", type=int, default=9600, help="Velocità alla partenza (default: 9600)")
+    parser.add_argument("--usb", action="store_true",
+                        help="Simula il collegamento via USB: la velocità non conta e non limita i dati")
+    parser.add_argument("--max_rate", type=int, default=MAX_RATE,
+                        help=f"Frequenza massima accettata da CFG-RATE (default: {MAX_RATE})")
+    parser.add_argument("--nav_sat", action="store_true",
+                        help="Simula un ricevitore u-blox 8, che conosce anche NAV-SAT")
+    parser.add_argument("--sats", type=int, default=DEFAULT_SATS, help="Satelliti della costellazione sintetica")
+    parser.add_argument("--seed", type=int, default=0, help="Seme dei dati sintetici (default: 0)")
+    parser.add_argument("--link", type=str, default=None,
+                        help="Crea un collegamento simbolico al terminale (es. /tmp/gps)")
+    args = parser.parse_args()
+
+    receiver = FakeReceiver(SkyModel(args.sats, args.seed), args.seed, args.rate, args.baudrate,
+                            PORT_USB if args.usb else PORT_UART1, args.max_rate, args.nav_sat,
+                            log=lambda text: print(text, flush=True))
+    if args.link:
+        if os.path.islink(args.link):
+            os.unlink(args.link)
+        os.symlink(receiver.name, args.link)
+    print(f"Ricevitore simulato su {args.link or receiver.name} ({args.rate} Hz, "
+          f"{'USB' if args.usb else f'{args.baudrate} baud'})", flush=True)
+    receiver.start()
+    try:
+        while True:
+            time.sleep(60)
+            if receiver.dropped_epochs:
+                print(f"Epoche perse per porta satura: {receiver.dropped_epochs}", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.close()
+        if args.link and os.path.islink(args.link):
+            os.unlink(args.link)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Acquisisce con un solo processo i dati di più ricevitori GPS collegati a porte
+seriali diverse, ciascuno con il proprio nome di stazione, finestra di cutoff
+e file CSV giornalieri.
+
+Le porte vengono lette in modo concorrente da un unico event loop asyncio:
+ogni stazione ha i propri accumulatori ma il processo, l'interprete e il
+ciclo di lettura sono condivisi.
+
+Sono supportate solo le opzioni elencate da --help. Le funzioni della console
+che dipendono dalla singola porta o stazione non sono disponibili: thread di
+lettura (--queue_size), --record, --events, --upload, --stats/--stats_file,
+--baudrate e la configurazione e l'acquisizione UBX (--ubx*). Per usarle si
+avvia un gps_sms_console.py per ogni ricevitore.
+
+Esempio:
+    python sms_multi.py --station NORD /dev/ttyACM0 315-45 20-80 --station SUD /dev/ttyACM1 100-260 30-80
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+from gps_sms_console import APPVERSION, Station, open_serial, parse_cutoff_interval
+from sms_capture import ReplaySerial
+from sms_nmea import parse_sentence
+from sms_writer import FLUSH_POLICIES
+
+# massima lunghezza di una riga senza terminatore prima di scartarla
+MAX_LINE = 1024
+
+
+def parse_arguments():
+    """
+    Gestisce i parametri da linea di comando.
+    """
+    parser = argparse.ArgumentParser(description="Acquisisce dati GPS da più porte seriali in un solo processo per le "
+                                                 f"finalità del progetto Share My Sky. Versione {APPVERSION}")
+
+    parser.add_argument("--station", nargs=4, action="append", required=True,
+                        metavar=("NOME", "PORTA", "AZIMUT", "ELEVAZIONE"),
+                        help="Stazione da acquisire: nome, porta seriale, intervallo di azimut e di elevazione "
+                             "per il cutoff (es: --station NORD /dev/ttyACM0 315-45 20-80). Ripetibile")
+    parser.add_argument("--csv_path", type=str, default=Path.home(),
+                        help=f"Percorso dei file CSV dove verranno registrati i dati raccolti (default: {Path.home()})")
+    parser.add_argument("--max_sats", type=int, default=32,
+                        help="Massimo numero di satelliti da considerare, default 32")
+    parser.add_argument("--silent", action="store_true", default=False,
+                        help="Se specificato, disabilita la stampa dei dati sulla console")
+    parser.add_argument("--flush", type=str, choices=FLUSH_POLICIES, default="minute",
+                        help="Quando forzare la scrittura su disco dei file CSV (default: minute)")
+    parser.add_argument("--replay", action="store_true", default=False,
+                        help="Le porte indicate sono file di cattura da rileggere invece di porte seriali")
+    parser.add_argument("--speed", type=float, default=0,
+                        help="Con --replay, multiplo della velocità reale (default: 0, massima velocità)")
+
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit(1)
+
+    return parser.parse_args()
+
+
+async def read_port(station, ser):
+    """
+    Legge una porta seriale senza bloccare l'event loop e passa le frasi alla stazione.
+
+    Il descrittore della porta viene registrato nell'event loop, che chiama la lettura
+    solo quando ci sono byte disponibili; le righe vengono ricomposte nel buffer.
+    """
+    loop = asyncio.get_running_loop()
+    closed = loop.create_future()
+    buf = bytearray()
+
+    def on_readable():
+        try:
+            data = ser.read(ser.in_waiting or 1)
+        except OSError as e:
+            loop.remove_reader(ser.fileno())
+            if not closed.done():
+                closed.set_exception(e)
+            return
+        buf.extend(data)
+        start = 0
+        while True:
+            end = buf.find(b"\n", start)
+            if end < 0:
+                break
+            station.feed(parse_sentence(bytes(buf[start:end + 1])))
+            start = end + 1
+        del buf[:start]
+        if len(buf) > MAX_LINE:
+            buf.clear()
+
+    loop.add_reader(ser.fileno(), on_readable)
+    try:
+        await closed
+    finally:
+        loop.remove_reader(ser.fileno())
+
+
+async def readline_port(station, ser):
+    """
+    Legge riga per riga in un thread: usato per i file di cattura, la cui riproduzione
+    può rispettare i tempi registrati, e su Windows, dove l'event loop non può
+    attendere i descrittori delle porte seriali.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            line = await loop.run_in_executor(None, ser.readline)
+        except EOFError:
+            print(f"[{station.name}] Fine dei dati registrati.")
+            return
+        station.feed(parse_sentence(line))
+
+
+async def acquire(stations, ports, threaded):
+    tasks = []
+    for station, ser in zip(stations, ports):
+        if threaded:
+            tasks.append(asyncio.create_task(readline_port(station, ser)))
+        else:
+            tasks.append(asyncio.create_task(read_port(station, ser)))
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for station, result in zip(stations, results):
+        if isinstance(result, Exception):
+            print(f"[{station.name}] Errore di lettura: {result}")
+
+
+def main():
+    args = parse_arguments()
+
+    stations = []
+    ports = []
+    threaded = args.replay or sys.platform == "win32"
+    for name, port, azimuth, elevation in args.station:
+        azimuth_cutoff = parse_cutoff_interval(azimuth, 360)
+        elevation_cutoff = parse_cutoff_interval(elevation, 90)
+        stations.append(Station(name, args.csv_path, azimuth_cutoff, elevation_cutoff, args.max_sats, args.silent,
+                                args.flush, prefix=f"[{name}] "))
+        if args.replay:
+            try:
+                ports.append(ReplaySerial(port, args.speed))
+            except (OSError, ValueError) as e:
+                print(f"Errore apertura file di cattura: {e}")
+                sys.exit(1)
+        else:
+            ports.append(open_serial(port, timeout=1 if threaded else 0))
+
+    print("--- SHARE MY SKY ---\n")
+    print("Stazioni: " + ", ".join(f"{s.name} ({p})" for s, (_, p, _, _) in zip(stations, args.station)) + "\n")
+
+    try:
+        asyncio.run(acquire(stations, ports, threaded))
+    except KeyboardInterrupt:
+        print("Interruzione da tastiera.")
+
+    for station, ser in zip(stations, ports):
+        station.close()
+        ser.close()
+    print("Programma terminato.")
+
+
+if __name__ == "__main__":
+    main()
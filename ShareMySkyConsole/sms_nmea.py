@@ -0,0 +1,248 @@
+"""
+Decodifica delle frasi NMEA 0183 direttamente dai byte ricevuti dalla seriale.
+
+parse_sentence() verifica il checksum senza convertire la riga in str e
+decodifica solo i campi necessari delle frasi GSV, RMC, GGA e TXT,
+restituendo valori tipizzati. Righe spezzate, caratteri non ASCII o checksum
+errati non sollevano eccezioni: la frase viene scartata e la riga successiva
+riparte dal primo '$'. Con un oggetto NmeaCounters le frasi scartate vengono
+anche contate, per tipo di errore.
+
+Eseguito direttamente misura la velocità di decodifica:
+    python sms_nmea.py [cattura.smscap]
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import sys
+import time
+from typing import NamedTuple
+
+# valore delle due cifre esadecimali del checksum
+_HEX = {}
+for _i in range(256):
+    _HEX[b"%02X" % _i] = _i
+    _HEX[b"%02x" % _i] = _i
+
+_from_bytes = int.from_bytes
+
+
+class NmeaCounters:
+    """
+    Contatori delle frasi ricevute, aggiornati da parse_sentence() se indicati.
+
+    types conta le frasi decodificate e quelle non gestite per tipo (b"GSV", b"VTG"...);
+    il checksum viene verificato solo per le frasi gestite.
+    """
+    __slots__ = ("types", "checksum_errors", "malformed", "incomplete")
+
+    def __init__(self):
+        self.types = {}
+        self.checksum_errors = 0
+        self.malformed = 0
+        self.incomplete = 0
+
+
+class Gsv(NamedTuple):
+    talker: bytes
+    total: int
+    index: int
+    in_view: int
+    sats: tuple  # (idsat, elevazione, azimut, cn0), i campi vuoti valgono 0
+
+
+class Rmc(NamedTuple):
+    talker: bytes
+    time: str  # hhmmss oppure hhmmss.ss
+    status: str
+    lat: float  # gradi decimali, negativi a sud
+    lon: float  # gradi decimali, negativi a ovest
+    date: str  # ddmmyy
+
+
+class Gga(NamedTuple):
+    talker: bytes
+    time: str
+    lat: float
+    lon: float
+    quality: int
+    num_sats: int
+    alt: float
+
+
+class Txt(NamedTuple):
+    talker: bytes
+    severity: int
+    text: str
+
+
+def checksum(payload):
+    """
+    XOR di tutti i byte tra '$' e '*'.
+
+    Il payload viene trattato come un unico intero e ripiegato su sé stesso:
+    ogni passo somma in XOR due metà, per cui il byte meno significativo
+    finale è lo XOR di tutti i byte, calcolato in poche operazioni in C.
+    """
+    if len(payload) > 128:
+        ck = 0
+        for ch in payload:
+            ck ^= ch
+        return ck
+    x = _from_bytes(payload, "little")
+    x ^= x >> 512
+    x ^= x >> 256
+    x ^= x >> 128
+    x ^= x >> 64
+    x &= 0xFFFFFFFFFFFFFFFF
+    x ^= x >> 32
+    x ^= x >> 16
+    x ^= x >> 8
+    return x & 0xFF
+
+
+def _int(field):
+    return int(field) if field else 0
+
+
+def _float(field):
+    return float(field) if field else 0.0
+
+
+# converte ddmm.mmmm in gradi decimali
+def _degrees(field, hemisphere):
+    if not field:
+        return 0.0
+    v = float(field)
+    deg = int(v / 100)
+    deg += (v - deg * 100) / 60
+    if hemisphere in (b"S", b"W"):
+        deg = -deg
+    return deg
+
+
+def _gsv(talker, f):
+    # solo gruppi completi di quattro campi (u-blox 9 aggiunge in coda l'id del segnale)
+    v = iter([int(x) if x else 0 for x in f[4:4 + (len(f) - 4) // 4 * 4]])
+    sats = tuple(zip(v, v, v, v))
+    return Gsv(talker, _int(f[1]), _int(f[2]), _int(f[3]), sats)
+
+
+def _rmc(talker, f):
+    return Rmc(talker, f[1].decode("ascii"), f[2].decode("ascii"),
+               _degrees(f[3], f[4]), _degrees(f[5], f[6]), f[9].decode("ascii"))
+
+
+def _gga(talker, f):
+    return Gga(talker, f[1].decode("ascii"), _degrees(f[2], f[3]), _degrees(f[4], f[5]),
+               _int(f[6]), _int(f[7]), _float(f[9]))
+
+
+def _txt(talker, f):
+    return Txt(talker, _int(f[3]), f[4].decode("ascii", "replace"))
+
+
+_DECODERS = {
+    b"GSV": _gsv,
+    b"RMC": _rmc,
+    b"GGA": _gga,
+    b"TXT": _txt,
+}
+
+
+def parse_sentence(line, counters=None):
+    """
+    Decodifica una riga ricevuta (bytes o memoryview).
+
+    Restituisce Gsv, Rmc, Gga o Txt, oppure None se la riga è incompleta,
+    ha checksum errato o contiene una frase non gestita; se counters (NmeaCounters)
+    è indicato, la riga viene contata.
+    """
+    if isinstance(line, memoryview):
+        line = line.tobytes()
+    start = line.rfind(b"$")
+    if start < 0:
+        # b"" è il timeout della seriale, non una riga persa
+        if counters is not None and line.strip():
+            counters.incomplete += 1
+        return None
+    end = line.find(b"*", start)
+    if end < 0:
+        if counters is not None:
+            counters.incomplete += 1
+        return None
+    payload = line[start + 1:end]
+    kind = payload[2:5]
+    # le frasi non gestite vengono scartate prima di calcolarne il checksum
+    decoder = _DECODERS.get(kind)
+    if decoder is None:
+        if counters is not None:
+            if kind.isalpha():
+                counters.types[kind] = counters.types.get(kind, 0) + 1
+            else:
+                counters.malformed += 1
+        return None
+    ck = _HEX.get(line[end + 1:end + 3])
+    if ck is None or checksum(payload) != ck:
+        if counters is not None:
+            counters.checksum_errors += 1
+        return None
+    try:
+        s = decoder(payload[0:2], payload.split(b","))
+    except (ValueError, IndexError, UnicodeDecodeError):
+        if counters is not None:
+            counters.malformed += 1
+        return None
+    if counters is not None:
+        counters.types[kind] = counters.types.get(kind, 0) + 1
+    return s
+
+
+def read_sentence(ser, counters=None):
+    """
+    Legge una riga dalla porta seriale e la decodifica.
+    """
+    return parse_sentence(ser.readline(), counters)
+
+
+def _benchmark_lines():
+    # circa un secondo di uscita di un ricevitore multi-costellazione a 10 Hz
+    lines = [b"$GPRMC,123519.00,A,4530.12345,N,00912.34567,E,0.012,,181024,,,A*00\r\n",
+             b"$GPVTG,,T,,M,0.012,N,0.022,K,A*00\r\n",
+             b"$GPGGA,123519.00,4530.12345,N,00912.34567,E,1,12,0.80,120.5,M,47.0,M,,*00\r\n",
+             b"$GPGSA,A,3,01,02,12,14,15,17,19,24,25,,,,1.52,0.80,1.29*00\r\n"]
+    for n in range(1, 4):
+        lines.append(b"$GPGSV,3,%d,12,01,40,083,46,02,17,308,41,12,07,344,39,14,22,228,45*00\r\n" % n)
+    for n in range(1, 3):
+        lines.append(b"$GLGSV,2,%d,08,65,40,083,46,66,17,308,41,72,07,344,,81,22,228,45*00\r\n" % n)
+    lines.append(b"$GPGLL,4530.12345,N,00912.34567,E,123519.00,A,A*00\r\n")
+    fixed = []
+    for line in lines:
+        payload = line[1:line.index(b"*")]
+        fixed.append(b"$" + payload + b"*%02X\r\n" % checksum(payload))
+    return fixed * 10
+
+
+def main():
+    if len(sys.argv) > 1:
+        from sms_capture import read_capture
+        lines = [data for _, data in read_capture(sys.argv[1])]
+    else:
+        lines = _benchmark_lines()
+        lines = lines * (100000 // len(lines))
+
+    t0 = time.perf_counter()
+    decoded = 0
+    for line in lines:
+        if parse_sentence(line) is not None:
+            decoded += 1
+    dt = time.perf_counter() - t0
+    print(f"{len(lines)} righe ({decoded} decodificate) in {dt:.3f} s: {len(lines) / dt:.0f} frasi/s, "
+          f"{sum(map(len, lines)) / dt / 1e6:.2f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Lettura della porta seriale in un thread dedicato.
+
+Il thread svuota continuamente la porta e accoda le righe complete in un buffer
+circolare di dimensione limitata; l'elaborazione, la stampa e la scrittura dei
+file avvengono nel thread principale, che legge dalla coda con readline().
+In questo modo una stampa lenta o un disco lento alla chiusura del minuto non
+fanno riempire il buffer del sistema operativo, e se la coda si riempie le
+righe perse vengono contate invece di sparire in silenzio.
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import threading
+import time
+from collections import deque
+
+DEFAULT_QUEUE_SIZE = 4096
+
+
+class SerialReader:
+    """
+    Sostituto di una porta seriale che ne legge le righe in un thread separato.
+
+    Con block=False, a coda piena la riga più vecchia viene scartata e contata in
+    dropped; con block=True il thread di lettura attende che si liberi spazio
+    (adatto alla riproduzione di una cattura, che non deve perdere nulla).
+    """
+
+    def __init__(self, ser, size=DEFAULT_QUEUE_SIZE, block=False):
+        self.ser = ser
+        self.size = size
+        self.block = block
+        self.lines = deque()
+        self.cond = threading.Condition()
+        self.error = None
+        self.running = True
+
+        # contatori
+        self.lines_read = 0
+        self.dropped = 0
+        self.high_water = 0
+        # istante di ricezione (time.monotonic()) e secondi passati in coda dell'ultima riga restituita;
+        # latency è None se l'ultima readline() è scaduta senza righe
+        self.received = 0.0
+        self.latency = None
+
+        self.thread = threading.Thread(target=self.run, name="serial-reader", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        ser = self.ser
+        lines = self.lines
+        cond = self.cond
+        monotonic = time.monotonic
+        while self.running:
+            try:
+                line = ser.readline()
+            except Exception as e:  # EOFError a fine cattura, SerialException se la porta sparisce
+                with cond:
+                    self.error = e
+                    cond.notify_all()
+                return
+            if not line:
+                continue
+            with cond:
+                if len(lines) >= self.size:
+                    if self.block:
+                        while len(lines) >= self.size and self.running:
+                            cond.wait(1.0)
+                    else:
+                        lines.popleft()
+                        self.dropped += 1
+                lines.append((monotonic(), line))
+                self.lines_read += 1
+                if len(lines) > self.high_water:
+                    self.high_water = len(lines)
+                cond.notify_all()
+
+    def readline(self):
+        """
+        Restituisce la prossima riga; come la porta seriale con timeout=1 restituisce b""
+        se non arriva nulla entro un secondo. Se il thread di lettura si è fermato per un
+        errore, l'eccezione viene rilanciata dopo aver consegnato le righe già in coda.
+        """
+        with self.cond:
+            if not self.lines:
+                if self.error is not None:
+                    raise self.error
+                self.cond.wait(1.0)
+                if not self.lines:
+                    self.latency = None
+                    return b""
+            received, line = self.lines.popleft()
+            self.received = received
+            self.latency = time.monotonic() - received
+            if self.block:
+                self.cond.notify_all()
+            return line
+
+    def stats(self):
+        with self.cond:
+            return {"lines_read": self.lines_read, "dropped": self.dropped,
+                    "queued": len(self.lines), "high_water": self.high_water, "size": self.size}
+
+    def reset_input_buffer(self):
+        pass
+
+    def close(self):
+        # la porta viene chiusa dopo il thread, la cui readline() ha comunque un timeout
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+        self.thread.join(2.0)
+        self.ser.close()
@@ -0,0 +1,276 @@
+"""
+Ricalcola offline le tabelle al minuto (azimut, elevazione, C/N0, S4C) a partire
+dai campioni GSV grezzi registrati con gps_sms_console.py --record (o dai
+messaggi NAV-SVINFO/NAV-SAT, se la cattura è stata fatta con --ubx).
+
+I campioni vengono caricati in array NumPy e raggruppati per (finestra, satellite)
+in un unico passaggio vettoriale; il risultato ha lo stesso formato dei file
+gps_<stazione>_<data>.csv prodotti dalla console. Con le finestre di un minuto
+allineate al minuto le righe coincidono con quelle della console, perché le
+somme delle intensità usano sum() come la console (compensata da Python 3.12).
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import argparse
+import calendar
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from gps_sms_console import parse_cutoff_interval, rmc_time
+from sms_capture import read_capture
+from sms_nmea import Gsv, Rmc
+from sms_ubx import NavSats, NavTime, decode
+
+SAMPLE_FIELDS = ("t", "idsat", "azimuth", "elevation", "cn0")
+# istante dell'ultima frase RMC, che chiude l'ultima finestra anche senza campioni successivi
+END_FIELD = "t_end"
+
+
+def parse_arguments():
+    """
+    Gestisce i parametri da linea di comando.
+    """
+    parser = argparse.ArgumentParser(description="Ricalcola i file CSV giornalieri di Share My Sky da catture grezze "
+                                                 "(.smscap) o da campioni già estratti (.npz)")
+    parser.add_argument("station", type=str, help="Nome della stazione usato nei file di uscita")
+    parser.add_argument("inputs", type=str, nargs='+', help="File di cattura o di campioni da elaborare")
+    parser.add_argument("--azimuth_cutoff", type=str, default=None,
+                        help="Intervallo di azimut per il cutoff (es: 315-45, 45-280, default: nessun cutoff)")
+    parser.add_argument("--elevation_cutoff", type=str, default=None,
+                        help="Intervallo di elevazione per il cutoff (es: 20-80, default: nessun cutoff)")
+    parser.add_argument("--csv_path", type=str, default=".",
+                        help="Cartella dove scrivere i file CSV (default: cartella corrente)")
+    parser.add_argument("--max_sats", type=int, default=32,
+                        help="Massimo numero di satelliti da considerare, default 32")
+    parser.add_argument("--window", type=int, default=60,
+                        help="Lunghezza in secondi della finestra di calcolo (default: 60)")
+    parser.add_argument("--offset", type=int, default=0,
+                        help="Sposta l'inizio delle finestre di N secondi rispetto al minuto (default: 0)")
+    parser.add_argument("--save_samples", type=str, default=None,
+                        help="Salva i campioni estratti in un file .npz per le elaborazioni successive")
+
+    return parser.parse_args()
+
+
+def extract_samples(path):
+    """
+    Estrae i campioni GSV (o NAV-SVINFO/NAV-SAT) di un file di cattura.
+
+    Ogni campione ha come istante (epoch UTC, secondi) quello dell'ultima frase RMC
+    (o NAV-TIMEUTC) ricevuta, che è anche il riferimento usato dalla console per assegnare il minuto.
+    L'istante dell'ultima RMC della cattura viene restituito in t_end.
+    """
+    cols = ([], [], [], [], [])
+    t_rmc = None
+    day_epoch = {}
+    for _, line in read_capture(path):
+        s = decode(line)
+
+        if (type(s) is Rmc and s.talker in (b'GP', b'GN')) or type(s) is NavTime:
+            rt = rmc_time(s)
+            if rt is None:
+                continue
+            hhmmss = s.time
+            date = rt[2]
+            if date not in day_epoch:
+                day_epoch[date] = calendar.timegm(datetime.strptime(date, "%d%m%y").timetuple())
+            t_rmc = day_epoch[date] + int(hhmmss[0:2]) * 3600 + int(hhmmss[2:4]) * 60 + int(hhmmss[4:6])
+
+        elif ((type(s) is Gsv and s.talker == b'GP') or type(s) is NavSats) and t_rmc is not None:
+            for idsat, altsat, azsat, cn0sat in s.sats:
+                cols[0].append(t_rmc)
+                cols[1].append(idsat)
+                cols[2].append(azsat)
+                cols[3].append(altsat)
+                cols[4].append(cn0sat)
+
+    return {
+        "t": np.array(cols[0], dtype=np.int64),
+        "idsat": np.array(cols[1], dtype=np.int16),
+        "azimuth": np.array(cols[2], dtype=np.int16),
+        "elevation": np.array(cols[3], dtype=np.int16),
+        "cn0": np.array(cols[4], dtype=np.int16),
+        END_FIELD: np.array([-1 if t_rmc is None else t_rmc], dtype=np.int64),
+    }
+
+
+def load_samples(paths):
+    """
+    Carica e concatena, in ordine di tempo, i campioni di più catture o file .npz.
+    """
+    parts = []
+    for path in paths:
+        if Path(path).suffix == ".npz":
+            with np.load(path) as data:
+                parts.append({k: data[k] for k in SAMPLE_FIELDS + (END_FIELD,) if k in data.files})
+        else:
+            parts.append(extract_samples(path))
+
+    samples = {k: np.concatenate([p[k] for p in parts]) for k in SAMPLE_FIELDS}
+    order = np.argsort(samples["t"], kind="stable")
+    samples = {k: v[order] for k, v in samples.items()}
+    # i file .npz delle versioni precedenti non hanno t_end: vale l'ultimo campione
+    ends = [p[END_FIELD] for p in parts if END_FIELD in p] + [samples["t"][-1:]]
+    samples[END_FIELD] = np.array([np.concatenate(ends).max(initial=-1)], dtype=np.int64)
+    return samples
+
+
+def save_samples(path, samples):
+    np.savez_compressed(path, **samples)
+
+
+def cutoff_mask(azimuth, elevation, azimuth_start, azimuth_end, elevation_start, elevation_end):
+    """
+    Versione vettoriale di is_within_cutoff().
+    """
+    mask = np.ones(len(azimuth), dtype=bool)
+    if not (azimuth_start == 0 and azimuth_end == 360):
+        if azimuth_start < azimuth_end:
+            mask &= (azimuth >= azimuth_start) & (azimuth <= azimuth_end)
+        else:
+            mask &= (azimuth >= azimuth_start) | (azimuth <= azimuth_end)
+
+    if not (elevation_start == 0 and elevation_end == 90):
+        mask &= (elevation >= elevation_start) & (elevation <= elevation_end)
+
+    return mask
+
+
+def compute_windows(samples, cutoff=(0, 360, 0, 90), max_sats=32, window=60, offset=0):
+    """
+    Calcola le statistiche per ogni (finestra, satellite) in un solo passaggio.
+
+    Vengono considerate solo le finestre interamente coperte dai dati, come fa la
+    console che scarta il minuto di partenza e quello in corso alla chiusura:
+    l'ultima finestra è chiusa dall'ultima frase RMC (t_end), come nella console.
+    Restituisce un dizionario di array ordinati per finestra e satellite.
+    """
+    t = samples["t"]
+    if len(t) == 0:
+        return None
+    t_first = t[0]
+    t_last = max(t[-1], samples[END_FIELD][0]) if END_FIELD in samples else t[-1]
+
+    mask = cutoff_mask(samples["azimuth"], samples["elevation"], *cutoff)
+    mask &= (samples["idsat"] >= 0) & (samples["idsat"] < max_sats)
+
+    win = (t - offset) // window
+    win_start = win * window + offset
+    mask &= (win_start >= t_first) & (win_start + window <= t_last)
+
+    win = win[mask]
+    idsat = samples["idsat"][mask].astype(np.int64)
+    key = win * max_sats + idsat
+    # l'ordinamento stabile mantiene la sequenza temporale dei campioni nel gruppo
+    order = np.argsort(key, kind="stable")
+    key = key[order]
+    if len(key) == 0:
+        return None
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    n = np.diff(np.r_[starts, len(key)]).astype(np.float64)
+
+    def group_sum(values):
+        return np.add.reduceat(values[mask][order].astype(np.float64), starts)
+
+    cn0 = samples["cn0"][mask][order].astype(np.float64)
+    i = np.power(10.0, cn0 / 10)
+    # sum() per gruppo invece di np.add.reduceat: da Python 3.12 sum() è compensata
+    # come le somme correnti della console, e S4C dopo l'arrotondamento resta identico
+    bounds = np.r_[starts, len(key)].tolist()
+    groups = list(zip(bounds[:-1], bounds[1:]))
+    values = i.tolist()
+    sum_i = np.array([sum(values[a:b]) for a, b in groups])
+    values = (i ** 2).tolist()
+    sum_i2 = np.array([sum(values[a:b]) for a, b in groups])
+
+    # stessi arrotondamenti di med() e s4c() della console
+    k = sum_i2 / n
+    j = (sum_i / n) ** 2
+    valid = (j > 0) & (k >= j)
+    s4c = np.zeros(len(starts))
+    s4c[valid] = np.trunc(np.power((k[valid] - j[valid]) / j[valid], 0.5) * 100 + 0.5) / 100
+
+    return {
+        "start": key[starts] // max_sats * window + offset,
+        "idsat": key[starts] % max_sats,
+        "azimuth": np.trunc(group_sum(samples["azimuth"]) / n * 10 + 0.5) / 10,
+        "elevation": np.trunc(group_sum(samples["elevation"]) / n * 10 + 0.5) / 10,
+        "cn0": np.trunc(group_sum(samples["cn0"]) / n * 10 + 0.5) / 10,
+        "s4c": s4c,
+        "valid": valid,
+        "window": window,
+    }
+
+
+def write_csv(result, station, csv_path):
+    """
+    Scrive i risultati nei file gps_<stazione>_<data>.csv, sovrascrivendoli.
+
+    Come nella console, il file è scelto in base alla data di chiusura della
+    finestra, mentre il timestamp della riga è quello del suo inizio; S4C non
+    calcolabile viene scritto come 0, uno S4C nullo come 0.0.
+    """
+    window = result["window"]
+    files = {}
+    labels = {}
+    for start, idsat, az, alt, cn0, s4c, valid in zip(result["start"].tolist(), result["idsat"].tolist(),
+                                                       result["azimuth"].tolist(), result["elevation"].tolist(),
+                                                       result["cn0"].tolist(), result["s4c"].tolist(),
+                                                       result["valid"].tolist()):
+        if start not in labels:
+            end = datetime.fromtimestamp(start + window, timezone.utc)
+            labels[start] = (datetime.fromtimestamp(start, timezone.utc).strftime("%y%m%d%H%M"),
+                             end.strftime("%d%m%y"))
+        timesat, date = labels[start]
+        if not valid:
+            # come s4c() della console, che in questo caso restituisce l'intero 0
+            s4c = 0
+        files.setdefault(date, []).append(f"{timesat},{idsat},{az},{alt},{cn0},{s4c}\n")
+
+    written = []
+    for date, rows in files.items():
+        logfile = Path(csv_path) / f"gps_{station}_{date}.csv"
+        with open(logfile, "w") as f:
+            f.write("".join(rows))
+        written.append(logfile)
+    return written
+
+
+def main():
+    args = parse_arguments()
+
+    azimuth_start, azimuth_end = parse_cutoff_interval(args.azimuth_cutoff, 360)
+    elevation_start, elevation_end = parse_cutoff_interval(args.elevation_cutoff, 90)
+
+    t0 = time.perf_counter()
+    samples = load_samples(args.inputs)
+    t1 = time.perf_counter()
+    print(f"Caricati {len(samples['t'])} campioni in {t1 - t0:.2f} s")
+
+    if args.save_samples:
+        save_samples(args.save_samples, samples)
+        print(f"Campioni salvati in {args.save_samples}")
+
+    result = compute_windows(samples, (azimuth_start, azimuth_end, elevation_start, elevation_end),
+                             args.max_sats, args.window, args.offset)
+    t2 = time.perf_counter()
+    if result is None:
+        print("Nessuna finestra completa da elaborare.")
+        sys.exit(1)
+    print(f"Calcolate {len(result['start'])} righe in {t2 - t1:.3f} s "
+          f"({len(samples['t']) / max(t2 - t1, 1e-9) / 1e6:.1f} M campioni/s)")
+
+    for logfile in write_csv(result, args.station, args.csv_path):
+        print(f"Scritto {logfile}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Statistiche di funzionamento della console.
+
+Durante l'acquisizione vengono contati frasi NMEA per tipo, checksum errati,
+righe incomplete o non decodificabili, campioni accettati e scartati (fuori dalla
+finestra di cutoff o con idsat oltre --max_sats), righe perse dalla coda di
+lettura e righe scritte; con istogrammi a intervalli fissi vengono misurati il
+tempo di chiusura del minuto, l'attesa delle righe nella coda di lettura e
+l'intervallo tra frasi RMC consecutive (la cui dispersione indica un host
+sovraccarico o una seriale in difficoltà).
+
+Alla chiusura di ogni minuto le statistiche vengono pubblicate come una riga
+sulla console e/o come file di testo nel formato di Prometheus (da leggere con
+il textfile collector di node_exporter). I contatori sono interi incrementati
+sul posto e un istogramma costa una ricerca binaria su una dozzina di valori,
+quindi la misura pesa poco rispetto alla decodifica delle frasi.
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import os
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+# limiti superiori degli intervalli degli istogrammi, in secondi
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0)
+# anche attorno a 0.1-0.5 s, per i ricevitori che trasmettono più epoche al secondo
+RMC_BUCKETS = (0.05, 0.09, 0.11, 0.15, 0.19, 0.21, 0.3, 0.5, 0.9, 0.95, 0.99, 1.01, 1.05, 1.1, 1.5, 2.0, 5.0)
+
+
+def label_value(value):
+    """
+    Valore di un'etichetta Prometheus, con le sequenze di escape del formato testuale.
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    """
+    Istogramma cumulativo a intervalli fissi, con somma e massimo dell'ultimo minuto.
+    """
+    __slots__ = ("bounds", "counts", "count", "sum", "minute_max", "minute_count", "minute_sum", "minute_sumsq")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.reset_minute()
+
+    def reset_minute(self):
+        self.minute_max = 0.0
+        self.minute_count = 0
+        self.minute_sum = 0.0
+        self.minute_sumsq = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.minute_count += 1
+        self.minute_sum += value
+        self.minute_sumsq += value * value
+        if value > self.minute_max:
+            self.minute_max = value
+
+    def minute_mean_std(self):
+        n = self.minute_count
+        if not n:
+            return 0.0, 0.0
+        mean = self.minute_sum / n
+        return mean, max(self.minute_sumsq / n - mean * mean, 0.0) ** 0.5
+
+    def prometheus(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class ConsoleStats:
+    """
+    Raccoglie le statistiche di una stazione e le pubblica a ogni minuto.
+
+    counters è l'NmeaCounters passato a read_sentence(); reader il SerialReader,
+    se la lettura avviene in un thread separato.
+    """
+
+    def __init__(self, station, counters, reader=None, path=None, show=True, prefix=""):
+        self.station = station
+        self.counters = counters
+        self.reader = reader
+        self.path = Path(path) if path else None
+        self.show = show
+        self.prefix = prefix
+        self.minute_close = Histogram(LATENCY_BUCKETS)
+        self.read_latency = Histogram(LATENCY_BUCKETS)
+        self.rmc_interval = Histogram(RMC_BUCKETS)
+        self.last_rmc = None
+        self.minutes = 0
+        self.previous = {}
+
+    def line(self, is_rmc):
+        """
+        Registra una riga elaborata, dopo la sua lettura.
+        """
+        if self.reader is not None:
+            if self.reader.latency is None:
+                # la lettura è scaduta senza righe: non c'è attesa in coda da misurare
+                return
+            self.read_latency.observe(self.reader.latency)
+            received = self.reader.received
+        else:
+            received = time.monotonic()
+        if is_rmc:
+            if self.last_rmc is not None:
+                self.rmc_interval.observe(received - self.last_rmc)
+            self.last_rmc = received
+
+    def snapshot(self, station):
+        c = self.counters
+        values = {
+            "sentences": sum(c.types.values()),
+            "checksum": c.checksum_errors,
+            "malformed": c.malformed,
+            "incomplete": c.incomplete,
+            "accepted": station.accepted,
+            "cutoff": station.rejected_cutoff,
+            "max_sats": station.rejected_max_sats,
+            "rows": station.rows_written,
+        }
+        if self.reader is not None:
+            values["dropped"] = self.reader.dropped
+        return values
+
+    def minute_closed(self, station, timesat, seconds):
+        """
+        Registra la durata della chiusura del minuto e pubblica le statistiche.
+        """
+        self.minute_close.observe(seconds)
+        self.minutes += 1
+        values = self.snapshot(station)
+        if self.show:
+            delta = {k: v - self.previous.get(k, 0) for k, v in values.items()}
+            types = " ".join(f"{k.decode()} {v}" for k, v in sorted(self.counters.types.items()))
+            mean, std = self.rmc_interval.minute_mean_std()
+            text = (f"[stats] {timesat} frasi {delta['sentences']}, checksum errati {delta['checksum']}, "
+                    f"illeggibili {delta['malformed'] + delta['incomplete']}, campioni {delta['accepted']} "
+                    f"(scartati cutoff {delta['cutoff']}, max_sats {delta['max_sats']}), righe {delta['rows']}, "
+                    f"chiusura {seconds * 1000:.1f} ms, RMC ogni {mean:.3f}±{std:.3f} s")
+            if self.reader is not None:
+                text += (f", attesa in coda max {self.read_latency.minute_max * 1000:.1f} ms, "
+                         f"righe perse {delta['dropped']}")
+            print(self.prefix + text + f" | totale per tipo: {types}")
+        self.previous = values
+        if self.path is not None:
+            try:
+                self.write(station, values)
+            except OSError as e:
+                print(self.prefix + f"Attenzione: impossibile scrivere le statistiche in {self.path}: {e}")
+        self.read_latency.reset_minute()
+        self.rmc_interval.reset_minute()
+        self.minute_close.reset_minute()
+
+    def write(self, station, values):
+        """
+        Scrive il file delle metriche nel formato testuale di Prometheus, sostituendolo in modo atomico.
+        """
+        labels = f'station="{label_value(self.station)}"'
+        out = []
+
+        def metric(name, kind, help_text, samples):
+            out.append(f"# HELP sharemysky_{name} {help_text}")
+            out.append(f"# TYPE sharemysky_{name} {kind}")
+            out.extend(samples)
+
+        metric("sentences_total", "counter", "Frasi NMEA ricevute per tipo",
+               [f'sharemysky_sentences_total{{{labels},type="{k.decode()}"}} {v}'
+                for k, v in sorted(self.counters.types.items())])
+        metric("checksum_errors_total", "counter", "Frasi con checksum errato",
+               [f"sharemysky_checksum_errors_total{{{labels}}} {values['checksum']}"])
+        metric("bad_lines_total", "counter", "Righe incomplete o non decodificabili",
+               [f'sharemysky_bad_lines_total{{{labels},reason="incomplete"}} {values["incomplete"]}',
+                f'sharemysky_bad_lines_total{{{labels},reason="malformed"}} {values["malformed"]}'])
+        metric("samples_total", "counter", "Campioni GSV accettati e scartati",
+               [f'sharemysky_samples_total{{{labels},result="accepted"}} {values["accepted"]}',
+                f'sharemysky_samples_total{{{labels},result="cutoff"}} {values["cutoff"]}',
+                f'sharemysky_samples_total{{{labels},result="max_sats"}} {values["max_sats"]}'])
+        metric("rows_written_total", "counter", "Righe scritte nei file CSV",
+               [f"sharemysky_rows_written_total{{{labels}}} {values['rows']}"])
+        metric("minutes_total", "counter", "Minuti chiusi",
+               [f"sharemysky_minutes_total{{{labels}}} {self.minutes}"])
+        if self.reader is not None:
+            stats = self.reader.stats()
+            metric("serial_lines_dropped_total", "counter", "Righe perse per coda di lettura piena",
+                   [f"sharemysky_serial_lines_dropped_total{{{labels}}} {stats['dropped']}"])
+            metric("serial_queue_high_water", "gauge", "Riempimento massimo della coda di lettura",
+                   [f"sharemysky_serial_queue_high_water{{{labels}}} {stats['high_water']}"])
+            metric("read_latency_seconds", "histogram", "Attesa delle righe nella coda di lettura",
+                   self.read_latency.prometheus("sharemysky_read_latency_seconds", labels))
+        if station.uploader is not None:
+            stats = station.uploader.stats()
+            metric("upload_pending_rows", "gauge", "Righe in attesa di invio al server",
+                   [f"sharemysky_upload_pending_rows{{{labels}}} {stats['pending']}"])
+            metric("upload_failures_total", "counter", "Invii al server non riusciti",
+                   [f"sharemysky_upload_failures_total{{{labels}}} {stats['failures']}"])
+        metric("minute_close_seconds", "histogram", "Durata della chiusura del minuto",
+               self.minute_close.prometheus("sharemysky_minute_close_seconds", labels))
+        metric("rmc_interval_seconds", "histogram", "Intervallo tra frasi RMC consecutive",
+               self.rmc_interval.prometheus("sharemysky_rmc_interval_seconds", labels))
+
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w") as f:
+            f.write("\n".join(out) + "\n")
+        os.replace(tmp, self.path)
@@ -0,0 +1,474 @@
+"""
+Generatore deterministico di dati sintetici per Share My Sky.
+
+Un modello di cielo semplificato (SkyModel) descrive per ogni satellite una
+traccia di azimut ed elevazione, un C/N0 che cresce con l'elevazione e un indice
+di scintillazione di fondo con episodi di scintillazione intensa, distribuiti
+nelle ore serali di ogni giorno (UTC) oppure indicati esplicitamente. Tutto
+dipende solo dal seme: a parità di parametri si ottengono gli stessi byte.
+
+Dal modello si ottengono:
+  - flussi NMEA RMC/GGA/GSV (a richiesta anche VTG, GSA e GLL) come quelli di
+    un ricevitore, da 1 a 10 Hz, con una frazione di frasi con checksum errato,
+    date precedenti al rollover della settimana GPS (1024 settimane indietro,
+    come i ricevitori vecchi) e orari con o senza millisecondi; vengono
+    salvati come cattura .smscap da rileggere con gps_sms_console.py --replay,
+    oppure come testo NMEA;
+  - con --ubx, le stesse epoche come frame binari UBX NAV-POSLLH, NAV-TIMEUTC
+    e NAV-SVINFO o NAV-SAT: a parità di seme una cattura UBX e una NMEA danno
+    gli stessi file CSV;
+  - file gps_<stazione>_<data>.csv al minuto nel formato della console, per
+    provare i programmi di PlotMySky su giorni, mesi o anni di dati.
+
+Uso:
+    python sms_synth.py synth.smscap --minutes 60 --rate 10 --checksum_errors 0.01
+    python sms_synth.py vecchio.nmea --minutes 10 --rollover --no_millis
+    python sms_synth.py synth_ubx.smscap --minutes 60 --rate 10 --ubx sat
+    python sms_synth.py /tmp/synth --csv --days 30 --station SYNTH
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import argparse
+import calendar
+import struct
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+
+from sms_capture import CaptureWriter
+from sms_nmea import checksum
+from sms_ubx import CLS_NAV, NAV_MESSAGES, NAV_POSLLH, NAV_SAT, NAV_SVINFO, NAV_TIMEUTC, frame
+
+DEFAULT_SATS = 24
+DEFAULT_START = "2023-11-17 00:00"
+MAX_RATE = 10
+# frasi emesse da nmea_stream, tra RMC, VTG, GGA, GSA, GSV e GLL
+DEFAULT_SENTENCES = ("RMC", "GGA", "GSV")
+ALL_SENTENCES = ("RMC", "VTG", "GGA", "GSA", "GSV", "GLL")
+
+# periodo orbitale GPS (mezzo giorno siderale), in secondi
+ORBIT_PERIOD = 43082.0
+# elevazione minima perché un satellite compaia nelle frasi GSV
+VISIBLE_ELEVATION = 5.0
+# indice di scintillazione in assenza di episodi
+BASE_S4 = 0.04
+# gli episodi casuali iniziano tra le 18 e le 23 UTC e durano da 15 a 90 minuti
+EPISODE_HOURS = (18, 23)
+EPISODE_MINUTES = (15, 90)
+
+ROLLOVER = timedelta(weeks=1024)
+
+# inizio del tempo GPS (6 gennaio 1980) e secondi intercalari rispetto a UTC, per l'iTOW dei messaggi UBX
+GPS_EPOCH = 315964800
+LEAP_SECONDS = 18
+WEEK_MS = 7 * 86400 * 1000
+
+# blocco di istanti calcolati insieme dal modello
+_CHUNK_SECONDS = 60
+
+
+def parse_start(text):
+    """
+    Istante iniziale "AAAA-MM-GG" o "AAAA-MM-GG HH:MM[:SS]" (UTC) in secondi epoch.
+    """
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return calendar.timegm(datetime.strptime(text, fmt).timetuple())
+        except ValueError:
+            pass
+    raise ValueError(f"Data non valida: '{text}' (usare AAAA-MM-GG o AAAA-MM-GG HH:MM)")
+
+
+class SkyModel:
+    """
+    Tracce, C/N0 e scintillazione di sats satelliti (PRN da 1 a sats).
+
+    Ogni satellite è visibile per circa metà del tempo. episodes_per_day episodi
+    casuali vengono collocati ogni giorno in base al seme e al giorno stesso, per
+    cui un giorno ha sempre gli stessi episodi qualunque sia l'inizio del flusso;
+    episodes è una lista di episodi espliciti (inizio epoch, durata in minuti,
+    picco di S4).
+    """
+
+    def __init__(self, sats=DEFAULT_SATS, seed=0, episodes_per_day=1, episodes=()):
+        rng = np.random.default_rng([seed, 0])
+        self.sats = sats
+        self.seed = seed
+        self.episodes_per_day = episodes_per_day
+        self.explicit = [(float(start), float(start) + minutes * 60, peak) for start, minutes, peak in episodes]
+        self.prn = np.arange(1, sats + 1)
+        self.phase = rng.uniform(0, 2 * np.pi, sats)
+        self.max_elevation = rng.uniform(35, 88, sats)
+        self.azimuth0 = rng.uniform(0, 360, sats)
+        self.direction = rng.choice([-1.0, 1.0], sats)
+        self._days = {}
+
+    def day_episodes(self, day):
+        """
+        Episodi (inizio, fine, picco) del giorno numero day dall'epoch.
+        """
+        if day not in self._days:
+            rng = np.random.default_rng([self.seed, 1, day])
+            episodes = []
+            for _ in range(self.episodes_per_day):
+                start = day * 86400 + rng.uniform(EPISODE_HOURS[0], EPISODE_HOURS[1]) * 3600
+                length = rng.uniform(*EPISODE_MINUTES) * 60
+                episodes.append((start, start + length, rng.uniform(0.4, 1.0)))
+            self._days[day] = episodes
+        return self._days[day]
+
+    def positions(self, t):
+        """
+        Azimut ed elevazione in gradi agli istanti t, array di forma (len(t), sats).
+        """
+        x = 2 * np.pi * np.asarray(t, dtype=float)[:, None] / ORBIT_PERIOD + self.phase
+        elevation = self.max_elevation * np.sin(x)
+        azimuth = (self.azimuth0 + self.direction * np.degrees(x) / 2) % 360
+        return azimuth, elevation
+
+    def s4(self, t, elevation):
+        """
+        Indice di scintillazione atteso agli istanti t, più forte a bassa elevazione.
+        """
+        t = np.asarray(t, dtype=float)
+        level = np.full(len(t), BASE_S4)
+        days = np.floor(t / 86400).astype(np.int64)
+        # un episodio serale può proseguire oltre la mezzanotte
+        episodes = list(self.explicit)
+        for day in range(int(days.min()) - 1, int(days.max()) + 1):
+            episodes.extend(self.day_episodes(day))
+        for start, end, peak in episodes:
+            inside = (t >= start) & (t < end)
+            if inside.any():
+                level[inside] += peak * np.sin(np.pi * (t[inside] - start) / (end - start))
+        return level[:, None] * (1 + 0.5 * np.cos(np.radians(np.clip(elevation, 0, 90))))
+
+    @staticmethod
+    def mean_cn0(elevation):
+        return 28 + 20 * np.sin(np.radians(np.clip(elevation, 0, 90)))
+
+
+def nmea_time(t, millis=True):
+    """
+    Orario hhmmss.ss (o hhmmss) e data ddmmyy delle frasi RMC per l'istante t.
+    """
+    cs = int(round(t * 100))
+    when = datetime.fromtimestamp(cs // 100, timezone.utc)
+    hhmmss = when.strftime("%H%M%S")
+    if millis:
+        hhmmss += f".{cs % 100:02d}"
+    return hhmmss, when
+
+
+def _degrees_minutes(value, width):
+    degrees = int(abs(value))
+    return f"{degrees:0{width}d}{(abs(value) - degrees) * 60:08.5f}"
+
+
+def sentence(payload, corrupt=False):
+    """
+    Frase completa di checksum; con corrupt=True il checksum è sbagliato.
+    """
+    payload = payload.encode("ascii")
+    ck = checksum(payload)
+    if corrupt:
+        ck ^= 0x5A
+    return b"$" + payload + b"*%02X\r\n" % ck
+
+
+def gsv_sentences(sats, corrupt):
+    """
+    Frasi GPGSV (4 satelliti per frase) per la lista di (prn, elevazione, azimut, cn0).
+    """
+    total = max(1, (len(sats) + 3) // 4)
+    out = []
+    for i in range(total):
+        fields = "".join(f",{prn:02d},{el:02d},{az:03d},{cn0:02d}" for prn, el, az, cn0 in sats[i * 4:i * 4 + 4])
+        out.append(sentence(f"GPGSV,{total},{i + 1},{len(sats):02d}{fields}", corrupt()))
+    return out
+
+
+def epochs(start, seconds, sky, rate=1, seed=0):
+    """
+    Genera le epoche (istante, satelliti) di un ricevitore a rate Hz per seconds secondi.
+
+    I satelliti sono i (prn, elevazione, azimut, cn0) di quelli visibili; il C/N0
+    di ogni campione oscilla attorno al valore medio con l'intensità del segnale
+    modulata dall'indice di scintillazione del modello. Il rumore dipende dal
+    seme e dal secondo di partenza, quindi flussi generati un pezzo alla volta
+    non si ripetono.
+    """
+    if not 1 <= rate <= MAX_RATE:
+        raise ValueError(f"La frequenza deve essere tra 1 e {MAX_RATE} Hz")
+    rng = np.random.default_rng([seed, 2, int(start)])
+    count = int(round(seconds * rate))
+    step = _CHUNK_SECONDS * rate
+    for first in range(0, count, step):
+        t = start + np.arange(first, min(first + step, count)) / rate
+        azimuth, elevation = sky.positions(t)
+        s4 = sky.s4(t, elevation)
+        intensity = np.maximum(1 + s4 * rng.standard_normal(s4.shape), 0.01) * 10 ** (sky.mean_cn0(elevation) / 10)
+        cn0 = np.clip(np.rint(10 * np.log10(intensity)), 0, 99).astype(int)
+        visible = elevation >= VISIBLE_ELEVATION
+        az = np.rint(azimuth).astype(int) % 360
+        el = np.rint(elevation).astype(int)
+        for k in range(len(t)):
+            yield t[k], [(int(sky.prn[j]), int(el[k, j]), int(az[k, j]), int(cn0[k, j]))
+                         for j in np.flatnonzero(visible[k])]
+
+
+def _error_source(seed, start, checksum_errors):
+    errors = np.random.default_rng([seed, 3, int(start)])
+
+    def corrupt():
+        return checksum_errors > 0 and errors.random() < checksum_errors
+
+    return corrupt
+
+
+def nmea_stream(start, seconds, sky, rate=1, seed=0, checksum_errors=0.0, rollover=False, millis=True,
+                lat=45.5, lon=9.2, sentences=DEFAULT_SENTENCES):
+    """
+    Genera le coppie (istante, frase) delle epoche di epochs().
+
+    Per ogni epoca vengono emesse, nell'ordine dei ricevitori u-blox, le frasi
+    indicate in sentences tra RMC, VTG, GGA, GSA, GSV (quelle dei satelliti
+    visibili) e GLL.
+    """
+    corrupt = _error_source(seed, start, checksum_errors)
+    position = f"{_degrees_minutes(lat, 2)},{'N' if lat >= 0 else 'S'},{_degrees_minutes(lon, 3)},{'E' if lon >= 0 else 'W'}"
+    for t, sats in epochs(start, seconds, sky, rate, seed):
+        hhmmss, when = nmea_time(t, millis)
+        if rollover:
+            when -= ROLLOVER
+        date = when.strftime("%d%m%y")
+        if "RMC" in sentences:
+            yield t, sentence(f"GPRMC,{hhmmss},A,{position},0.01,,{date},,,A", corrupt())
+        if "VTG" in sentences:
+            yield t, sentence("GPVTG,,T,,M,0.010,N,0.019,K,A", corrupt())
+        if "GGA" in sentences:
+            yield t, sentence(f"GPGGA,{hhmmss},{position},1,{min(len(sats), 12):02d},0.9,120.5,M,47.0,M,,",
+                              corrupt())
+        if "GSA" in sentences:
+            used = ",".join([f"{prn:02d}" for prn, *_ in sats[:12]] + [""] * (12 - min(len(sats), 12)))
+            yield t, sentence(f"GPGSA,A,3,{used},1.52,0.90,1.22", corrupt())
+        if "GSV" in sentences:
+            for line in gsv_sentences(sats, corrupt):
+                yield t, line
+        if "GLL" in sentences:
+            yield t, sentence(f"GPGLL,{position},{hhmmss},A,A", corrupt())
+
+
+def _ubx(msg_id, payload, corrupt):
+    """
+    Frame UBX della classe NAV; con corrupt=True il checksum è sbagliato.
+    """
+    data = frame(CLS_NAV, msg_id, payload)
+    if corrupt:
+        data = data[:-1] + bytes((data[-1] ^ 0x5A,))
+    return data
+
+
+def gps_itow(t):
+    """
+    Millisecondi della settimana GPS all'istante UTC t.
+    """
+    return int(round((t - GPS_EPOCH + LEAP_SECONDS) * 1000)) % WEEK_MS
+
+
+def nav_posllh(t, lat, lon, corrupt=False):
+    return _ubx(NAV_POSLLH, struct.pack("<IiiiiII", gps_itow(t), round(lon * 1e7), round(lat * 1e7),
+                                        167500, 120500, 2500, 3500), corrupt)
+
+
+def nav_timeutc(t, corrupt=False):
+    cs = int(round(t * 100))
+    when = datetime.fromtimestamp(cs // 100, timezone.utc)
+    # tAcc 20 ns; valid: validTOW, validWKN e validUTC
+    return _ubx(NAV_TIMEUTC, struct.pack("<IIiHBBBBBB", gps_itow(t), 20, cs % 100 * 10000000, when.year,
+                                         when.month, when.day, when.hour, when.minute, when.second, 0x07), corrupt)
+
+
+def nav_svinfo(t, sats, corrupt=False):
+    """
+    NAV-SVINFO (u-blox 7): un canale per satellite, con flags svUsed, orbitAvail e orbitEph.
+    """
+    payload = struct.pack("<IBBH", gps_itow(t), len(sats), 0x04, 0)
+    payload += b"".join(struct.pack("<BBBBBbhi", chn, prn, 0x0D, 7, cn0, el, az, 0)
+                        for chn, (prn, el, az, cn0) in enumerate(sats))
+    return _ubx(NAV_SVINFO, payload, corrupt)
+
+
+def nav_sat(t, sats, corrupt=False):
+    """
+    NAV-SAT (u-blox 8 e successivi): satelliti GPS usati, sani e con effemeridi.
+    """
+    payload = struct.pack("<IBBH", gps_itow(t), 1, len(sats), 0)
+    payload += b"".join(struct.pack("<BBBbhhI", 0, prn, cn0, el, az, 0, 0x0F | 0x10 | 0x100)
+                        for prn, el, az, cn0 in sats)
+    return _ubx(NAV_SAT, payload, corrupt)
+
+
+def ubx_stream(start, seconds, sky, rate=1, seed=0, checksum_errors=0.0, nav="svinfo", lat=45.5, lon=9.2):
+    """
+    Genera le coppie (istante, frame) delle epoche di epochs() come messaggi UBX:
+    NAV-POSLLH, NAV-TIMEUTC e NAV-SVINFO o NAV-SAT, nell'ordine dei ricevitori u-blox.
+    """
+    sats_message = {NAV_SVINFO: nav_svinfo, NAV_SAT: nav_sat}[NAV_MESSAGES[nav]]
+    corrupt = _error_source(seed, start, checksum_errors)
+    for t, sats in epochs(start, seconds, sky, rate, seed):
+        yield t, nav_posllh(t, lat, lon, corrupt())
+        yield t, nav_timeutc(t, corrupt())
+        yield t, sats_message(t, sats, corrupt())
+
+
+def write_nmea(path, stream, start):
+    """
+    Salva il flusso come cattura .smscap oppure, per le altre estensioni, come
+    testo NMEA (o byte UBX di seguito). Restituisce il numero di frasi scritte.
+    """
+    count = 0
+    if Path(path).suffix == ".smscap":
+        writer = CaptureWriter(path, start=start)
+        try:
+            for t, line in stream:
+                writer.write(line, t)
+                count += 1
+        finally:
+            writer.close()
+    else:
+        with open(path, "wb") as f:
+            for _, line in stream:
+                f.write(line)
+                count += 1
+    return count
+
+
+def minute_rows(sky, day, seed=0):
+    """
+    Righe al minuto del file giornaliero del giorno numero day dall'epoch.
+
+    Come la console, il file di un giorno contiene i minuti dalle 23:59 del giorno
+    precedente alle 23:58. Restituisce un DataFrame con le colonne dei CSV.
+    """
+    import pandas as pd
+
+    rng = np.random.default_rng([seed, 4, day])
+    minutes = np.arange(day * 1440 - 1, day * 1440 + 1439)
+    t = minutes * 60 + 30.0
+    azimuth, elevation = sky.positions(t)
+    s4 = sky.s4(t, elevation)
+    cn0 = sky.mean_cn0(elevation) + 0.8 * rng.standard_normal(elevation.shape)
+    s4c = np.maximum(s4 * (1 + 0.15 * rng.standard_normal(s4.shape)), 0)
+
+    rows, sats = np.nonzero(elevation >= VISIBLE_ELEVATION)
+    stamps = pd.to_datetime(minutes * 60, unit="s").strftime("%y%m%d%H%M").to_numpy()
+    return pd.DataFrame({
+        "timestamp": stamps[rows],
+        "idsat": sky.prn[sats],
+        "azimuth": np.round(azimuth[rows, sats], 1),
+        "elevation": np.round(elevation[rows, sats], 1),
+        "cn0": np.round(cn0[rows, sats], 1),
+        "s4c": np.round(s4c[rows, sats], 2),
+    })
+
+
+def write_csv_days(directory, station, first_day, days, sky, seed=0, overwrite=False):
+    """
+    Scrive days file gps_<stazione>_<ddmmyy>.csv a partire dal giorno first_day
+    (numero di giorni dall'epoch); i file già presenti vengono tenuti se overwrite
+    è False. Restituisce l'elenco dei percorsi in ordine di data.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for day in range(first_day, first_day + days):
+        date = datetime.fromtimestamp(day * 86400, timezone.utc).strftime("%d%m%y")
+        path = directory / f"gps_{station}_{date}.csv"
+        if overwrite or not path.exists():
+            tmp = path.with_suffix(".tmp")
+            minute_rows(sky, day, seed).to_csv(tmp, header=False, index=False)
+            tmp.replace(path)
+        paths.append(path)
+    return paths
+
+
+def parse_arguments():
+    """
+    Gestisce i parametri da linea di comando.
+    """
+    parser = argparse.ArgumentParser(description="Genera flussi NMEA o file CSV sintetici e riproducibili "
+                                                 "per provare e misurare Share My Sky")
+    parser.add_argument("output", type=str,
+                        help="File di uscita (.smscap per una cattura, altrimenti testo NMEA) oppure, con --csv, "
+                             "la cartella dei file giornalieri")
+    parser.add_argument("--start", type=str, default=DEFAULT_START,
+                        help=f"Inizio dei dati, AAAA-MM-GG [HH:MM[:SS]] UTC (default: {DEFAULT_START})")
+    parser.add_argument("--minutes", type=float, default=10, help="Durata del flusso NMEA in minuti (default: 10)")
+    parser.add_argument("--sats", type=int, default=DEFAULT_SATS,
+                        help=f"Numero di satelliti della costellazione, ne è visibile circa metà "
+                             f"(default: {DEFAULT_SATS})")
+    parser.add_argument("--rate", type=int, default=1, help=f"Epoche al secondo, da 1 a {MAX_RATE} (default: 1)")
+    parser.add_argument("--seed", type=int, default=0, help="Seme del generatore (default: 0)")
+    parser.add_argument("--episodes", type=int, default=1,
+                        help="Episodi di scintillazione casuali per giorno, tra le 18 e le 23 UTC (default: 1)")
+    parser.add_argument("--episode", type=str, nargs=3, action="append", default=[],
+                        metavar=("INIZIO", "MINUTI", "S4"),
+                        help='Episodio esplicito, es. --episode "2023-11-17 20:30" 40 0.8 (ripetibile)')
+    parser.add_argument("--checksum_errors", type=float, default=0.0,
+                        help="Frazione di frasi con checksum errato (default: 0)")
+    parser.add_argument("--rollover", action="store_true",
+                        help="Date RMC 1024 settimane indietro, come i ricevitori precedenti al rollover del 2019")
+    parser.add_argument("--no_millis", action="store_true",
+                        help="Orari RMC/GGA senza millisecondi (hhmmss), come i ricevitori vecchi")
+    parser.add_argument("--sentences", type=str, nargs="+", choices=ALL_SENTENCES, default=list(DEFAULT_SENTENCES),
+                        help=f"Frasi NMEA da generare (default: {' '.join(DEFAULT_SENTENCES)})")
+    parser.add_argument("--ubx", type=str, choices=list(NAV_MESSAGES), default=None,
+                        help="Genera frame UBX NAV-POSLLH, NAV-TIMEUTC e NAV-SVINFO (svinfo) o NAV-SAT (sat) "
+                             "invece delle frasi NMEA")
+    parser.add_argument("--csv", action="store_true",
+                        help="Scrive file CSV giornalieri al minuto invece di un flusso NMEA")
+    parser.add_argument("--days", type=int, default=1, help="Giorni di file CSV da generare (default: 1)")
+    parser.add_argument("--station", type=str, default="SYNTH", help="Nome della stazione dei file CSV")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    try:
+        start = parse_start(args.start)
+        episodes = [(parse_start(s), float(m), float(p)) for s, m, p in args.episode]
+    except ValueError as e:
+        print(f"Errore: {e}")
+        sys.exit(1)
+    if not 1 <= args.rate <= MAX_RATE:
+        print(f"Errore: la frequenza deve essere tra 1 e {MAX_RATE} Hz")
+        sys.exit(1)
+    sky = SkyModel(args.sats, args.seed, args.episodes, episodes)
+
+    t0 = time.perf_counter()
+    if args.csv:
+        paths = write_csv_days(args.output, args.station, start // 86400, args.days, sky, args.seed, overwrite=True)
+        size = sum(p.stat().st_size for p in paths)
+        print(f"Scritti {len(paths)} file in {args.output} ({size / 1e6:.1f} MB, {time.perf_counter() - t0:.1f} s)")
+    else:
+        if args.ubx:
+            stream = ubx_stream(start, args.minutes * 60, sky, args.rate, args.seed, args.checksum_errors, args.ubx)
+        else:
+            stream = nmea_stream(start, args.minutes * 60, sky, args.rate, args.seed, args.checksum_errors,
+                                 args.rollover, not args.no_millis, sentences=args.sentences)
+        count = write_nmea(args.output, stream, start)
+        print(f"Scritti {count} {'frame' if args.ubx else 'frasi'} in {args.output} "
+              f"({time.perf_counter() - t0:.1f} s)")
+
+
+if __name__ == "__main__":
+    main()
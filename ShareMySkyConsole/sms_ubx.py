@@ -0,0 +1,581 @@
+"""
+Configurazione dei ricevitori u-blox e acquisizione con il protocollo binario UBX.
+
+Di fabbrica il ricevitore (u-blox 7020) trasmette a 9600 baud un'epoca al
+secondo, con frasi VTG, GLL e GSA che la console non usa: S4C viene quindi
+calcolato su circa 60 campioni al minuto. configure() invia:
+
+  CFG-MSG   frequenza 0 per le frasi inutilizzate (VTG, GLL, GSA)
+  CFG-PRT   nuova velocità della porta UART, mantenendone modo e protocolli
+  CFG-RATE  periodo di misura per 1-10 epoche al secondo
+  CFG-CFG   salvataggio della configurazione (opzionale)
+
+e attende per ciascun messaggio ACK-ACK (ACK-NAK o nessuna risposta entro il
+timeout sollevano UbxError). La porta viene prima interrogata con un poll di
+CFG-PRT: sulla porta USB la velocità non conta e non viene cambiata. Dopo
+CFG-PRT il ricevitore cambia velocità e la risposta può andare persa, quindi
+anche la porta locale viene portata alla nuova velocità e il cambio viene
+verificato con un nuovo poll; se fallisce si torna alla velocità precedente.
+
+Con nav='svinfo' (u-blox 7) o nav='sat' (u-blox 8 e successivi) vengono
+anche attivati NAV-POSLLH, NAV-TIMEUTC e NAV-SVINFO o NAV-SAT: un solo frame
+binario per epoca contiene tutti i satelliti, invece di tre o più frasi GSV
+da convertire dal testo. UbxSerial divide il flusso della porta in record
+(un frame UBX o una riga NMEA), per cui thread di lettura, --record e --replay
+funzionano come con le sole frasi NMEA; decode() trasforma i frame NAV in
+NavSats, NavTime e NavPos, che Station tratta come GSV e RMC.
+
+Un frame UBX è composto da 0xB5 0x62, classe, id, lunghezza del payload
+(uint16 little endian), payload e checksum di Fletcher a 8 bit su classe, id,
+lunghezza e payload. UbxParser estrae i frame da un flusso di byte in cui sono
+mescolati alle frasi NMEA.
+
+Uso, per configurare il ricevitore una volta sola senza avviare la console:
+    python sms_ubx.py /dev/ttyS0 --rate 10 --new_baudrate 115200 --save
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import argparse
+import struct
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import NamedTuple
+
+from sms_nmea import parse_sentence
+
+SYNC = b"\xb5\x62"
+_HEADER = struct.Struct("<BBH")
+
+CLS_NAV = 0x01
+CLS_ACK = 0x05
+CLS_CFG = 0x06
+CLS_NMEA = 0xF0
+
+ACK_NAK = 0x00
+ACK_ACK = 0x01
+
+CFG_PRT = 0x00
+CFG_MSG = 0x01
+CFG_RATE = 0x08
+CFG_CFG = 0x09
+
+NAV_POSLLH = 0x02
+NAV_TIMEUTC = 0x21
+NAV_SVINFO = 0x30
+NAV_SAT = 0x35
+# messaggio con i satelliti in vista per ciascuna generazione di ricevitori
+NAV_MESSAGES = {"svinfo": NAV_SVINFO, "sat": NAV_SAT}
+
+# id delle frasi NMEA standard nella classe 0xF0
+NMEA_IDS = {"GGA": 0x00, "GLL": 0x01, "GSA": 0x02, "GSV": 0x03, "RMC": 0x04, "VTG": 0x05, "ZDA": 0x08}
+UNUSED_SENTENCES = ("VTG", "GLL", "GSA")
+# con l'acquisizione UBX non serve nessuna frase NMEA
+NMEA_SENTENCES = ("GGA", "GLL", "GSA", "GSV", "RMC", "VTG")
+
+# porte del ricevitore (portID di CFG-PRT)
+PORT_UART1 = 1
+PORT_UART2 = 2
+PORT_USB = 3
+UART_PORTS = (PORT_UART1, PORT_UART2)
+
+# CFG-PRT per una UART: portID, reserved, txReady, mode, baudRate, inProtoMask, outProtoMask, flags, reserved
+_CFG_PRT = struct.Struct("<BBHIIHHHH")
+# CFG-RATE: measRate (ms), navRate (cicli), timeRef (1 = tempo GPS)
+_CFG_RATE = struct.Struct("<HHH")
+# CFG-CFG: clearMask, saveMask, loadMask, deviceMask
+_CFG_CFG = struct.Struct("<IIIB")
+
+PROTO_UBX = 0x01
+PROTO_NMEA = 0x02
+# 8 bit, nessuna parità, 1 bit di stop
+MODE_8N1 = 0x000008D0
+
+MAX_RATE = 10
+# payload più lungo accettato da UbxParser: oltre si tratta di byte spuri
+MAX_PAYLOAD = 4096
+ACK_TIMEOUT = 1.0
+# attesa prima di cambiare la velocità della porta locale dopo CFG-PRT
+BAUD_SWITCH_DELAY = 0.1
+
+# byte per epoca con 12 satelliti in vista: RMC, GGA e tre GSV
+EPOCH_BYTES = 72 + 76 + 3 * 70
+BAUDRATES = (9600, 19200, 38400, 57600, 115200, 230400, 460800)
+
+# payload dei messaggi NAV
+_NAV_HEAD = struct.Struct("<IBBH")
+# NAV-SVINFO: chn, svid, flags, quality, cno, elev, azim, prRes
+_SVINFO_SV = struct.Struct("<BBBBBbhi")
+# NAV-SAT: gnssId, svId, cno, elev, azim, prRes, flags
+_SAT_SV = struct.Struct("<BBBbhhI")
+# NAV-TIMEUTC: iTOW, tAcc, nano, year, month, day, hour, min, sec, valid
+_TIMEUTC = struct.Struct("<IIiHBBBBBB")
+# NAV-POSLLH: iTOW, lon, lat, height, hMSL, hAcc, vAcc
+_POSLLH = struct.Struct("<IiiiiII")
+
+# satelliti GPS: svid da 1 a 32 in NAV-SVINFO, gnssId 0 in NAV-SAT
+GPS_MAX_SVID = 32
+GNSS_GPS = 0
+# NAV-SVINFO flags: posizione del satellite nota
+SVINFO_ORBIT_AVAIL = 0x04
+# NAV-TIMEUTC valid: data e ora UTC valide
+TIMEUTC_VALID_UTC = 0x04
+
+
+class UbxError(Exception):
+    """
+    Il ricevitore ha rifiutato un messaggio o non ha risposto.
+    """
+
+
+class UbxFrame(NamedTuple):
+    cls: int
+    msg_id: int
+    payload: bytes
+
+
+class NavSats(NamedTuple):
+    itow: int  # millisecondi della settimana GPS
+    sats: tuple  # (idsat, elevazione, azimut, cn0) dei satelliti GPS, come Gsv.sats
+
+
+class NavTime(NamedTuple):
+    itow: int
+    time: str  # hhmmss.ss, vuoto se l'ora UTC non è ancora valida
+    date: str  # ddmmyy
+
+
+class NavPos(NamedTuple):
+    itow: int
+    lat: float
+    lon: float
+
+
+def fletcher(data):
+    """
+    Checksum di Fletcher a 8 bit (CK_A, CK_B) dei byte indicati.
+
+    CK_A è la somma dei byte e CK_B la somma delle somme parziali, calcolate
+    entrambe in C da sum() e accumulate() invece che byte per byte.
+    """
+    return sum(data) & 0xFF, sum(accumulate(data)) & 0xFF
+
+
+def frame(cls, msg_id, payload=b""):
+    """
+    Frame UBX completo di sincronismo e checksum.
+    """
+    body = _HEADER.pack(cls, msg_id, len(payload)) + bytes(payload)
+    return SYNC + body + bytes(fletcher(body))
+
+
+class UbxParser:
+    """
+    Estrae i frame UBX da un flusso di byte, scartando tutto il resto (frasi NMEA comprese).
+
+    I frame con checksum errato o lunghezza impossibile vengono contati in errors
+    e la ricerca riprende dal byte successivo al sincronismo.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.errors = 0
+
+    def feed(self, data):
+        """
+        Aggiunge i byte ricevuti e restituisce la lista dei frame completi.
+        """
+        buf = self.buf
+        buf += data
+        frames = []
+        while True:
+            start = buf.find(SYNC)
+            if start < 0:
+                # un 0xB5 finale può essere l'inizio del prossimo sincronismo
+                del buf[:len(buf) - 1 if buf.endswith(SYNC[:1]) else len(buf)]
+                break
+            del buf[:start]
+            if len(buf) < 6:
+                break
+            cls, msg_id, length = _HEADER.unpack_from(buf, 2)
+            if length > MAX_PAYLOAD:
+                self.errors += 1
+                del buf[:2]
+                continue
+            end = 6 + length
+            if len(buf) < end + 2:
+                break
+            view = memoryview(buf)
+            ok = bytes(fletcher(view[2:end])) == view[end:end + 2]
+            payload = bytes(view[6:end])
+            view.release()
+            if not ok:
+                self.errors += 1
+                del buf[:2]
+                continue
+            frames.append(UbxFrame(cls, msg_id, payload))
+            del buf[:end + 2]
+        return frames
+
+
+def cfg_msg(sentence, rate):
+    """
+    CFG-MSG: emette la frase NMEA indicata ogni rate epoche sulla porta corrente (0 la disabilita).
+    """
+    return cfg_msg_id(CLS_NMEA, NMEA_IDS[sentence], rate)
+
+
+def cfg_msg_id(cls, msg_id, rate):
+    """
+    CFG-MSG per un messaggio qualsiasi, indicato da classe e id.
+    """
+    return frame(CLS_CFG, CFG_MSG, bytes((cls, msg_id, rate)))
+
+
+def cfg_prt(port_id, baudrate, mode=MODE_8N1, in_proto=PROTO_UBX | PROTO_NMEA, out_proto=PROTO_UBX | PROTO_NMEA):
+    """
+    CFG-PRT per una porta UART.
+    """
+    return frame(CLS_CFG, CFG_PRT, _CFG_PRT.pack(port_id, 0, 0, mode, baudrate, in_proto, out_proto, 0, 0))
+
+
+def cfg_rate(rate):
+    """
+    CFG-RATE: rate epoche al secondo (da 1 a MAX_RATE).
+    """
+    if not 1 <= rate <= MAX_RATE:
+        raise ValueError(f"La frequenza di navigazione deve essere tra 1 e {MAX_RATE} Hz")
+    return frame(CLS_CFG, CFG_RATE, _CFG_RATE.pack(round(1000 / rate), 1, 1))
+
+
+def cfg_save():
+    """
+    CFG-CFG: salva la configurazione corrente in memoria non volatile.
+    """
+    return frame(CLS_CFG, CFG_CFG, _CFG_CFG.pack(0, 0xFFFF, 0, 0x17))
+
+
+def poll(cls, msg_id, payload=b""):
+    """
+    Richiesta della configurazione corrente (payload vuoto o con il solo identificativo).
+    """
+    return frame(cls, msg_id, payload)
+
+
+def required_baudrate(rate, epoch_bytes=EPOCH_BYTES):
+    """
+    Velocità standard minima per trasmettere rate epoche al secondo, con un margine del 25%.
+    """
+    needed = rate * epoch_bytes * 10 * 1.25
+    for baudrate in BAUDRATES:
+        if baudrate >= needed:
+            return baudrate
+    return BAUDRATES[-1]
+
+
+def wait_for(ser, parser, match, timeout=ACK_TIMEOUT):
+    """
+    Legge dalla porta finché match(frame) restituisce un valore diverso da None o
+    scade il timeout (restituisce None).
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        data = ser.read(max(1, ser.in_waiting))
+        for f in parser.feed(data):
+            result = match(f)
+            if result is not None:
+                return result
+    return None
+
+
+def _ack_of(cls, msg_id):
+    def match(f):
+        if f.cls == CLS_ACK and f.payload[:2] == bytes((cls, msg_id)):
+            return f.msg_id == ACK_ACK
+        return None
+    return match
+
+
+def send(ser, parser, message, timeout=ACK_TIMEOUT):
+    """
+    Invia un messaggio CFG e attende l'ACK; solleva UbxError per NAK o timeout.
+    """
+    cls, msg_id = message[2], message[3]
+    ser.write(message)
+    ser.flush()
+    acked = wait_for(ser, parser, _ack_of(cls, msg_id), timeout)
+    if acked is None:
+        raise UbxError(f"nessuna risposta al messaggio 0x{cls:02X} 0x{msg_id:02X}")
+    if not acked:
+        raise UbxError(f"messaggio 0x{cls:02X} 0x{msg_id:02X} rifiutato dal ricevitore (NAK)")
+
+
+def request(ser, parser, message, timeout=ACK_TIMEOUT):
+    """
+    Invia un poll e restituisce il payload della risposta; solleva UbxError se non arriva.
+    """
+    cls, msg_id = message[2], message[3]
+    ser.write(message)
+    ser.flush()
+    payload = wait_for(ser, parser, lambda f: f.payload if (f.cls, f.msg_id) == (cls, msg_id) else None, timeout)
+    if payload is None:
+        raise UbxError(f"nessuna risposta al poll 0x{cls:02X} 0x{msg_id:02X}")
+    return payload
+
+
+def configure(ser, rate=None, baudrate=None, disable=UNUSED_SENTENCES, save=False, nav=None, log=print):
+    """
+    Configura il ricevitore collegato alla porta ser (pyserial già aperta alla
+    velocità attuale del ricevitore). Alla fine ser è alla nuova velocità.
+
+    nav ('svinfo' o 'sat') attiva a ogni epoca i messaggi NAV per l'acquisizione UBX.
+    """
+    parser = UbxParser()
+    ser.reset_input_buffer()
+    port = request(ser, parser, poll(CLS_CFG, CFG_PRT))
+    port_id = port[0]
+
+    for sentence in disable:
+        send(ser, parser, cfg_msg(sentence, 0))
+    if disable:
+        log(f"Frasi disabilitate: {', '.join(disable)}")
+
+    if nav is not None:
+        for msg_id in (NAV_POSLLH, NAV_TIMEUTC, NAV_MESSAGES[nav]):
+            send(ser, parser, cfg_msg_id(CLS_NAV, msg_id, 1))
+        log(f"Messaggi attivati: NAV-POSLLH, NAV-TIMEUTC, NAV-{nav.upper()}")
+
+    if baudrate is not None and port_id in UART_PORTS and baudrate != ser.baudrate:
+        fields = list(_CFG_PRT.unpack(port[:_CFG_PRT.size]))
+        fields[4] = baudrate
+        old = ser.baudrate
+        ser.write(frame(CLS_CFG, CFG_PRT, _CFG_PRT.pack(*fields)))
+        ser.flush()
+        # l'ACK arriva alla vecchia velocità o si perde nel cambio: la verifica è il poll successivo
+        time.sleep(BAUD_SWITCH_DELAY)
+        ser.baudrate = baudrate
+        ser.reset_input_buffer()
+        parser = UbxParser()
+        try:
+            request(ser, parser, poll(CLS_CFG, CFG_PRT, bytes((port_id,))))
+        except UbxError:
+            ser.baudrate = old
+            raise UbxError(f"il ricevitore non risponde a {baudrate} baud, porta riportata a {old} baud")
+        log(f"Velocità della porta: {old} -> {baudrate} baud")
+    elif baudrate is not None and port_id not in UART_PORTS:
+        log("Ricevitore collegato via USB: la velocità della porta non viene cambiata")
+
+    if rate is not None:
+        if port_id in UART_PORTS and ser.baudrate < required_baudrate(rate):
+            log(f"Attenzione: a {ser.baudrate} baud {rate} epoche al secondo potrebbero non passare "
+                f"(servono almeno {required_baudrate(rate)} baud)")
+        send(ser, parser, cfg_rate(rate))
+        log(f"Frequenza di navigazione: {rate} Hz")
+
+    if save:
+        send(ser, parser, cfg_save())
+        log("Configurazione salvata nel ricevitore")
+
+
+def _svinfo(payload):
+    itow, num_ch, _, _ = _NAV_HEAD.unpack_from(payload)
+    if len(payload) != _NAV_HEAD.size + num_ch * _SVINFO_SV.size:
+        raise ValueError("lunghezza di NAV-SVINFO non valida")
+    return NavSats(itow, tuple((svid, elev, azim, cno) for _, svid, flags, _, cno, elev, azim, _
+                               in _SVINFO_SV.iter_unpack(payload[_NAV_HEAD.size:])
+                               if 0 < svid <= GPS_MAX_SVID and flags & SVINFO_ORBIT_AVAIL))
+
+
+def _sat(payload):
+    itow, _, num_svs, _ = _NAV_HEAD.unpack_from(payload)
+    if len(payload) != _NAV_HEAD.size + num_svs * _SAT_SV.size:
+        raise ValueError("lunghezza di NAV-SAT non valida")
+    # elevazione fuori da +-90 o orbitSource (bit 8-10) nullo: posizione sconosciuta
+    return NavSats(itow, tuple((svid, elev, azim, cno) for gnss, svid, cno, elev, azim, _, flags
+                               in _SAT_SV.iter_unpack(payload[_NAV_HEAD.size:])
+                               if gnss == GNSS_GPS and -90 <= elev <= 90 and flags & 0x700))
+
+
+def _timeutc(payload):
+    itow, _, nano, year, month, day, hour, minute, sec, valid = _TIMEUTC.unpack(payload)
+    if not valid & TIMEUTC_VALID_UTC:
+        return NavTime(itow, "", "")
+    cs = round(nano / 10000000)
+    if 0 <= cs < 100 and sec < 60:
+        return NavTime(itow, f"{hour:02d}{minute:02d}{sec:02d}.{cs:02d}", f"{day:02d}{month:02d}{year % 100:02d}")
+    # nano (anche negativo) corregge l'ora intera; il secondo 60 di un leap second diventa il 59
+    if sec == 60:
+        sec, cs = 59, cs + 100
+    t = datetime(year, month, day, hour, minute, sec) + timedelta(milliseconds=cs * 10)
+    return NavTime(itow, f"{t.hour:02d}{t.minute:02d}{t.second:02d}.{t.microsecond // 10000:02d}",
+                   f"{t.day:02d}{t.month:02d}{t.year % 100:02d}")
+
+
+def _posllh(payload):
+    itow, lon, lat, _, _, _, _ = _POSLLH.unpack(payload)
+    return NavPos(itow, lat * 1e-7, lon * 1e-7)
+
+
+_NAV_DECODERS = {
+    NAV_SVINFO: (b"NAV-SVINFO", _svinfo),
+    NAV_SAT: (b"NAV-SAT", _sat),
+    NAV_TIMEUTC: (b"NAV-TIMEUTC", _timeutc),
+    NAV_POSLLH: (b"NAV-POSLLH", _posllh),
+}
+
+
+def parse_frame(data, counters=None):
+    """
+    Decodifica un frame UBX completo (bytes, come restituito da UbxSerial.readline()).
+
+    Restituisce NavSats, NavTime o NavPos, oppure None per frame incompleti, con
+    checksum errato o di altri messaggi; se counters (NmeaCounters) è indicato,
+    il frame viene contato come le frasi NMEA.
+    """
+    if len(data) < 8 or len(data) != (data[4] | data[5] << 8) + 8:
+        if counters is not None:
+            counters.incomplete += 1
+        return None
+    view = memoryview(data)
+    if fletcher(view[2:-2]) != (data[-2], data[-1]):
+        if counters is not None:
+            counters.checksum_errors += 1
+        return None
+    entry = _NAV_DECODERS.get(data[3]) if data[2] == CLS_NAV else None
+    if entry is None:
+        if counters is not None:
+            counters.types[b"UBX"] = counters.types.get(b"UBX", 0) + 1
+        return None
+    name, decoder = entry
+    try:
+        s = decoder(view[6:-2])
+    except (struct.error, ValueError):
+        if counters is not None:
+            counters.malformed += 1
+        return None
+    if counters is not None:
+        counters.types[name] = counters.types.get(name, 0) + 1
+    return s
+
+
+def decode(data, counters=None):
+    """
+    Decodifica un record del flusso: frame UBX o frase NMEA.
+    """
+    if data[:2] == SYNC:
+        return parse_frame(data, counters)
+    return parse_sentence(data, counters)
+
+
+def read_message(ser, counters=None):
+    """
+    Legge un record dalla porta (o da UbxSerial) e lo decodifica.
+    """
+    return decode(ser.readline(), counters)
+
+
+class UbxSerial:
+    """
+    Avvolge una porta seriale con frame UBX e frasi NMEA mescolati: readline()
+    restituisce un frame completo oppure una riga NMEA, o b"" allo scadere del
+    timeout della porta.
+    """
+
+    # massima lunghezza di una riga senza terminatore prima di restituirla comunque
+    MAX_LINE = 1024
+
+    def __init__(self, ser):
+        self.ser = ser
+        self.buf = bytearray()
+
+    def _next_record(self):
+        buf = self.buf
+        while buf:
+            if buf[:2] == SYNC:
+                if len(buf) < 6:
+                    return None
+                length = buf[4] | buf[5] << 8
+                if length > MAX_PAYLOAD:
+                    # falso sincronismo: i due byte vengono scartati
+                    del buf[:2]
+                    continue
+                if len(buf) < length + 8:
+                    return None
+                record = bytes(buf[:length + 8])
+                del buf[:length + 8]
+                return record
+            if len(buf) == 1 and buf[0] == SYNC[0]:
+                return None
+            # riga NMEA, o byte spuri, fino al fine riga o al prossimo frame
+            end = buf.find(b"\n") + 1
+            sync = buf.find(SYNC, 1)
+            if sync > 0 and (end == 0 or sync < end):
+                end = sync
+            if end == 0:
+                if len(buf) < self.MAX_LINE:
+                    return None
+                end = len(buf)
+            record = bytes(buf[:end])
+            del buf[:end]
+            return record
+        return None
+
+    def readline(self):
+        while True:
+            record = self._next_record()
+            if record is not None:
+                return record
+            data = self.ser.read(max(1, self.ser.in_waiting))
+            if not data:
+                return b""
+            self.buf += data
+
+    def reset_input_buffer(self):
+        self.buf.clear()
+        self.ser.reset_input_buffer()
+
+    def close(self):
+        self.ser.close()
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Configura un ricevitore u-blox con messaggi UBX CFG")
+    parser.add_argument("serial_port", type=str, help="Porta seriale del ricevitore (es: /dev/ttyACM0, COM3)")
+    parser.add_argument("--baudrate", type=int, default=9600,
+                        help="Velocità attuale della porta del ricevitore (default: 9600)")
+    parser.add_argument("--new_baudrate", type=int, default=None, help="Nuova velocità della porta UART")
+    parser.add_argument("--rate", type=int, default=None, help=f"Epoche al secondo, da 1 a {MAX_RATE}")
+    parser.add_argument("--keep", action="store_true", help="Non disabilita le frasi VTG, GLL e GSA")
+    parser.add_argument("--nav", type=str, choices=list(NAV_MESSAGES), default=None,
+                        help="Attiva i messaggi NAV per l'acquisizione UBX e disabilita tutte le frasi NMEA: "
+                             "svinfo per u-blox 7, sat per u-blox 8 e successivi")
+    parser.add_argument("--save", action="store_true", help="Salva la configurazione nel ricevitore")
+    args = parser.parse_args()
+
+    import serial
+
+    try:
+        ser = serial.Serial(args.serial_port, baudrate=args.baudrate, timeout=ACK_TIMEOUT)
+    except serial.SerialException as e:
+        print(f"Errore apertura porta seriale: {e}")
+        sys.exit(1)
+    try:
+        disable = NMEA_SENTENCES if args.nav else () if args.keep else UNUSED_SENTENCES
+        configure(ser, args.rate, args.new_baudrate, disable, args.save, args.nav)
+    except (UbxError, ValueError) as e:
+        print(f"Errore nella configurazione del ricevitore: {e}")
+        sys.exit(1)
+    finally:
+        ser.close()
+
+
+if __name__ == "__main__":
+    main()
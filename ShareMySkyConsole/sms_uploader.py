@@ -0,0 +1,303 @@
+"""
+Invio dei dati della stazione al server di raccolta (ShareMySkyServer/sms_ingest.py).
+
+Le righe di ogni minuto vengono prima accodate in una coda su disco (spool) e
+solo dopo inviate da un thread separato, quindi l'acquisizione non aspetta mai
+la rete: se la linea è assente i dati restano nella coda, anche attraverso un
+riavvio, e vengono inviati quando la linea torna.
+
+La coda è una sequenza di file segmento spool_<n>.csv nella directory
+<csv_path>/spool_<stazione>; il file "committed" contiene il segmento e la
+posizione fino a cui il server ha confermato la ricezione. I segmenti già
+confermati vengono cancellati.
+
+Per ridurre traffico e risvegli su linee a consumo le righe vengono inviate a
+lotti compressi con gzip, quando ne sono accumulate batch_rows o quando la più
+vecchia ha max_age secondi; la connessione HTTP resta aperta tra un invio e
+l'altro. Il server chiude le connessioni inattive (dopo 30 s, molto meno di
+max_age), quindi se l'invio su una connessione riusata fallisce perché il
+server l'ha chiusa viene ripetuto subito su una connessione nuova. Negli altri
+casi di errore il lotto viene ripetuto con attese crescenti; il server scarta
+le righe che ha già ricevuto, per cui ripetere un invio non crea duplicati.
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import gzip
+import http.client
+import json
+import os
+import random
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+DEFAULT_BATCH_ROWS = 1000
+DEFAULT_MAX_AGE = 300
+SEGMENT_SIZE = 1024 * 1024
+
+# attese tra i tentativi, in secondi
+BACKOFF_MIN = 5
+BACKOFF_MAX = 900
+
+TIMEOUT = 30
+
+# errori di una connessione keep-alive chiusa dal server mentre era inattiva
+STALE_CONNECTION_ERRORS = (BrokenPipeError, ConnectionResetError, http.client.RemoteDisconnected)
+
+
+class Spool:
+    """
+    Coda persistente di righe su file segmento, con la posizione confermata.
+    """
+
+    def __init__(self, directory, fsync=False):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.fsync = fsync
+        self.committed_path = self.directory / "committed"
+        self.committed = self.read_committed()
+        segments = self.segments()
+        self.write_seq = segments[-1] if segments else self.committed[0]
+        self.f = None
+
+    def segment_path(self, seq):
+        return self.directory / f"spool_{seq:012d}.csv"
+
+    def segments(self):
+        return sorted(int(p.stem[6:]) for p in self.directory.glob("spool_*.csv"))
+
+    def read_committed(self):
+        try:
+            seq, offset = self.committed_path.read_text().split()
+            return int(seq), int(offset)
+        except (OSError, ValueError):
+            return 0, 0
+
+    def append(self, rows):
+        """
+        Accoda le righe (già terminate da newline) con una sola scrittura.
+        """
+        if self.f is None or self.f.tell() >= SEGMENT_SIZE:
+            if self.f is not None:
+                self.f.close()
+                self.write_seq += 1
+            self.f = open(self.segment_path(self.write_seq), "ab")
+        self.f.write("".join(rows).encode())
+        self.f.flush()
+        if self.fsync:
+            os.fsync(self.f.fileno())
+
+    def read(self, max_rows):
+        """
+        Legge dalla posizione confermata al più max_rows righe complete;
+        restituisce (righe, posizione dopo l'ultima riga letta).
+        """
+        seq, offset = self.committed
+        lines = []
+        for s in self.segments():
+            if s < seq:
+                continue
+            if s > seq:
+                seq, offset = s, 0
+            with open(self.segment_path(s), "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    lines.append(line)
+                    offset += len(line)
+                    if len(lines) >= max_rows:
+                        return lines, (seq, offset)
+        return lines, (seq, offset)
+
+    def pending_rows(self):
+        seq, offset = self.committed
+        count = 0
+        for s in self.segments():
+            if s >= seq:
+                with open(self.segment_path(s), "rb") as f:
+                    f.seek(offset if s == seq else 0)
+                    count += f.read().count(b"\n")
+        return count
+
+    def commit(self, position):
+        """
+        Registra la posizione confermata dal server e cancella i segmenti già inviati.
+        """
+        tmp = self.committed_path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            f.write(f"{position[0]} {position[1]}\n")
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp, self.committed_path)
+        self.committed = position
+        for s in self.segments():
+            if s < position[0]:
+                self.segment_path(s).unlink(missing_ok=True)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+class Uploader:
+    """
+    Thread di invio della coda di una stazione al server di raccolta.
+    """
+
+    def __init__(self, url, station, spool_dir, batch_rows=DEFAULT_BATCH_ROWS, max_age=DEFAULT_MAX_AGE,
+                 fsync=False, prefix=""):
+        u = urlsplit(url)
+        if u.scheme not in ("http", "https") or not u.hostname:
+            raise ValueError(f"Indirizzo del server non valido: {url}")
+        self.https = u.scheme == "https"
+        self.host = u.hostname
+        self.port = u.port
+        self.path = f"{u.path.rstrip('/')}/v1/stations/{station}/minutes"
+        self.batch_rows = batch_rows
+        self.max_age = max_age
+        self.prefix = prefix
+
+        self.spool = Spool(spool_dir, fsync)
+        self.cond = threading.Condition()
+        self.pending = self.spool.pending_rows()
+        # dati rimasti da una sessione precedente: vanno inviati subito
+        self.oldest = time.monotonic() - max_age if self.pending else None
+        self.running = True
+        self.conn = None
+        self.backoff = 0
+        self.retry_at = 0
+
+        # contatori
+        self.sent_rows = 0
+        self.sent_bytes = 0
+        self.batches = 0
+        self.failures = 0
+
+        self.thread = threading.Thread(target=self.run, name="uploader", daemon=True)
+        self.thread.start()
+
+    def enqueue(self, rows):
+        """
+        Accoda le righe di un minuto; non attende mai la rete.
+        """
+        if not rows:
+            return
+        with self.cond:
+            try:
+                self.spool.append(rows)
+            except OSError as e:
+                print(self.prefix + f"Attenzione: impossibile accodare i dati da inviare: {e}")
+                return
+            self.pending += len(rows)
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            if self.pending >= self.batch_rows:
+                self.cond.notify()
+
+    def due(self, now):
+        """
+        Secondi da attendere prima del prossimo invio (0 se è ora), None se non c'è niente da inviare.
+        """
+        if not self.pending:
+            return None
+        wait = 0 if self.pending >= self.batch_rows else self.oldest + self.max_age - now
+        return max(wait, self.retry_at - now, 0)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running:
+                    wait = self.due(time.monotonic())
+                    if wait == 0:
+                        break
+                    # un solo risveglio per lotto: alla scadenza dell'età massima o alla fine dell'attesa
+                    self.cond.wait(wait)
+                if not self.running:
+                    break
+                lines, position = self.spool.read(self.batch_rows)
+                if not lines:
+                    # nessuna riga completa: il conteggio era in eccesso
+                    self.pending = 0
+                    self.oldest = None
+                    continue
+
+            if not self.send(lines):
+                continue
+            with self.cond:
+                self.spool.commit(position)
+                self.pending = max(self.pending - len(lines), 0)
+                self.oldest = time.monotonic() if self.pending else None
+        self.close_connection()
+
+    def connect(self):
+        if self.conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            self.conn = cls(self.host, self.port, timeout=TIMEOUT)
+        return self.conn
+
+    def close_connection(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def post(self, body):
+        conn = self.connect()
+        conn.request("POST", self.path, body, {"Content-Type": "text/csv", "Content-Encoding": "gzip"})
+        response = conn.getresponse()
+        return response, response.read()
+
+    def send(self, lines):
+        """
+        Invia un lotto; restituisce True se il server ne ha confermato la ricezione.
+        """
+        body = gzip.compress(b"".join(lines))
+        try:
+            reused = self.conn is not None
+            try:
+                response, data = self.post(body)
+            except STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                # il server ha chiuso la connessione inattiva: un solo nuovo tentativo, subito
+                self.close_connection()
+                response, data = self.post(body)
+            if response.status != 200:
+                raise http.client.HTTPException(f"risposta {response.status} {response.reason}")
+            json.loads(data)
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            self.close_connection()
+            self.failures += 1
+            # attesa esponenziale con una parte casuale, per non ripresentarsi tutti insieme al server
+            self.backoff = min(max(self.backoff * 2, BACKOFF_MIN), BACKOFF_MAX)
+            delay = self.backoff * random.uniform(0.5, 1.0)
+            self.retry_at = time.monotonic() + delay
+            print(self.prefix + f"Invio al server non riuscito ({e}), nuovo tentativo tra {delay:.0f} s "
+                                f"({self.pending} righe in coda)")
+            return False
+        self.backoff = 0
+        self.retry_at = 0
+        self.batches += 1
+        self.sent_rows += len(lines)
+        self.sent_bytes += len(body)
+        return True
+
+    def stats(self):
+        with self.cond:
+            return {"pending": self.pending, "sent_rows": self.sent_rows, "sent_bytes": self.sent_bytes,
+                    "batches": self.batches, "failures": self.failures}
+
+    def close(self):
+        # i dati non inviati restano nella coda su disco per la prossima sessione
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.thread.join(TIMEOUT + 5)
+        self.spool.close()
@@ -0,0 +1,66 @@
+"""
+Scrittura bufferizzata dei file CSV giornalieri.
+
+Il file del giorno resta aperto per tutta la sessione: le righe di ogni minuto
+vengono scritte con una sola operazione e il file viene chiuso solo al cambio
+di data (mezzanotte UTC secondo la data RMC) o all'uscita dal programma.
+Su schede SD questo evita un'apertura, una chiusura e un aggiornamento dei
+metadati per ogni satellite a ogni minuto.
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import os
+from pathlib import Path
+
+# none:   i dati restano nel buffer finché non è pieno o alla rotazione
+# minute: flush a ogni minuto, i dati sono subito visibili agli altri programmi
+# fsync:  flush e fsync a ogni minuto, nessuna perdita anche per mancanza di corrente
+FLUSH_POLICIES = ("none", "minute", "fsync")
+
+BUFFER_SIZE = 64 * 1024
+
+
+class DailyCsvWriter:
+    """
+    Stream di file <prefix><data>.csv con rotazione giornaliera.
+    """
+
+    def __init__(self, directory, prefix, flush="minute"):
+        if flush not in FLUSH_POLICIES:
+            raise ValueError(f"Politica di flush non valida: {flush}")
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.flush = flush
+        self.date = None
+        self.f = None
+
+    def path(self, date):
+        return self.directory / f"{self.prefix}{date}.csv"
+
+    def write(self, date, rows):
+        """
+        Aggiunge in blocco le righe (già terminate da newline) al file della data indicata.
+        """
+        if date != self.date:
+            self.close()
+            self.f = open(self.path(date), "a", buffering=BUFFER_SIZE)
+            self.date = date
+        if rows:
+            self.f.write("".join(rows))
+        if self.flush != "none":
+            self.f.flush()
+            if self.flush == "fsync":
+                os.fsync(self.f.fileno())
+
+    def close(self):
+        if self.f is not None:
+            self.f.flush()
+            if self.flush == "fsync":
+                os.fsync(self.f.fileno())
+            self.f.close()
+            self.f = None
+            self.date = None
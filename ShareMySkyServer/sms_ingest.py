@@ -0,0 +1,380 @@
+"""
+Server di raccolta dei dati delle stazioni Share My Sky.
+
+Le stazioni inviano con HTTP/1.1 (connessioni keep-alive) lotti di righe nel
+formato dei CSV della console, eventualmente compressi con gzip:
+
+    POST /v1/stations/<stazione>/minutes
+    Content-Encoding: gzip
+    Content-Type: text/csv
+
+    2311172358,1,197.3,48.9,36.5,1.32
+    ...
+
+Ogni riga viene accodata al file giornaliero della stazione
+<archivio>/<stazione>/gps_<stazione>_<ddmmyy>.csv, con la stessa suddivisione
+per data della console (la riga delle 23:59 va nel file del giorno dopo).
+Le righe già ricevute, con la stessa chiave (stazione, minuto, PRN), vengono
+scartate: una stazione può quindi ripetere senza danni un invio di cui non ha
+avuto conferma. La risposta è un JSON con il numero di righe accettate,
+duplicate e non valide.
+
+Per la deduplicazione di ogni file giornaliero si tengono in memoria solo
+l'ultimo minuto ricevuto e le PRN degli ultimi minuti; solo quando arrivano
+dati più vecchi (per esempio dopo un'interruzione della rete) le chiavi del
+file vengono lette dal disco.
+
+    GET /v1/health    stato del server e contatori
+
+Con --drop e --delay il server simula una linea inaffidabile (richieste perse
+prima o dopo la registrazione, risposte in ritardo), per provare l'invio dalle
+stazioni (ShareMySkyConsole/sms_uploader.py).
+
+Uso:
+    python sms_ingest.py --store /srv/sharemysky --port 8080
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+APPVERSION = "0.1"
+
+STATION_NAME = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+PATH = re.compile(r'^/v1/stations/([^/]+)/minutes$')
+
+# massima dimensione di un lotto, compresso e decompresso
+MAX_BODY = 4 * 1024 * 1024
+MAX_ROWS_BYTES = 32 * 1024 * 1024
+
+# minuti recenti di cui si tengono in memoria le PRN ricevute, per file giornaliero
+RECENT_MINUTES = 16
+# file giornalieri di cui si tiene lo stato in memoria
+MAX_DAYS = 8192
+# secondi di inattività dopo cui una connessione keep-alive viene chiusa
+IDLE_TIMEOUT = 30
+
+
+def parse_row(line):
+    """
+    Controlla una riga del CSV e restituisce (minuto, prn), oppure None se non è valida.
+    """
+    fields = line.split(b",")
+    if len(fields) != 6 or len(fields[0]) != 10 or not fields[0].isdigit():
+        return None
+    try:
+        prn = int(fields[1])
+        for f in fields[2:]:
+            float(f)
+    except ValueError:
+        return None
+    if not 0 <= prn < 256:
+        return None
+    return int(fields[0]), prn
+
+
+def file_date(minute, cache):
+    """
+    Data ddmmyy del file in cui va la riga del minuto indicato (yymmddHHMM intero).
+    """
+    date = cache.get(minute)
+    if date is None:
+        t = datetime.strptime(f"{minute:010d}", "%y%m%d%H%M") + timedelta(minutes=1)
+        date = cache[minute] = t.strftime("%d%m%y")
+    return date
+
+
+class DayFile:
+    """
+    Stato di deduplicazione di un file giornaliero di una stazione.
+    """
+
+    __slots__ = ("path", "max_minute", "recent", "full", "pending")
+
+    def __init__(self, path):
+        self.path = path
+        self.max_minute = -1
+        self.recent = OrderedDict()  # minuto -> maschera di bit delle PRN
+        self.full = None             # come recent, per tutto il file; caricato solo se serve
+        self.pending = []            # righe accettate non ancora scritte
+        if path.exists():
+            self.load()
+            self.trim()
+            self.full = None
+
+    def load(self):
+        # le chiavi vengono lette dal file, che deve quindi contenere anche le righe in attesa
+        self.write()
+        full = {}
+        with open(self.path, "rb") as f:
+            for line in f:
+                row = parse_row(line.strip())
+                if row is not None:
+                    full[row[0]] = full.get(row[0], 0) | (1 << row[1])
+        self.full = full
+        if full:
+            self.max_minute = max(full)
+            for minute in sorted(full)[-RECENT_MINUTES:]:
+                self.recent[minute] = full[minute]
+
+    def trim(self):
+        while len(self.recent) > RECENT_MINUTES:
+            self.recent.popitem(last=False)
+
+    def seen(self, minute, prn):
+        mask = self.recent.get(minute)
+        if mask is not None:
+            return bool(mask >> prn & 1)
+        if minute > self.max_minute:
+            return False
+        # dato più vecchio degli ultimi minuti: servono tutte le chiavi del file
+        if self.full is None:
+            self.load()
+        return bool(self.full.get(minute, 0) >> prn & 1)
+
+    def add(self, minute, prn, line):
+        bit = 1 << prn
+        if minute in self.recent or minute > self.max_minute:
+            self.recent[minute] = self.recent.get(minute, 0) | bit
+            if minute > self.max_minute:
+                self.max_minute = minute
+                self.trim()
+        if self.full is not None:
+            self.full[minute] = self.full.get(minute, 0) | bit
+        self.pending.append(line)
+
+    def write(self, fsync=False):
+        if not self.pending:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write(b"\n".join(self.pending) + b"\n")
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        self.pending = []
+
+
+class IngestStore:
+    """
+    Archivio per stazione con deduplicazione; sicuro con più thread.
+    """
+
+    def __init__(self, directory, fsync=False):
+        self.directory = Path(directory)
+        self.fsync = fsync
+        self.days = OrderedDict()
+        self.days_lock = threading.Lock()
+        self.locks = {}
+        self.date_cache = {}
+        self.counters = {"requests": 0, "accepted": 0, "duplicates": 0, "rejected": 0}
+        self.counters_lock = threading.Lock()
+
+    def station_lock(self, station):
+        with self.days_lock:
+            lock = self.locks.get(station)
+            if lock is None:
+                lock = self.locks[station] = threading.Lock()
+            return lock
+
+    def day_file(self, station, date):
+        key = (station, date)
+        with self.days_lock:
+            day = self.days.get(key)
+            if day is not None:
+                self.days.move_to_end(key)
+                return day
+        day = DayFile(self.directory / station / f"gps_{station}_{date}.csv")
+        with self.days_lock:
+            self.days[key] = day
+            while len(self.days) > MAX_DAYS:
+                self.days.popitem(last=False)
+        return day
+
+    def ingest(self, station, data):
+        """
+        Aggiunge le righe nuove di un lotto e restituisce (accettate, duplicate, non valide).
+        """
+        accepted = duplicates = rejected = 0
+        with self.station_lock(station):
+            days = set()
+            for line in data.splitlines():
+                line = line.strip()
+                if not line:
+                    continue
+                row = parse_row(line)
+                if row is None:
+                    rejected += 1
+                    continue
+                minute, prn = row
+                try:
+                    date = file_date(minute, self.date_cache)
+                except ValueError:
+                    # cifre corrette ma data inesistente (per esempio il mese 13)
+                    rejected += 1
+                    continue
+                day = self.day_file(station, date)
+                if day.seen(minute, prn):
+                    duplicates += 1
+                    continue
+                day.add(minute, prn, line)
+                days.add(day)
+                accepted += 1
+
+            # una scrittura per file giornaliero per lotto
+            for day in days:
+                day.write(self.fsync)
+
+        if len(self.date_cache) > 100000:
+            self.date_cache.clear()
+        with self.counters_lock:
+            self.counters["requests"] += 1
+            self.counters["accepted"] += accepted
+            self.counters["duplicates"] += duplicates
+            self.counters["rejected"] += rejected
+        return accepted, duplicates, rejected
+
+    def stats(self):
+        with self.counters_lock:
+            stats = dict(self.counters)
+        stats["days_in_memory"] = len(self.days)
+        return stats
+
+
+class IngestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = f"ShareMySkyIngest/{APPVERSION}"
+    timeout = IDLE_TIMEOUT
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/v1/health":
+            stats = self.server.store.stats()
+            stats["uptime"] = int(time.time() - self.server.started)
+            self.reply(200, stats)
+        else:
+            self.reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        m = PATH.match(self.path)
+        if m is None or not STATION_NAME.match(m.group(1)):
+            self.reply(404, {"error": "not found"})
+            return
+        # il corpo non viene letto se la lunghezza non è valida: la connessione va chiusa
+        value = self.headers.get("Content-Length")
+        if value is None:
+            self.reply(411, {"error": "Content-Length required"})
+            self.close_connection = True
+            return
+        value = value.strip()
+        if not value.isdigit() or not value.isascii():
+            self.reply(400, {"error": "invalid Content-Length"})
+            self.close_connection = True
+            return
+        length = int(value)
+        if length > MAX_BODY:
+            self.reply(413, {"error": "batch too large"})
+            self.close_connection = True
+            return
+        body = self.rfile.read(length)
+
+        server = self.server
+        fault = server.drop and random.random() < server.drop
+        if fault and random.random() < 0.5:
+            # richiesta persa prima di essere registrata
+            self.close_connection = True
+            return
+
+        if self.headers.get("Content-Encoding", "identity") == "gzip":
+            try:
+                d = zlib.decompressobj(wbits=31)
+                body = d.decompress(body, MAX_ROWS_BYTES)
+                if d.unconsumed_tail:
+                    self.reply(413, {"error": "batch too large"})
+                    return
+                if not d.eof:
+                    self.reply(400, {"error": "truncated gzip data"})
+                    return
+            except zlib.error:
+                self.reply(400, {"error": "invalid gzip data"})
+                return
+
+        accepted, duplicates, rejected = self.server.store.ingest(m.group(1), body)
+        if fault:
+            # registrata ma senza risposta: la stazione la invierà di nuovo
+            self.close_connection = True
+            return
+        if server.delay:
+            time.sleep(random.uniform(0, server.delay))
+        self.reply(200, {"accepted": accepted, "duplicates": duplicates, "rejected": rejected})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class IngestServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, store, verbose=False, drop=0, delay=0):
+        super().__init__(address, IngestHandler)
+        self.store = store
+        self.verbose = verbose
+        self.drop = drop
+        self.delay = delay
+        self.started = time.time()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server di raccolta dei dati delle stazioni Share My Sky. "
+                                                 f"Versione {APPVERSION}")
+    parser.add_argument("--store", type=str, default=".",
+                        help="Directory dell'archivio, con una sottodirectory per stazione (default: .)")
+    parser.add_argument("--host", type=str, default="0.0.0.0", help="Indirizzo di ascolto (default: 0.0.0.0)")
+    parser.add_argument("--port", type=int, default=8080, help="Porta di ascolto (default: 8080)")
+    parser.add_argument("--fsync", action="store_true", default=False,
+                        help="Esegue fsync dei file prima di confermare ogni lotto")
+    parser.add_argument("--verbose", action="store_true", default=False, help="Stampa ogni richiesta ricevuta")
+    parser.add_argument("--drop", type=float, default=0,
+                        help="Prova: frazione delle richieste lasciate senza risposta, metà prima e metà dopo "
+                             "averle registrate (default: 0)")
+    parser.add_argument("--delay", type=float, default=0,
+                        help="Prova: ritardo casuale massimo delle risposte in secondi (default: 0)")
+    args = parser.parse_args()
+
+    store = IngestStore(args.store, args.fsync)
+    server = IngestServer((args.host, args.port), store, args.verbose, args.drop, args.delay)
+    print(f"--- SHARE MY SKY INGEST ---\n\nIn ascolto su {args.host}:{args.port}, archivio in {Path(args.store)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Interruzione da tastiera.")
+    server.server_close()
+    print(f"Statistiche: {store.stats()}")
+    print("Programma terminato.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Prova di carico del server di raccolta con una flotta di stazioni simulate.
+
+Ogni stazione simulata invia, minuto per minuto, le righe di 12 satelliti
+compresse con gzip su una connessione keep-alive; una parte dei lotti viene
+inviata due volte per verificare la deduplicazione. Alla fine vengono
+confrontati i contatori del server con quelli attesi e stampati richieste al
+secondo, latenze e il numero di stazioni reali (un invio al minuto) che il
+server potrebbe servire a quel ritmo.
+
+Senza --url viene avviato un server locale su una directory temporanea.
+
+Esempio:
+    python sms_loadtest.py --stations 2000 --minutes 10 --connections 32
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import argparse
+import gzip
+import http.client
+import json
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from urllib.parse import urlsplit
+
+SATS = 12
+
+
+def minute_rows(station_index, t):
+    """
+    Righe di un minuto di una stazione simulata, nel formato dei CSV della console.
+    """
+    rnd = random.Random(station_index * 1000003 + t.hour * 60 + t.minute)
+    minute = t.strftime("%y%m%d%H%M")
+    return [f"{minute},{prn},{rnd.uniform(0, 360):.1f},{rnd.uniform(10, 80):.1f},{rnd.uniform(25, 50):.1f},"
+            f"{rnd.uniform(0, 1.5):.2f}\n" for prn in range(1, SATS + 1)]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_server(host, port, timeout=10):
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            with socket.create_connection((host, port), 0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def get_stats(host, port):
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    conn.request("GET", "/v1/health")
+    stats = json.loads(conn.getresponse().read())
+    conn.close()
+    return stats
+
+
+def worker(host, port, stations, minutes, start, duplicate_rate, results, lock):
+    """
+    Invia i dati di un gruppo di stazioni su una sola connessione keep-alive.
+    """
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    latencies = []
+    requests = rows = accepted = duplicates = errors = 0
+    rnd = random.Random(stations[0] if stations else 0)
+    for m in range(minutes):
+        t = start + timedelta(minutes=m)
+        for station in stations:
+            body = gzip.compress("".join(minute_rows(station, t)).encode(), 1)
+            sends = 2 if rnd.random() < duplicate_rate else 1
+            for _ in range(sends):
+                t0 = time.perf_counter()
+                try:
+                    conn.request("POST", f"/v1/stations/SIM{station:05d}/minutes", body,
+                                 {"Content-Encoding": "gzip", "Content-Type": "text/csv"})
+                    reply = json.loads(conn.getresponse().read())
+                except (OSError, http.client.HTTPException, ValueError):
+                    errors += 1
+                    conn.close()
+                    conn = http.client.HTTPConnection(host, port, timeout=30)
+                    continue
+                latencies.append(time.perf_counter() - t0)
+                requests += 1
+                rows += SATS
+                accepted += reply["accepted"]
+                duplicates += reply["duplicates"]
+    conn.close()
+    with lock:
+        results["latencies"].extend(latencies)
+        for k, v in (("requests", requests), ("rows", rows), ("accepted", accepted), ("duplicates", duplicates),
+                     ("errors", errors)):
+            results[k] += v
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prova di carico del server di raccolta Share My Sky.")
+    parser.add_argument("--url", type=str, default=None,
+                        help="Indirizzo del server (es. http://127.0.0.1:8080); senza, ne avvia uno locale")
+    parser.add_argument("--stations", type=int, default=1000, help="Stazioni simulate (default: 1000)")
+    parser.add_argument("--minutes", type=int, default=5, help="Minuti inviati da ogni stazione (default: 5)")
+    parser.add_argument("--connections", type=int, default=16, help="Connessioni keep-alive parallele (default: 16)")
+    parser.add_argument("--duplicates", type=float, default=0.05,
+                        help="Frazione dei lotti inviati due volte (default: 0.05)")
+    args = parser.parse_args()
+
+    server = None
+    tmp = None
+    if args.url is None:
+        tmp = tempfile.TemporaryDirectory(prefix="sms_ingest_")
+        host, port = "127.0.0.1", free_port()
+        server = subprocess.Popen([sys.executable, str(Path(__file__).with_name("sms_ingest.py")),
+                                   "--store", tmp.name, "--host", host, "--port", str(port)],
+                                  stdout=subprocess.DEVNULL)
+        if not wait_server(host, port):
+            print("Errore: il server locale non risponde.")
+            server.kill()
+            return
+    else:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+
+    before = get_stats(host, port)
+    start = datetime(2024, 10, 1, 12, 0)
+    groups = [list(range(i, args.stations, args.connections)) for i in range(args.connections)]
+    results = {"latencies": [], "requests": 0, "rows": 0, "accepted": 0, "duplicates": 0, "errors": 0}
+    lock = threading.Lock()
+    threads = [threading.Thread(target=worker, args=(host, port, g, args.minutes, start, args.duplicates, results,
+                                                     lock))
+               for g in groups if g]
+
+    print(f"{args.stations} stazioni x {args.minutes} minuti su {len(threads)} connessioni...")
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    after = get_stats(host, port)
+
+    lat = sorted(results["latencies"]) or [0]
+    expected = args.stations * args.minutes * SATS
+    rate = results["requests"] / elapsed
+    print(f"Richieste: {results['requests']} in {elapsed:.1f} s ({rate:.0f}/s, {results['rows'] / elapsed:.0f} righe/s),"
+          f" errori: {results['errors']}")
+    print(f"Latenza: mediana {lat[len(lat) // 2] * 1000:.1f} ms, 99% {lat[int(len(lat) * 0.99)] * 1000:.1f} ms")
+    print(f"Righe accettate: {results['accepted']} (attese {expected}), duplicate scartate: "
+          f"{results['duplicates']}")
+    print(f"Contatori del server: accettate {after['accepted'] - before['accepted']}, "
+          f"duplicate {after['duplicates'] - before['duplicates']}")
+    print(f"A questo ritmo il server riceve un lotto al minuto da circa {rate * 60:.0f} stazioni.")
+    if results["accepted"] != expected:
+        print("Attenzione: le righe accettate non corrispondono a quelle attese.")
+
+    if server is not None:
+        server.terminate()
+        server.wait()
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+"""
+Benchmark dei percorsi di acquisizione e di plot di Share My Sky.
+
+I dati vengono prodotti da sms_synth con un seme fisso, quindi ogni esecuzione
+misura esattamente lo stesso lavoro. Vengono misurati:
+
+  acquisizione (su un flusso NMEA sintetico di --minutes minuti a --rate Hz)
+    readgps          lettura e decodifica di una riga (read_sentence, che nella
+                     console sostituisce readgps() di gps_s4c.py)
+    s4c              s4c() sui campioni di un satellite in un minuto
+    s4c_accumulator  gli stessi campioni con SatAccumulator (add + s4c)
+    is_within_cutoff una verifica della finestra di cutoff
+    minute_close     Station.close_minute() con i satelliti del flusso, CSV compreso
+    csv_output       DailyCsvWriter.write() delle righe di un minuto
+    station_feed     decodifica ed elaborazione di una riga con Station.feed()
+    epoch_nmea       decodifica ed elaborazione delle frasi RMC, GGA e GSV di
+                     un'epoca, con sms_ubx.decode() come nella console
+    epoch_ubx        lo stesso per i frame NAV-POSLLH, NAV-TIMEUTC e NAV-SVINFO
+                     della stessa epoca (acquisizione --ubx svinfo)
+
+  plot_my_sky10 (su 1 giorno, 1 mese e 1 anno di CSV al minuto)
+    load       load_range() dei file
+    filter     filtri di load_and_filter() (azimut, elevazione, maschera CN0),
+               compresa la scrittura del CSV filtrato
+    partition  partition_windows() in finestre di 24 ore
+    render     grafici snr e s4c_max di tutto l'intervallo con --decimate (Agg)
+
+Per ogni misura si tiene il tempo migliore su --repeat ripetizioni, espresso in
+secondi per operazione. I risultati vengono aggiunti come una riga JSON a
+--results, con commit, host e versioni delle librerie; ogni misura viene
+confrontata con la mediana delle ultime esecuzioni sullo stesso host e con la
+stessa configurazione e segnalata se è più lenta di oltre --tolerance. Con
+--check il programma termina con codice 1 se ci sono regressioni.
+
+I CSV sintetici vengono generati una sola volta nella cartella --data (circa
+40 MB al mese) e riutilizzati nelle esecuzioni successive.
+
+Uso:
+    python benchmarks/sms_bench.py
+    python benchmarks/sms_bench.py --suite acquisition --rate 10
+    python benchmarks/sms_bench.py --scales day month --check
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / "ShareMySkyConsole"), str(ROOT / "PlotMySky")]
+
+import matplotlib  # noqa: E402
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+import gps_sms_console as console  # noqa: E402
+import plot_my_sky10 as plot  # noqa: E402
+import sms_synth  # noqa: E402
+from sms_archive import load_range  # noqa: E402
+from sms_nmea import Gsv, parse_sentence, read_sentence  # noqa: E402
+from sms_ubx import decode  # noqa: E402
+from sms_writer import DailyCsvWriter  # noqa: E402
+
+SCALES = {"day": 1, "month": 30, "year": 365}
+SUITES = ("acquisition", "plot")
+DEFAULT_RESULTS = Path(__file__).with_name("results.jsonl")
+DEFAULT_DATA = Path(tempfile.gettempdir()) / "sms_bench"
+DEFAULT_TOLERANCE = 0.2
+HISTORY = 5
+
+# filtri usati nella fase filter, come un uso tipico di plot_my_sky10
+AZIMUTH_RANGE = (100, 260)
+ELEVATION_RANGE = (10, 90)
+CN0_MASK = 30
+USECOLS = ["timestamp", "idsat", "azimuth", "elevation", "cn0", "s4c"]
+
+
+def measure(fn, repeat, ops=1):
+    """
+    Tempo migliore in secondi per operazione di fn(), che ne esegue ops.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best / ops
+
+
+class LineSerial:
+    """
+    Porta seriale finta che restituisce righe già in memoria.
+    """
+
+    def __init__(self, lines):
+        self.readline = iter(lines).__next__
+
+
+def acquisition_benchmarks(args, work):
+    """
+    Misure del percorso di acquisizione sul flusso sintetico.
+    """
+    sky = sms_synth.SkyModel(args.sats, args.seed)
+    start = sms_synth.parse_start(sms_synth.DEFAULT_START)
+    stream = list(sms_synth.nmea_stream(start, args.minutes * 60, sky, args.rate, args.seed))
+    lines = [line for _, line in stream]
+
+    # campioni (az, alt, cn0) per minuto e satellite, come li accumula Station
+    minutes = {}
+    for t, line in stream:
+        s = parse_sentence(line)
+        if type(s) is Gsv:
+            minute = minutes.setdefault(int(t // 60), {})
+            for idsat, alt, az, cn0 in s.sats:
+                minute.setdefault(idsat, []).append((az, alt, cn0))
+    minutes = list(minutes.values())
+    tracks = [samples for minute in minutes for samples in minute.values()]
+    cn0_lists = [[cn0 for _, _, cn0 in samples] for samples in tracks]
+    positions = [(az, alt) for samples in tracks for az, alt, _ in samples]
+    rows_per_minute = [[f"2311171200,{idsat},{samples[0][0]}.0,{samples[0][1]}.0,{samples[0][2]}.0,0.05\n"
+                        for idsat, samples in minute.items()] for minute in minutes]
+
+    results = {}
+
+    def readgps():
+        ser = LineSerial(lines)
+        for _ in range(len(lines)):
+            read_sentence(ser)
+
+    results["readgps"] = measure(readgps, args.repeat, len(lines))
+
+    def s4c_lists():
+        for a in cn0_lists:
+            console.s4c(a)
+
+    results["s4c"] = measure(s4c_lists, args.repeat, len(cn0_lists))
+
+    def s4c_accumulator():
+        acc = console.SatAccumulator()
+        for samples in tracks:
+            for az, alt, cn0 in samples:
+                acc.add(az, alt, cn0)
+            acc.s4c()
+            acc.reset()
+
+    results["s4c_accumulator"] = measure(s4c_accumulator, args.repeat, len(tracks))
+
+    def cutoff():
+        within = console.is_within_cutoff
+        for az, alt in positions:
+            within(az, alt, 315, 45, 20, 80)
+
+    results["is_within_cutoff"] = measure(cutoff, args.repeat, len(positions))
+
+    station = console.Station("BENCH", work, (0, 360), (0, 90), silent=True)
+    station.timesat_old = "2311171200"
+    close_time = []
+    for _ in range(args.repeat):
+        elapsed = 0.0
+        for minute in minutes:
+            for idsat, samples in minute.items():
+                acc = station.satacc[idsat]
+                for az, alt, cn0 in samples:
+                    acc.add(az, alt, cn0)
+            t0 = time.perf_counter()
+            station.close_minute("171123")
+            elapsed += time.perf_counter() - t0
+        close_time.append(elapsed / len(minutes))
+    station.close()
+    results["minute_close"] = min(close_time)
+
+    writer = DailyCsvWriter(work, "gps_BENCHCSV_")
+
+    def csv_output():
+        for i, rows in enumerate(rows_per_minute):
+            # un cambio di file ogni 1440 minuti, come a mezzanotte
+            writer.write("1711%02d" % (i // 1440 % 100), rows)
+
+    results["csv_output"] = measure(csv_output, args.repeat, len(rows_per_minute))
+    writer.close()
+
+    def station_feed():
+        station = console.Station("BENCHFEED", work, (0, 360), (0, 90), silent=True)
+        feed = station.feed
+        for line in lines:
+            feed(parse_sentence(line))
+        station.close()
+
+    results["station_feed"] = measure(station_feed, args.repeat, len(lines))
+
+    # stesse epoche come frasi NMEA e come frame UBX
+    epochs = int(round(args.minutes * 60 * args.rate))
+    frames = [f for _, f in sms_synth.ubx_stream(start, args.minutes * 60, sky, args.rate, args.seed)]
+
+    def epoch_feed(records):
+        def run():
+            station = console.Station("BENCHEPOCH", work, (0, 360), (0, 90), silent=True)
+            feed = station.feed
+            for record in records:
+                feed(decode(record))
+            station.close()
+        return run
+
+    results["epoch_nmea"] = measure(epoch_feed(lines), args.repeat, epochs)
+    results["epoch_ubx"] = measure(epoch_feed(frames), args.repeat, epochs)
+    return results
+
+
+def synthetic_csv(args, days):
+    """
+    File CSV sintetici dei primi days giorni, generati solo se mancano.
+    """
+    directory = Path(args.data) / f"csv_seed{args.seed}_sats{args.sats}"
+    sky = sms_synth.SkyModel(args.sats, args.seed)
+    first_day = sms_synth.parse_start(sms_synth.DEFAULT_START) // 86400
+    t0 = time.perf_counter()
+    paths = sms_synth.write_csv_days(directory, "BENCH", first_day, days, sky, args.seed)
+    if time.perf_counter() - t0 > 1:
+        print(f"Generati i dati sintetici in {directory} ({time.perf_counter() - t0:.0f} s)")
+    return [str(p) for p in paths], pd.Timestamp(first_day * 86400, unit="s")
+
+
+def plot_benchmarks(args, work, scale):
+    """
+    Misure delle fasi di plot_my_sky10 su SCALES[scale] giorni di dati.
+    """
+    days = SCALES[scale]
+    paths, start = synthetic_csv(args, days)
+    # l'anno viene misurato una volta sola
+    repeat = args.repeat if days <= 30 else 1
+    base = str(Path(work) / f"bench_{scale}")
+    results = {}
+    quiet = contextlib.redirect_stdout(io.StringIO())
+
+    with quiet:
+        df = load_range(paths, usecols=USECOLS)
+        results[f"load.{scale}"] = measure(lambda: load_range(paths, usecols=USECOLS), repeat)
+
+        # misura solo i filtri: i dati già caricati sostituiscono la lettura dei file
+        with mock.patch.object(plot, "load_range", lambda *a, **k: df):
+            filtered = plot.load_and_filter(paths, base, AZIMUTH_RANGE, ELEVATION_RANGE, cn0_mask=CN0_MASK)
+            results[f"filter.{scale}"] = measure(
+                lambda: plot.load_and_filter(paths, base, AZIMUTH_RANGE, ELEVATION_RANGE, cn0_mask=CN0_MASK), repeat)
+
+        window_starts = [start + pd.Timedelta(days=i) for i in range(-1, days + 1)]
+        results[f"partition.{scale}"] = measure(lambda: plot.partition_windows(filtered, window_starts), repeat)
+
+        plot.use_agg()
+        window = plot.partition_windows(filtered, [window_starts[0], window_starts[-1]])[0]
+        filters = {'azimut_range': AZIMUTH_RANGE, 'elevation_range': ELEVATION_RANGE, 'cn0_mask': CN0_MASK,
+                   'want_max': True, 'decimate': plot.DECIMATE_WIDTH}
+        renderers = [plot.RENDERERS['snr'], plot.RENDERERS['s4c_max']]
+        results[f"render.{scale}"] = measure(
+            lambda: plot.render_window(renderers, window, base, filters, False), repeat)
+    print(f"  {scale}: {len(paths)} file, {len(df)} righe, {len(filtered)} dopo i filtri")
+    return results
+
+
+def git_revision():
+    """
+    Commit corrente e presenza di modifiche non salvate, se il programma è in un repository git.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def load_history(path):
+    try:
+        with open(path, "r") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def baselines(history, record):
+    """
+    Mediana di ogni misura nelle ultime HISTORY esecuzioni comparabili con record.
+    """
+    same = [r for r in history
+            if r.get("host") == record["host"] and r.get("python") == record["python"]
+            and r.get("config") == record["config"]]
+    values = {}
+    for r in same:
+        for name, value in r["results"].items():
+            values.setdefault(name, []).append(value)
+    return {name: statistics.median(v[-HISTORY:]) for name, v in values.items()}
+
+
+def format_time(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:9.2f} µs"
+    if seconds < 1:
+        return f"{seconds * 1e3:9.2f} ms"
+    return f"{seconds:9.2f} s "
+
+
+def report(results, base, tolerance):
+    """
+    Stampa le misure con la variazione rispetto al riferimento; restituisce le regressioni.
+    """
+    regressions = []
+    print(f"{'misura':<26}{'tempo/op':>13}{'riferimento':>14}{'variazione':>12}")
+    for name, value in results.items():
+        line = f"{name:<26}{format_time(value):>13}"
+        if name in base:
+            change = value / base[name] - 1
+            line += f"{format_time(base[name]):>14}{change:>+11.0%}"
+            if change > tolerance:
+                line += "  REGRESSIONE"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def parse_arguments():
+    """
+    Gestisce i parametri da linea di comando.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark di acquisizione e plot di Share My Sky su dati sintetici")
+    parser.add_argument("--suite", type=str, nargs="+", choices=SUITES, default=list(SUITES),
+                        help="Gruppi di misure da eseguire (default: tutti)")
+    parser.add_argument("--scales", type=str, nargs="+", choices=list(SCALES), default=list(SCALES),
+                        help="Quantità di dati per le misure di plot (default: day month year)")
+    parser.add_argument("--repeat", type=int, default=5, help="Ripetizioni di ogni misura (default: 5)")
+    parser.add_argument("--minutes", type=int, default=30,
+                        help="Durata in minuti del flusso NMEA per l'acquisizione (default: 30)")
+    parser.add_argument("--rate", type=int, default=1, help="Epoche al secondo del flusso NMEA (default: 1)")
+    parser.add_argument("--sats", type=int, default=sms_synth.DEFAULT_SATS,
+                        help=f"Satelliti della costellazione sintetica (default: {sms_synth.DEFAULT_SATS})")
+    parser.add_argument("--seed", type=int, default=0, help="Seme dei dati sintetici (default: 0)")
+    parser.add_argument("--data", type=str, default=str(DEFAULT_DATA),
+                        help=f"Cartella dei CSV sintetici riutilizzati tra le esecuzioni (default: {DEFAULT_DATA})")
+    parser.add_argument("--results", type=str, default=str(DEFAULT_RESULTS),
+                        help="File JSON lines dei risultati (default: benchmarks/results.jsonl)")
+    parser.add_argument("--no_save", action="store_true", help="Non aggiunge i risultati al file")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"Rallentamento oltre il quale una misura è una regressione (default: "
+                             f"{DEFAULT_TOLERANCE:.0%})")
+    parser.add_argument("--check", action="store_true", help="Esce con codice 1 se ci sono regressioni")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    commit, dirty = git_revision()
+    record = {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "dirty": dirty,
+        "host": platform.node(),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "packages": {"numpy": np.__version__, "pandas": pd.__version__, "matplotlib": matplotlib.__version__},
+        "repeat": args.repeat,
+        "config": {"minutes": args.minutes, "rate": args.rate, "sats": args.sats,
+                   "seed": args.seed},
+        "results": {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix="sms_bench_") as work:
+        if "acquisition" in args.suite:
+            print("Acquisizione...")
+            record["results"].update(acquisition_benchmarks(args, work))
+        if "plot" in args.suite:
+            print("plot_my_sky10...")
+            for scale in args.scales:
+                record["results"].update(plot_benchmarks(args, work, scale))
+
+    history = load_history(args.results)
+    regressions = report(record["results"], baselines(history, record), args.tolerance)
+    if not args.no_save:
+        with open(args.results, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        print(f"Risultati aggiunti a {args.results} (commit {commit or '?'}{', modificato' if dirty else ''})")
+    if regressions:
+        print(f"Regressioni oltre il {args.tolerance:.0%}: {', '.join(regressions)}")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
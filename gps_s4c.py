@@ -1,4 +1,4 @@
-import serial, config_gps_s4c
+import serial, os, config_gps_s4c
 
 # costanti
 DEVICE=config_gps_s4c.DEVICE
@@ -12,6 +12,9 @@ AZ_a=config_gps_s4c.AZ_a
 ALT_min=config_gps_s4c.ALT_min
 ALT_max=config_gps_s4c.ALT_max
 
+# se True, a ogni minuto i file di log vengono anche sincronizzati su disco (fsync)
+FSYNC=getattr(config_gps_s4c,"FSYNC",False)
+
 
 
 # calcolo media di un vettore
@@ -46,6 +49,28 @@ def array (n):
 	return (x)
 	
 	
+# file di log tenuti aperti, chiusi solo quando cambia il nome (rotazione giornaliera)
+logfiles={}
+
+def logwrite (stream, name, text):
+	f=logfiles.get(stream)
+	if (f!=None) and (f.name!=name):
+		f.close()
+		f=None
+	if (f==None):
+		f=open(name,"a")
+		logfiles[stream]=f
+	f.write (text)
+
+
+# rende visibili su disco le righe del minuto
+def logflush ():
+	for f in logfiles.values():
+		f.flush()
+		if (FSYNC):
+			os.fsync(f.fileno())
+
+
 # legge i dati dall'antenna	
 def readgps ():
 	s=str(ser.readline().decode("utf-8"))
@@ -155,11 +180,12 @@ while (True):
 				lonv=[]
 				altv=[]
 				POSFILE=DIR_FILE+"sms_pos_"+STATION_NAME+".csv"
-				f=open(POSFILE,"a")
 				s=str(timesat_old)+","+str(latm)+","+str(lonm)+","+str(altm)+"\n"
 				print (s)
-				f.write (s)
-				f.close()
+				logwrite ("pos",POSFILE,s)
+				
+				rows=[]
+				toprows=[]
 				
 				# calcolo delle coordinate medie e dell s4c del segnale per ogni satellite valido		
 				for t in range (0,MAX_SAT):
@@ -176,19 +202,22 @@ while (True):
 						
 						print (f'{timesat_old:6}  sat: {t:2}   az: {azmed:5}   alt: {altmed:4}   cn0: {cn0med:4}   s4c:{cn0s4c:5} {cn0s}')
 						
-						# esegue il log sul file giornaliero
-						LOG_FILE=DIR_FILE+"sms_"+STATION_NAME+"_"+STATION_POS+"_"+timesat_old[:6]+".csv"
-						f=open(LOG_FILE,"a")
+						# prepara le righe per il file giornaliero
 						s1=str(timesat_old)+","+str(t)+","+str(azmed)+","+str(altmed)+","+str(cn0med)+","+str(cn0s4c)+"\n"
-						f.write (s1)
-						f.close()
+						rows=rows+[s1]
 						
-						# esegue il log sul file dei topevent
+						# e per il file dei topevent
 						if (cn0s4c>0.5):
-							LOG_FILE=DIR_FILE+"sms_"+STATION_NAME+"_"+STATION_POS+"_topevent.csv"
-							f=open(LOG_FILE,"a")
-							f.write (s1)
-							f.close()
+							toprows=toprows+[s1]
+				
+				# esegue il log sul file giornaliero e su quello dei topevent con una sola scrittura ciascuno
+				if (len(rows)>0):
+					LOG_FILE=DIR_FILE+"sms_"+STATION_NAME+"_"+STATION_POS+"_"+timesat_old[:6]+".csv"
+					logwrite ("log",LOG_FILE,"".join(rows))
+				if (len(toprows)>0):
+					LOG_FILE=DIR_FILE+"sms_"+STATION_NAME+"_"+STATION_POS+"_topevent.csv"
+					logwrite ("top",LOG_FILE,"".join(toprows))
+				logflush ()
 							
 				print ()
 				# vuota gli array
@@ -0,0 +1,22 @@
+"""
+Configurazione comune dei test: i moduli dei tre programmi non sono pacchetti
+installabili, quindi le loro cartelle vengono aggiunte a sys.path come fanno
+i programmi stessi.
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+CONSOLE = ROOT / "ShareMySkyConsole"
+PLOT = ROOT / "PlotMySky"
+SERVER = ROOT / "ShareMySkyServer"
+
+for path in (CONSOLE, PLOT, SERVER):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
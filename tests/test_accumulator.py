@@ -0,0 +1,104 @@
+"""
+SatAccumulator deve dare gli stessi valori di med() e s4c() applicate alla
+lista dei campioni, con le somme semplici (Python < 3.12) e con quelle
+compensate come sum() da Python 3.12. Il ramo che non corrisponde alla versione
+in uso viene provato sostituendo sum() in gps_sms_console con un'implementazione
+di riferimento.
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import math
+import random
+import sys
+
+import pytest
+
+import gps_sms_console
+from gps_sms_console import SatAccumulator, med, s4c
+
+COMPENSATED = sys.version_info >= (3, 12)
+
+
+def plain_sum(values):
+    """
+    sum() di Python fino alla 3.11.
+    """
+    total = 0
+    for v in values:
+        total += v
+    return total
+
+
+def neumaier_sum(values):
+    """
+    sum() di Python dalla 3.12 sui float: sommatoria compensata di Neumaier.
+    """
+    values = list(values)
+    if not values or not all(type(v) is float for v in values):
+        return plain_sum(values)
+    total = 0.0
+    c = 0.0
+    for v in values:
+        t = total + v
+        if abs(total) >= abs(v):
+            c += (total - t) + v
+        else:
+            c += (v - t) + total
+        total = t
+    if c and math.isfinite(c):
+        total += c
+    return total
+
+
+def samples(rng):
+    n = rng.choice((1, 2, 3, rng.randint(4, 30), rng.randint(30, 120)))
+    if rng.random() < 0.1:
+        # C/N0 costante: s4c nullo
+        cn0 = [rng.randint(0, 55)] * n
+    else:
+        low = rng.randint(0, 50)
+        cn0 = [rng.randint(low, low + rng.choice((1, 3, 10, 30))) for _ in range(n)]
+    return [rng.randint(0, 359) for _ in range(n)], [rng.randint(0, 90) for _ in range(n)], cn0
+
+
+def effective(total, comp):
+    # come in SatAccumulator.s4c()
+    return total + comp if comp and math.isfinite(comp) else total
+
+
+@pytest.mark.parametrize("compensated", [False, True], ids=["plain", "compensated"])
+def test_accumulator_matches_lists(monkeypatch, compensated):
+    monkeypatch.setattr(gps_sms_console, "_COMPENSATED_SUM", compensated)
+    if compensated != COMPENSATED:
+        # med() usa il nome globale sum: in gps_sms_console viene sostituito da quello dell'altra versione
+        monkeypatch.setattr(gps_sms_console, "sum", neumaier_sum if compensated else plain_sum, raising=False)
+    list_sum = getattr(gps_sms_console, "sum", sum)
+    rng = random.Random(12)
+    acc = SatAccumulator()
+    for _ in range(5000):
+        az, alt, cn0 = samples(rng)
+        acc.reset()
+        for a, e, c in zip(az, alt, cn0):
+            acc.add(a, e, c)
+        assert acc.az_med() == int(med(az) * 10 + 0.5) / 10
+        assert acc.alt_med() == int(med(alt) * 10 + 0.5) / 10
+        assert acc.cn0_med() == int(med(cn0) * 10 + 0.5) / 10
+        expected = s4c(cn0)
+        got = acc.s4c()
+        assert got == expected and type(got) is type(expected), cn0
+        # prima dell'arrotondamento di s4c: le somme delle intensità devono coincidere esattamente
+        i = [10 ** (c / 10) for c in cn0]
+        assert effective(acc.sum_i, acc.comp_i) == list_sum(i)
+        assert effective(acc.sum_i2, acc.comp_i2) == list_sum([x ** 2 for x in i])
+
+
+def test_reference_sum_matches_builtin():
+    reference = neumaier_sum if COMPENSATED else plain_sum
+    rng = random.Random(3)
+    for _ in range(2000):
+        values = [10 ** (rng.randint(0, 55) / 10) ** rng.choice((1, 2)) for _ in range(rng.randint(1, 120))]
+        assert reference(values) == sum(values)
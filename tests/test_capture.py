@@ -0,0 +1,57 @@
+"""
+File di cattura di sms_capture: registrazioni più lunghe dei circa 49 giorni
+rappresentabili in millisecondi con un uint32 e file mancanti, non compressi o
+con intestazione errata, segnalati già all'apertura.
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import gzip
+
+import pytest
+
+from sms_capture import MAGIC, CaptureWriter, ReplaySerial, read_capture
+
+START = 1700000000.0
+DAY = 86400
+
+
+def test_long_recording_is_rebased(tmp_path):
+    path = tmp_path / "long.smscap"
+    times = [START, START + 1.5, START + 49 * DAY, START + 49 * DAY + 0.25, START + 120 * DAY]
+    writer = CaptureWriter(path, START)
+    for i, t in enumerate(times):
+        writer.write(f"$GPRMC,{i}\r\n".encode(), t)
+    writer.close()
+    records = list(read_capture(path))
+    assert [data for _, data in records] == [f"$GPRMC,{i}\r\n".encode() for i in range(len(times))]
+    assert [t for t, _ in records] == pytest.approx(times, abs=0.001)
+
+
+def test_replay_to_end(tmp_path):
+    path = tmp_path / "short.smscap"
+    writer = CaptureWriter(path, START)
+    writer.write(b"$GPGSV,1\r\n", START)
+    writer.close()
+    ser = ReplaySerial(path)
+    assert ser.readline() == b"$GPGSV,1\r\n"
+    with pytest.raises(EOFError):
+        ser.readline()
+
+
+@pytest.mark.parametrize("content, error", [
+    (None, OSError),
+    (b"$GPRMC,plain text\r\n", OSError),
+    (gzip.compress(b"$GPRMC,gzip but not a capture\r\n"), ValueError),
+    (gzip.compress(MAGIC + b"\x00\x01"), ValueError),
+    (gzip.compress(b""), ValueError),
+], ids=["missing", "not_gzip", "no_magic", "short_header", "empty"])
+def test_bad_capture_is_reported_when_opened(tmp_path, content, error):
+    path = tmp_path / "bad.smscap"
+    if content is not None:
+        path.write_bytes(content)
+    with pytest.raises(error):
+        ReplaySerial(path)
@@ -0,0 +1,63 @@
+"""
+Registro degli eventi di sms_events: righe START ed END di un evento concluso
+e riga END scritta alla chiusura se l'acquisizione termina durante un evento.
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+from sms_events import EventDetector, EventLog
+
+DATE = "171123"
+
+
+def minute(m):
+    return f"231117{10 + m // 60:02d}{m % 60:02d}"
+
+
+def feed(log, s4c_by_minute):
+    for m, values in enumerate(s4c_by_minute):
+        log.update(minute(m), DATE, [(prn, 100 + prn, 40 + prn, s4c) for prn, s4c in values])
+
+
+QUIET = [(1, 0.1), (2, 0.1), (3, 0.1)]
+STRONG = [(1, 0.7), (2, 0.6), (3, 0.1)]
+PEAK = [(1, 0.9), (2, 0.6), (3, 0.55)]
+
+
+def records(tmp_path):
+    return [line.split(",") for line in (tmp_path / f"sms_PROVA_events_{DATE}.csv").read_text().splitlines()]
+
+
+def test_event_start_and_end(tmp_path, capsys):
+    log = EventLog(tmp_path, "PROVA", EventDetector(min_minutes=2))
+    feed(log, [QUIET, STRONG, PEAK, STRONG, QUIET, QUIET])
+    log.close()
+    start, end = records(tmp_path)
+    assert start == [minute(2), "START", minute(1), "2", "3", "1 2 3", "0.9", "1", "101", "41"]
+    assert end == [minute(3), "END", minute(1), "3", "3", "1 2 3", "0.9", "1", "101", "41"]
+    out = capsys.readouterr().out
+    assert f"Inizio evento di scintillazione alle {minute(1)}: 3 satelliti (1 2 3), s4c massimo 0.9 (sat 1)" in out
+    assert f"Fine evento di scintillazione alle {minute(3)}: durata 3 min, satelliti 1 2 3, s4c massimo 0.9 " \
+           f"(sat 1)" in out
+
+
+def test_open_event_is_ended_on_close(tmp_path):
+    log = EventLog(tmp_path, "PROVA", EventDetector(min_minutes=2))
+    feed(log, [QUIET, STRONG, STRONG, PEAK])
+    log.close()
+    start, end = records(tmp_path)
+    assert start[1] == "START"
+    assert end == [minute(3), "END", minute(1), "3", "3", "1 2 3", "0.9", "1", "101", "41"]
+
+
+def test_close_without_event(tmp_path):
+    log = EventLog(tmp_path, "PROVA", EventDetector(min_minutes=2))
+    feed(log, [QUIET, STRONG, QUIET])
+    log.close()
+    assert not list(tmp_path.iterdir())
+    # chiusura senza nessun minuto elaborato
+    EventLog(tmp_path, "PROVA", EventDetector()).close()
+    assert not list(tmp_path.iterdir())
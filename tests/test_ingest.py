@@ -0,0 +1,122 @@
+"""
+Archivio del server di raccolta sms_ingest: deduplicazione per (stazione,
+minuto, PRN), suddivisione delle righe nei file giornalieri come nella console,
+righe non valide scartate senza perdere le altre del lotto e richieste HTTP con
+lunghezze non valide o troppo grandi.
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import gzip
+import http.client
+import json
+import threading
+
+import pytest
+
+import sms_ingest
+
+STATION = "PROVA"
+
+
+@pytest.fixture
+def store(tmp_path):
+    return sms_ingest.IngestStore(tmp_path / "store")
+
+
+@pytest.fixture
+def server(store):
+    srv = sms_ingest.IngestServer(("127.0.0.1", 0), store)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def rows(minutes, prns):
+    return [f"{minute},{prn},{prn * 10}.0,{40 + prn}.0,35.5,0.{prn:02d}" for minute in minutes for prn in prns]
+
+
+def batch(lines):
+    return "".join(line + "\n" for line in lines).encode()
+
+
+def day_lines(store, date):
+    path = store.directory / STATION / f"gps_{STATION}_{date}.csv"
+    return path.read_text().splitlines()
+
+
+def post(server, body, headers):
+    conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=5)
+    try:
+        conn.putrequest("POST", f"/v1/stations/{STATION}/minutes")
+        for name, value in headers.items():
+            conn.putheader(name, value)
+        conn.endheaders()
+        if body:
+            conn.send(body)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def test_repeated_and_overlapping_batches_are_stored_once(store):
+    first = rows([2311172356, 2311172357, 2311172358], range(1, 9))
+    overlap = rows([2311172358, 2311172359], range(1, 9)) + rows([2311172358], range(9, 12))
+    assert store.ingest(STATION, batch(first)) == (len(first), 0, 0)
+    assert store.ingest(STATION, batch(first)) == (0, len(first), 0)
+    assert store.ingest(STATION, batch(overlap)) == (8 + 3, 8, 0)
+
+    # le righe fino alle 23:58 vanno nel file del 17, quelle delle 23:59 nel file del giorno dopo
+    day17 = day_lines(store, "171123")
+    day18 = day_lines(store, "181123")
+    assert sorted(day17) == sorted(first + rows([2311172358], range(9, 12)))
+    assert sorted(day18) == sorted(rows([2311172359], range(1, 9)))
+    assert len(day17) == len(set(day17))
+
+
+def test_old_duplicates_are_found_on_disk(store):
+    # dopo più di RECENT_MINUTES minuti le chiavi dei minuti vecchi vanno rilette dal file
+    minutes = [2311171000 + m for m in range(sms_ingest.RECENT_MINUTES + 10)]
+    store.ingest(STATION, batch(rows(minutes, range(1, 4))))
+    fresh = sms_ingest.IngestStore(store.directory)
+    assert fresh.ingest(STATION, batch(rows(minutes[:2], range(1, 5)))) == (2, 6, 0)
+    assert len(day_lines(fresh, "171123")) == len(minutes) * 3 + 2
+
+
+def test_impossible_date_is_rejected_without_losing_the_batch(store):
+    good = rows([2311172355], range(1, 5))
+    bad = ["2313172358,1,1.0,1.0,1.0,1.0", "2302302358,2,1.0,1.0,1.0,1.0"]
+    assert store.ingest(STATION, batch(good[:2] + bad + good[2:])) == (4, 0, 2)
+    assert day_lines(store, "171123") == good
+    assert store.stats()["rejected"] == 2
+
+
+def test_http_batch_with_bad_rows(server, store):
+    good = rows([2311172355], range(1, 5))
+    body = gzip.compress(batch(good + ["2313172358,1,1.0,1.0,1.0,1.0"]))
+    status, reply = post(server, body, {"Content-Length": str(len(body)), "Content-Encoding": "gzip"})
+    assert status == 200
+    assert reply == {"accepted": 4, "duplicates": 0, "rejected": 1}
+    assert day_lines(store, "171123") == good
+
+
+@pytest.mark.parametrize("length, status", [(None, 411), ("-5", 400), ("abc", 400), ("1e3", 400),
+                                            (str(sms_ingest.MAX_BODY + 1), 413)])
+def test_http_bad_content_length(server, store, length, status):
+    headers = {} if length is None else {"Content-Length": length}
+    assert post(server, b"", headers)[0] == status
+    assert store.stats()["requests"] == 0
+
+
+def test_http_decompressed_batch_too_large(server, store, monkeypatch):
+    monkeypatch.setattr(sms_ingest, "MAX_ROWS_BYTES", 1000)
+    body = gzip.compress(batch(rows([2311172355 + m for m in range(4)], range(1, 33))))
+    status, reply = post(server, body, {"Content-Length": str(len(body)), "Content-Encoding": "gzip"})
+    assert status == 413
+    assert store.stats()["requests"] == 0
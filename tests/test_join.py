@@ -0,0 +1,62 @@
+"""
+Unione delle stazioni di sms_join: delle righe di una stazione con lo stesso
+(minuto, PRN) viene tenuta la prima letta, e le altre vengono contate e
+segnalate una sola volta anche quando i blocchi si sovrappongono.
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+import sms_join
+import sms_synth
+
+FIRST_DAY = sms_synth.parse_start(sms_synth.DEFAULT_START) // 86400
+
+
+def frame(rows):
+    return pd.DataFrame({'timestamp': pd.to_datetime([r[0] for r in rows], format='%y%m%d%H%M'),
+                         'idsat': np.array([r[1] for r in rows], dtype=np.uint8),
+                         's4c': [r[2] for r in rows]})
+
+
+def test_duplicates_keep_the_first_row():
+    a = frame([("2311171000", 1, 0.1), ("2311171000", 2, 0.2), ("2311171000", 1, 0.9), ("2311171001", 1, 0.3),
+               ("2311171000", 1, 0.8)])
+    b = frame([("2311171000", 1, 0.5), ("2311171001", 2, 0.6)])
+    keys, values, duplicates = sms_join.join_stations([a, b], ['s4c'])
+    wide = sms_join.wide_frame(keys, values, ["A", "B"])
+    assert wide['idsat'].tolist() == [1, 2, 1, 2]
+    np.testing.assert_array_equal(wide['s4c_A'], [0.1, 0.2, 0.3, np.nan])
+    np.testing.assert_array_equal(wide['s4c_B'], [0.5, np.nan, np.nan, 0.6])
+    assert len(duplicates[0]) == 2 and set(duplicates[0]) == {keys[0]}
+    assert len(duplicates[1]) == 0
+
+
+def test_main_reports_duplicates_once(tmp_path, monkeypatch, capsys):
+    sky = sms_synth.SkyModel(6)
+    paths = {name: sms_synth.write_csv_days(tmp_path / name, name, FIRST_DAY, 2, sky, seed)
+             for seed, name in enumerate(("NORD", "SUD"))}
+    # la stazione NORD ha tre righe del 17 ripetute (con valori diversi) in fondo al file
+    path = paths["NORD"][0]
+    lines = path.read_text().splitlines()
+    repeated = [",".join(line.split(",")[:5] + ["9.99"]) for line in lines[100:103]]
+    path.write_text("\n".join(lines + repeated) + "\n")
+
+    out = tmp_path / "joined"
+    monkeypatch.setattr(sys, "argv", ["sms_join.py", str(tmp_path / "NORD"), str(tmp_path / "SUD"), "--output",
+                                      str(out), "--columns", "s4c", "--corr", "--window", "30", "--max_lag", "3"])
+    sms_join.main()
+    printed = capsys.readouterr().out
+    assert "Attenzione: 3 righe duplicate (stesso minuto e PRN) della stazione NORD" in printed
+    assert "Righe duplicate ignorate: 3" in printed
+
+    joined = pd.read_csv(f"{out}.csv", dtype={'timestamp': str})
+    assert not joined.duplicated(['timestamp', 'idsat']).any()
+    assert (joined['s4c_NORD'] != 9.99).all()
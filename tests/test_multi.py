@@ -0,0 +1,111 @@
+"""
+sms_multi deve scrivere per ogni stazione gli stessi file CSV di una
+gps_sms_console.py dedicata, sia rileggendo catture sia leggendo da pty.
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from conftest import CONSOLE
+
+import sms_multi
+import sms_synth
+from gps_sms_console import Station, open_serial, parse_cutoff_interval
+from sms_capture import read_capture
+
+START = "2023-11-17 23:56:20"
+STATIONS = (("NORD", 1, "315-45", "20-80"), ("SUD", 2, "100-260", "10-90"))
+
+
+def make_capture(path, seed, minutes=5):
+    start = sms_synth.parse_start(START)
+    sky = sms_synth.SkyModel(sms_synth.DEFAULT_SATS, seed)
+    sms_synth.write_nmea(path, sms_synth.nmea_stream(start, minutes * 60, sky, 1, seed), start)
+    return path
+
+
+def console_reference(tmp_path, name, capture, azimuth, elevation):
+    out = tmp_path / f"console_{name}"
+    out.mkdir()
+    subprocess.run([sys.executable, "gps_sms_console.py", name, "x", azimuth, elevation, "--replay", str(capture),
+                    "--silent", "--csv_path", str(out)], cwd=CONSOLE, check=True, capture_output=True)
+    return out
+
+
+def csv_files(directory):
+    return {p.name: p.read_bytes() for p in sorted(directory.glob("gps_*.csv"))}
+
+
+@pytest.fixture
+def captures(tmp_path):
+    return {name: make_capture(tmp_path / f"{name}.smscap", seed) for name, seed, _, _ in STATIONS}
+
+
+def test_replay_matches_console(tmp_path, captures):
+    out = tmp_path / "multi"
+    out.mkdir()
+    args = [sys.executable, "sms_multi.py", "--replay", "--silent", "--csv_path", str(out)]
+    for name, _, azimuth, elevation in STATIONS:
+        args += ["--station", name, str(captures[name]), azimuth, elevation]
+    subprocess.run(args, cwd=CONSOLE, check=True, capture_output=True)
+
+    written = csv_files(out)
+    for name, _, azimuth, elevation in STATIONS:
+        expected = csv_files(console_reference(tmp_path, name, captures[name], azimuth, elevation))
+        assert expected
+        assert {k: v for k, v in written.items() if k.startswith(f"gps_{name}_")} == expected
+
+
+def feed_pty(master, ser, capture):
+    """
+    Scrive le righe della cattura sul lato master e lo chiude quando la porta le ha lette tutte.
+    """
+    for _, line in read_capture(capture):
+        os.write(master, line)
+    deadline = time.monotonic() + 10
+    while ser.in_waiting and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    os.close(master)
+
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="servono gli pseudo-terminali")
+def test_pty_ports_match_console(tmp_path, captures):
+    out = tmp_path / "multi_pty"
+    out.mkdir()
+    stations, ports, writers = [], [], []
+    for name, _, azimuth, elevation in STATIONS:
+        master, slave = os.openpty()
+        ser = open_serial(os.ttyname(slave), timeout=0)
+        os.close(slave)
+        stations.append(Station(name, str(out), parse_cutoff_interval(azimuth, 360),
+                                parse_cutoff_interval(elevation, 90), silent=True))
+        ports.append(ser)
+        writers.append(threading.Thread(target=feed_pty, args=(master, ser, captures[name]), daemon=True))
+
+    for writer in writers:
+        writer.start()
+    # le due porte vengono lette insieme dallo stesso event loop; la chiusura del master termina la lettura
+    asyncio.run(asyncio.wait_for(sms_multi.acquire(stations, ports, threaded=False), 60))
+    for writer in writers:
+        writer.join()
+    for station, ser in zip(stations, ports):
+        station.close()
+        ser.close()
+
+    written = csv_files(out)
+    for name, _, azimuth, elevation in STATIONS:
+        expected = csv_files(console_reference(tmp_path, name, captures[name], azimuth, elevation))
+        assert expected
+        assert {k: v for k, v in written.items() if k.startswith(f"gps_{name}_")} == expected
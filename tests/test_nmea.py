@@ -0,0 +1,105 @@
+"""
+Decodifica di sms_nmea.parse_sentence(): frasi con checksum errato, righe in
+cui una frase spezzata è seguita da una nuova frase dopo un altro '$', frasi
+troncate e caratteri spuri vengono scartati (e contati) senza eccezioni.
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import pytest
+
+from gps_sms_console import banner_coordinate
+from sms_nmea import Gsv, NmeaCounters, Rmc, checksum, parse_sentence
+
+
+def nmea(payload):
+    return b"$" + payload + b"*%02X\r\n" % checksum(payload)
+
+
+RMC = nmea(b"GPRMC,123519.00,A,4530.12345,N,00912.34567,W,0.012,,181023,,,A")
+GSV = nmea(b"GPGSV,3,1,12,01,40,083,46,02,17,308,41,12,07,344,,14,22,228,45")
+
+
+def test_valid_sentences():
+    counters = NmeaCounters()
+    rmc = parse_sentence(RMC, counters)
+    assert type(rmc) is Rmc
+    assert (rmc.time, rmc.status, rmc.date) == ("123519.00", "A", "181023")
+    assert rmc.lat == pytest.approx(45 + 30.12345 / 60)
+    assert rmc.lon == pytest.approx(-(9 + 12.34567 / 60))
+    gsv = parse_sentence(memoryview(GSV), counters)
+    assert type(gsv) is Gsv
+    assert (gsv.total, gsv.index, gsv.in_view) == (3, 1, 12)
+    assert gsv.sats == ((1, 40, 83, 46), (2, 17, 308, 41), (12, 7, 344, 0), (14, 22, 228, 45))
+    assert counters.types == {b"RMC": 1, b"GSV": 1}
+
+
+@pytest.mark.parametrize("line", [
+    RMC.replace(b"4530", b"4531"),
+    RMC[:-4] + b"%02X\r\n" % ((int(RMC[-4:-2], 16) + 1) % 256),
+    RMC[:-4] + b"ZZ\r\n",
+], ids=["payload", "digits", "not_hex"])
+def test_checksum_rejected(line):
+    counters = NmeaCounters()
+    assert parse_sentence(line, counters) is None
+    assert counters.checksum_errors == 1
+    assert counters.types == {}
+
+
+def test_lowercase_checksum_accepted():
+    assert type(parse_sentence(RMC[:-4] + RMC[-4:-2].lower() + b"\r\n")) is Rmc
+
+
+@pytest.mark.parametrize("prefix", [
+    b"$GPGSV,3,2,12,05,1",
+    b"\x00\xff\xfe garbage $GP",
+    GSV[:25] + b"$",
+    b"$GPRMC,123518.00,A,45*7",
+])
+def test_resync_on_last_dollar(prefix):
+    # la frase interrotta viene persa, quella che segue nella stessa riga no
+    counters = NmeaCounters()
+    assert parse_sentence(prefix + RMC, counters) == parse_sentence(RMC)
+    assert counters.types == {b"RMC": 1}
+    assert counters.checksum_errors == counters.incomplete == counters.malformed == 0
+
+
+@pytest.mark.parametrize("line, counter", [
+    (RMC[:30], "incomplete"),
+    (RMC[:-5] + b"\r\n", "incomplete"),
+    (RMC[:-3], "checksum_errors"),
+    (RMC[:-4], "checksum_errors"),
+    (b"GPRMC,123519.00,A,4530\r\n", "incomplete"),
+    (nmea(b"GPRMC,123519.00,A"), "malformed"),
+    (nmea(b"GPGSV,3,x,12"), "malformed"),
+    (nmea(b"GPRMC,12\xe85\xe9,A,,,,,,,181023"), "malformed"),
+    (nmea(b"G\x01\x02\x03"), "malformed"),
+], ids=["cut", "no_checksum", "one_digit", "no_digits", "no_dollar", "few_fields", "bad_number", "non_ascii",
+        "bad_type"])
+def test_truncated_or_broken(line, counter):
+    counters = NmeaCounters()
+    assert parse_sentence(line, counters) is None
+    assert getattr(counters, counter) == 1
+    assert counters.checksum_errors + counters.incomplete + counters.malformed == 1
+
+
+def test_timeout_is_not_counted():
+    counters = NmeaCounters()
+    assert parse_sentence(b"", counters) is None
+    assert counters.incomplete == 0
+
+
+def test_unhandled_sentence_counted_by_type():
+    counters = NmeaCounters()
+    assert parse_sentence(nmea(b"GPVTG,,T,,M,0.012,N,0.022,K,A"), counters) is None
+    assert counters.types == {b"VTG": 1}
+
+
+def test_banner_coordinates():
+    # stesso formato della console originale: int(ddmm.mmmm) / 100 ed emisfero
+    rmc = parse_sentence(RMC)
+    assert banner_coordinate(rmc.lat, "N", "S") == "45.3 N"
+    assert banner_coordinate(rmc.lon, "E", "W") == "9.12 W"
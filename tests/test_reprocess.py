@@ -0,0 +1,92 @@
+"""
+sms_reprocess deve scrivere gli stessi file CSV della console (Station) per le
+catture di sms_synth, compreso l'ultimo minuto quando la cattura termina con la
+frase RMC che lo chiude.
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import numpy as np
+import pytest
+
+import sms_reprocess
+import sms_synth
+from gps_sms_console import Station, parse_cutoff_interval
+from sms_capture import CaptureWriter, read_capture
+from sms_nmea import parse_sentence
+
+START = "2023-11-17 23:55:20"
+
+
+def make_capture(path, seed, minutes=6, until_rmc=False):
+    """
+    Cattura di sms_synth; con until_rmc termina con la RMC del secondo 00 dopo
+    l'ultimo minuto, senza le frasi GSV che la seguono.
+    """
+    start = sms_synth.parse_start(START)
+    stream = list(sms_synth.nmea_stream(start, minutes * 60 + 1, sms_synth.SkyModel(sms_synth.DEFAULT_SATS, seed),
+                                        1, seed))
+    if until_rmc:
+        last = max(n for n, (_, line) in enumerate(stream) if line.startswith(b"$GPRMC,") and line[11:13] == b"00")
+        stream = stream[:last + 1]
+    writer = CaptureWriter(path, start)
+    for t, line in stream:
+        writer.write(line, t)
+    writer.close()
+    return path
+
+
+def station_files(tmp_path, capture, azimuth, elevation):
+    out = tmp_path / "console"
+    out.mkdir()
+    station = Station("PROVA", str(out), parse_cutoff_interval(azimuth, 360), parse_cutoff_interval(elevation, 90),
+                      silent=True)
+    for _, line in read_capture(capture):
+        station.feed(parse_sentence(line))
+    station.close()
+    return {p.name: p.read_text() for p in sorted(out.glob("gps_*.csv"))}
+
+
+def reprocess_files(tmp_path, paths, azimuth, elevation):
+    out = tmp_path / "reprocess"
+    out.mkdir()
+    samples = sms_reprocess.load_samples(paths)
+    cutoff = parse_cutoff_interval(azimuth, 360) + parse_cutoff_interval(elevation, 90)
+    result = sms_reprocess.compute_windows(samples, cutoff)
+    sms_reprocess.write_csv(result, "PROVA", out)
+    return {p.name: p.read_text() for p in sorted(out.glob("gps_*.csv"))}
+
+
+@pytest.mark.parametrize("seed, azimuth, elevation", [(1, None, None), (2, "315-45", "20-80"), (3, "100-260", None)])
+@pytest.mark.parametrize("until_rmc", [False, True])
+def test_matches_console(tmp_path, seed, azimuth, elevation, until_rmc):
+    capture = make_capture(tmp_path / "cattura.smscap", seed, until_rmc=until_rmc)
+    expected = station_files(tmp_path, capture, azimuth, elevation)
+    rows = sum(text.count("\n") for text in expected.values())
+    assert rows > 0
+    assert reprocess_files(tmp_path, [capture], azimuth, elevation) == expected
+
+
+def test_last_minute_closed_by_rmc(tmp_path):
+    capture = make_capture(tmp_path / "cattura.smscap", 1, until_rmc=True)
+    files = reprocess_files(tmp_path, [capture], None, None)
+    # la cattura termina alle 00:01:00: l'ultimo minuto scritto è 00:00, nel file del 18
+    assert files["gps_PROVA_181123.csv"].splitlines()[-1].startswith("2311180000,")
+
+
+def test_saved_samples_keep_the_end(tmp_path):
+    capture = make_capture(tmp_path / "cattura.smscap", 1, until_rmc=True)
+    samples = sms_reprocess.load_samples([capture])
+    sms_reprocess.save_samples(tmp_path / "campioni.npz", samples)
+    again = sms_reprocess.load_samples([tmp_path / "campioni.npz"])
+    assert again[sms_reprocess.END_FIELD][0] == samples[sms_reprocess.END_FIELD][0] > samples["t"][-1]
+    expected = station_files(tmp_path, capture, None, None)
+    assert reprocess_files(tmp_path, [tmp_path / "campioni.npz"], None, None) == expected
+
+    # senza t_end (file .npz precedenti) l'ultima finestra si chiude all'ultimo campione
+    np.savez_compressed(tmp_path / "vecchio.npz", **{k: samples[k] for k in sms_reprocess.SAMPLE_FIELDS})
+    old = sms_reprocess.load_samples([tmp_path / "vecchio.npz"])
+    assert old[sms_reprocess.END_FIELD][0] == samples["t"][-1]
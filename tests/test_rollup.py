@@ -0,0 +1,61 @@
+"""
+Riepiloghi di sms_rollup: se non si possono salvare accanto ai dati (archivio
+in sola lettura) vengono calcolati in memoria con gli stessi valori, e
+plot_my_sky10 usa i dati al minuto se non si chiede un'altra risoluzione.
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+import sms_rollup
+import sms_synth
+
+FIRST_DAY = sms_synth.parse_start(sms_synth.DEFAULT_START) // 86400
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return sms_synth.write_csv_days(tmp_path, "PROVA", FIRST_DAY, 2, sms_synth.SkyModel(6))
+
+
+@pytest.mark.parametrize("resolution", ["hour", "day"])
+def test_unwritable_archive_uses_memory(paths, monkeypatch, resolution):
+    def refuse(src, dst):
+        raise PermissionError(13, "Permission denied", str(dst))
+
+    with monkeypatch.context() as m:
+        m.setattr(os, "replace", refuse)
+        in_memory = sms_rollup.load_rollup(paths, resolution)
+    assert not list(paths[0].parent.glob("*.rollup.csv"))
+    assert not list(paths[0].parent.glob("*.tmp"))
+
+    saved = sms_rollup.load_rollup(paths, resolution)
+    assert all(sms_rollup.is_current(p) for p in paths)
+    from_files = sms_rollup.load_rollup(paths, resolution)
+    assert not in_memory.empty
+    pd.testing.assert_frame_equal(in_memory, saved)
+    pd.testing.assert_frame_equal(in_memory, from_files)
+
+
+def test_plot_resolution_defaults_to_minute(monkeypatch):
+    import plot_my_sky10
+    seen = {}
+
+    def stop(paths, *args):
+        seen['resolution'] = args[-1]
+        return None
+
+    monkeypatch.setattr(plot_my_sky10, "select_files", lambda *args: ["gps_PROVA_171123.csv"])
+    monkeypatch.setattr(plot_my_sky10, "load_and_filter", stop)
+    for argv, expected in ((["--hours", "720"], "minute"), (["--hours", "720", "--resolution", "auto"], "hour")):
+        monkeypatch.setattr(sys, "argv", ["plot_my_sky10.py", "gps_PROVA_171123.csv"] + argv)
+        plot_my_sky10.main()
+        assert seen['resolution'] == expected
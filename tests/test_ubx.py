@@ -0,0 +1,106 @@
+"""
+Configurazione del ricevitore con sms_ubx.configure() sul ricevitore simulato
+di sms_fakegps, collegato attraverso uno pseudo-terminale: messaggi accettati
+(ACK), rifiutati (NAK), senza risposta e cambio di velocità non riuscito, con
+la porta riportata alla velocità di partenza.
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import os
+
+import pytest
+
+from gps_sms_console import open_serial
+from sms_fakegps import FakeReceiver
+from sms_synth import SkyModel
+from sms_ubx import CFG_PRT, CLS_CFG, PORT_USB, UbxError, configure
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "openpty"), reason="servono gli pseudo-terminali")
+
+
+class StuckReceiver(FakeReceiver):
+    """
+    Ricevitore che conferma CFG-PRT ma resta alla velocità di prima.
+    """
+
+    def handle(self, f):
+        if f.cls == CLS_CFG and f.msg_id == CFG_PRT and len(f.payload) == 20:
+            self.ack(f)
+            return
+        super().handle(f)
+
+
+@pytest.fixture
+def connect():
+    """
+    connect(**opzioni) avvia un ricevitore simulato e apre la porta dal lato della console.
+    """
+    opened = []
+
+    def start(cls=FakeReceiver, **options):
+        receiver = cls(SkyModel(), log=lambda text: None, **options)
+        receiver.start()
+        ser = open_serial(receiver.name, receiver.baudrate, timeout=0.05)
+        opened.append((receiver, ser))
+        return receiver, ser
+
+    yield start
+    for receiver, ser in opened:
+        ser.close()
+        receiver.close()
+
+
+def test_rate_and_baudrate_acknowledged(connect):
+    receiver, ser = connect(rate=1, baudrate=9600)
+    messages = []
+    configure(ser, rate=10, baudrate=115200, log=messages.append)
+    assert receiver.rate == 10
+    assert receiver.baudrate == 115200
+    assert ser.baudrate == 115200
+    assert "Velocità della porta: 9600 -> 115200 baud" in messages
+    assert "Frequenza di navigazione: 10 Hz" in messages
+    # le frasi non usate dalla console sono state disabilitate
+    assert receiver.sentences == {"RMC", "GGA", "GSV"}
+
+
+def test_rate_rejected(connect):
+    receiver, ser = connect(max_rate=5)
+    with pytest.raises(UbxError, match="rifiutato"):
+        configure(ser, rate=10, log=lambda text: None)
+    assert receiver.rate == 1
+
+
+def test_no_answer():
+    master, slave = os.openpty()
+    ser = open_serial(os.ttyname(slave), timeout=0.05)
+    try:
+        with pytest.raises(UbxError, match="nessuna risposta"):
+            configure(ser, rate=10, log=lambda text: None)
+    finally:
+        ser.close()
+        os.close(master)
+        os.close(slave)
+
+
+def test_baudrate_fallback(connect):
+    receiver, ser = connect(cls=StuckReceiver, baudrate=9600)
+    with pytest.raises(UbxError, match="riportata a 9600 baud"):
+        configure(ser, baudrate=115200, disable=(), log=lambda text: None)
+    assert receiver.baudrate == 9600
+    assert ser.baudrate == 9600
+    # alla velocità di partenza il ricevitore risponde ancora
+    configure(ser, rate=5, disable=(), log=lambda text: None)
+    assert receiver.rate == 5
+
+
+def test_usb_keeps_baudrate(connect):
+    receiver, ser = connect(port_id=PORT_USB, baudrate=9600)
+    messages = []
+    configure(ser, rate=10, baudrate=115200, disable=(), log=messages.append)
+    assert ser.baudrate == 9600
+    assert receiver.rate == 10
+    assert "Ricevitore collegato via USB: la velocità della porta non viene cambiata" in messages
@@ -0,0 +1,133 @@
+"""
+Invio con sms_uploader al server di raccolta sms_ingest, avviato in un thread:
+con connessioni keep-alive chiuse dal server, richieste perse prima o dopo la
+registrazione (quindi ripetute) e risposte in ritardo nessuna riga deve andare
+persa o comparire due volte nell'archivio.
+
+Copyright (C) 2024 Thomas Mazzi, Giuseppe Massimo Bertani
+
+This program is distributed under the GNU General Public License version 3.0.
+For more information, see the LICENSE file or visit https://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import sms_ingest
+import sms_uploader
+
+STATION = "PROVA"
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """
+    Avvia un server di raccolta; server.configure(drop, delay) ne cambia l'affidabilità.
+    """
+    monkeypatch.setattr(sms_uploader, "BACKOFF_MIN", 0.01)
+    monkeypatch.setattr(sms_uploader, "BACKOFF_MAX", 0.05)
+    store = sms_ingest.IngestStore(tmp_path / "store")
+    srv = sms_ingest.IngestServer(("127.0.0.1", 0), store)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    srv.url = f"http://127.0.0.1:{srv.server_address[1]}"
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def minute_rows(first, count, sats=8):
+    """
+    Righe di count minuti consecutivi nel formato della console.
+    """
+    t0 = datetime(2023, 11, 17, 23, 50)
+    rows = []
+    for m in range(first, first + count):
+        stamp = (t0 + timedelta(minutes=m)).strftime("%y%m%d%H%M")
+        rows.append([f"{stamp},{prn},{prn * 10}.0,{40 + prn}.0,{30 + m % 7}.5,0.{prn:02d}\n" for prn in range(1, sats + 1)])
+    return rows
+
+
+def stored_rows(tmp_path):
+    rows = []
+    for path in sorted((tmp_path / "store" / STATION).glob("gps_*.csv")):
+        rows.extend(line + "\n" for line in path.read_text().splitlines())
+    return rows
+
+
+def wait_sent(uploader, timeout=30):
+    deadline = time.monotonic() + timeout
+    while uploader.stats()["pending"] and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert uploader.stats()["pending"] == 0
+
+
+def assert_archive(tmp_path, minutes):
+    expected = [row for rows in minutes for row in rows]
+    stored = stored_rows(tmp_path)
+    assert len(stored) == len(set(stored)), "righe duplicate nell'archivio"
+    assert sorted(stored) == sorted(expected), "righe perse o estranee nell'archivio"
+
+
+def test_idle_keepalive_connection_is_reopened(tmp_path, server, monkeypatch):
+    # il server chiude le connessioni inattive dopo 0.2 s invece di 30
+    monkeypatch.setattr(sms_ingest.IngestHandler, "timeout", 0.2)
+    uploader = sms_uploader.Uploader(server.url, STATION, tmp_path / "spool", batch_rows=8, max_age=60)
+    minutes = minute_rows(0, 3)
+    try:
+        for rows in minutes:
+            uploader.enqueue(rows)
+            wait_sent(uploader)
+            # la connessione resta aperta dal lato della stazione ma il server l'ha già chiusa
+            time.sleep(0.5)
+        stats = uploader.stats()
+    finally:
+        uploader.close()
+    assert stats["failures"] == 0
+    assert stats["batches"] == 3
+    assert_archive(tmp_path, minutes)
+
+
+def test_unreliable_server_loses_and_duplicates_nothing(tmp_path, server):
+    random.seed(1)
+    server.drop = 0.3
+    server.delay = 0.02
+    uploader = sms_uploader.Uploader(server.url, STATION, tmp_path / "spool", batch_rows=40, max_age=0.05)
+    minutes = minute_rows(0, 30)
+    try:
+        for rows in minutes:
+            uploader.enqueue(rows)
+        wait_sent(uploader, 60)
+        stats = uploader.stats()
+    finally:
+        uploader.close()
+    # qualche invio deve essere fallito ed essere stato ripetuto
+    assert stats["failures"] > 0
+    assert server.store.stats()["duplicates"] > 0
+    assert_archive(tmp_path, minutes)
+
+
+def test_spool_survives_restart(tmp_path, server):
+    # prima sessione senza server raggiungibile: le righe restano nella coda su disco
+    uploader = sms_uploader.Uploader("http://127.0.0.1:9", STATION, tmp_path / "spool", batch_rows=1000,
+                                     max_age=3600)
+    minutes = minute_rows(0, 5)
+    for rows in minutes:
+        uploader.enqueue(rows)
+    uploader.close()
+    assert not stored_rows(tmp_path)
+
+    # la sessione successiva invia le righe rimaste e quelle nuove
+    uploader = sms_uploader.Uploader(server.url, STATION, tmp_path / "spool", batch_rows=1000, max_age=0.05)
+    more = minute_rows(5, 5)
+    try:
+        for rows in more:
+            uploader.enqueue(rows)
+        wait_sent(uploader)
+    finally:
+        uploader.close()
+    assert_archive(tmp_path, minutes + more)